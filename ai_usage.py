@@ -0,0 +1,192 @@
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+
+
+def file_sha256(path):
+    """Beregner SHA-256 af en fil uden at læse hele filen ind i hukommelsen"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def request_cache_key(model, messages, **options):
+    """Nøgle for et AI-kald: samme model, beskeder og indstillinger giver samme nøgle"""
+    payload = json.dumps({'model': model, 'messages': messages, 'options': options},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class AIUsageLog:
+    """Gemmer tokenforbrug, latenstid og cache for alle AI-kald i en lokal SQLite database.
+
+    Cachen er begrænset til cache_max_entries svar, og svar ældre end cache_max_age_days bruges ikke.
+    """
+
+    def __init__(self, db_path, cache_max_entries=2000, cache_max_age_days=30):
+        self.db_path = db_path
+        self.cache_max_entries = cache_max_entries
+        self.cache_max_age_days = cache_max_age_days
+        self._lock = threading.Lock()
+        self._create_tables()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def _create_tables(self):
+        conn = self._connect()
+        try:
+            conn.executescript('''
+            CREATE TABLE IF NOT EXISTS ai_calls (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at TEXT NOT NULL,
+                purpose TEXT,
+                model TEXT,
+                prompt_tokens INTEGER DEFAULT 0,
+                completion_tokens INTEGER DEFAULT 0,
+                latency REAL DEFAULT 0,
+                retries INTEGER DEFAULT 0,
+                cache_hit INTEGER DEFAULT 0,
+                document_hash TEXT,
+                document_name TEXT,
+                page INTEGER,
+                cost REAL DEFAULT 0,
+                baseline_cost REAL DEFAULT 0,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_ai_calls_created_at ON ai_calls(created_at);
+            CREATE INDEX IF NOT EXISTS idx_ai_calls_document ON ai_calls(document_hash);
+            CREATE TABLE IF NOT EXISTS ai_cache (
+                cache_key TEXT PRIMARY KEY,
+                model TEXT,
+                content TEXT,
+                prompt_tokens INTEGER DEFAULT 0,
+                completion_tokens INTEGER DEFAULT 0,
+                created_at TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_ai_cache_created_at ON ai_cache(created_at);
+            ''')
+            # Loggen fra før fejlede kald blev registreret mangler kolonnen
+            columns = [info[1] for info in conn.execute('PRAGMA table_info(ai_calls)')]
+            if 'error' not in columns:
+                conn.execute('ALTER TABLE ai_calls ADD COLUMN error TEXT')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def record_call(self, purpose, model, prompt_tokens, completion_tokens, latency, retries=0,
+                    cache_hit=False, document_hash=None, document_name=None, page=None,
+                    cost=0.0, baseline_cost=0.0, error=None):
+        """Skriver en række i ai_calls. error er fejlbeskeden for et kald der fejlede efter alle forsøg.
+        Fejl logges men afbryder aldrig selve udtrækningen"""
+        try:
+            with self._lock:
+                conn = self._connect()
+                try:
+                    conn.execute('''
+                        INSERT INTO ai_calls (created_at, purpose, model, prompt_tokens, completion_tokens,
+                                              latency, retries, cache_hit, document_hash, document_name,
+                                              page, cost, baseline_cost, error)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', (datetime.now().isoformat(timespec='seconds'), purpose, model, prompt_tokens,
+                          completion_tokens, latency, retries, int(cache_hit), document_hash,
+                          document_name, page, cost, baseline_cost, error))
+                    conn.commit()
+                finally:
+                    conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Kunne ikke gemme AI-kald i forbrugsloggen: {e}")
+
+    def _cache_cutoff(self):
+        return (datetime.now() - timedelta(days=self.cache_max_age_days)).isoformat(timespec='seconds')
+
+    def has_document(self, document_hash):
+        """Sand hvis dokumentet er sendt til AI'en før"""
+        try:
+            conn = self._connect()
+            try:
+                return conn.execute('SELECT 1 FROM ai_calls WHERE document_hash=? LIMIT 1',
+                                    (document_hash,)).fetchone() is not None
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Fejl ved opslag i AI-forbrugsloggen: {e}")
+            return False
+
+    def get_cached(self, cache_key):
+        """Returnerer (content, prompt_tokens, completion_tokens) for en cachet forespørgsel eller None"""
+        try:
+            conn = self._connect()
+            try:
+                return conn.execute(
+                    'SELECT content, prompt_tokens, completion_tokens FROM ai_cache WHERE cache_key=? AND created_at >= ?',
+                    (cache_key, self._cache_cutoff())
+                ).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Fejl ved opslag i AI-cache: {e}")
+            return None
+
+    def store_cached(self, cache_key, model, content, prompt_tokens, completion_tokens):
+        try:
+            with self._lock:
+                conn = self._connect()
+                try:
+                    conn.execute('''
+                        INSERT OR REPLACE INTO ai_cache (cache_key, model, content, prompt_tokens,
+                                                         completion_tokens, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    ''', (cache_key, model, content, prompt_tokens, completion_tokens,
+                          datetime.now().isoformat(timespec='seconds')))
+                    self._prune_cache(conn)
+                    conn.commit()
+                finally:
+                    conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Kunne ikke gemme svar i AI-cache: {e}")
+
+    def _prune_cache(self, conn):
+        """Fjerner udløbne svar og de ældste ud over cache_max_entries"""
+        conn.execute('DELETE FROM ai_cache WHERE created_at < ?', (self._cache_cutoff(),))
+        conn.execute('DELETE FROM ai_cache WHERE cache_key NOT IN '
+                     '(SELECT cache_key FROM ai_cache ORDER BY created_at DESC LIMIT ?)', (self.cache_max_entries,))
+
+    def _summary(self, group_expression, extra_columns=''):
+        conn = self._connect()
+        try:
+            return conn.execute(f'''
+                SELECT {group_expression} AS grp{extra_columns},
+                       COUNT(*),
+                       SUM(cache_hit),
+                       SUM(CASE WHEN cache_hit THEN 0 ELSE prompt_tokens END),
+                       SUM(CASE WHEN cache_hit THEN 0 ELSE completion_tokens END),
+                       AVG(CASE WHEN cache_hit THEN NULL ELSE latency END),
+                       SUM(latency),
+                       SUM(retries),
+                       SUM(CASE WHEN cache_hit THEN 0 ELSE cost END),
+                       SUM(CASE WHEN cache_hit THEN cost ELSE 0 END),
+                       SUM(baseline_cost),
+                       SUM(error IS NOT NULL)
+                FROM ai_calls
+                GROUP BY grp
+                ORDER BY MAX(created_at) DESC
+            ''').fetchall()
+        finally:
+            conn.close()
+
+    def daily_summary(self):
+        """Aggregater pr. dag: dato, kald, cache hits, prompt/completion tokens, gns. latenstid,
+        samlet tid, retries, pris, sparet ved cache, pris hvis alt var kørt på den stærke model og
+        fejlede kald"""
+        return self._summary('substr(created_at, 1, 10)')
+
+    def document_summary(self):
+        """Aggregater pr. dokument: hash, navn, antal sider og samme kolonner som daily_summary"""
+        return self._summary("COALESCE(document_hash, '')",
+                             ', MAX(document_name), COUNT(DISTINCT page)')
@@ -4,11 +4,15 @@ import os
 import shutil
 import logging
 import time
+import uuid
+import multiprocessing
+import requests
 from datetime import datetime
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QPushButton, QFileDialog, QVBoxLayout, QWidget,
                              QProgressBar, QMessageBox, QLineEdit, QTableView, QHBoxLayout,
                              QLabel, QComboBox, QMenu, QAction, QDialog, QFormLayout, QHeaderView,
-                             QStyle, QToolTip, QStatusBar, QStyledItemDelegate, QMenuBar, QScrollArea)
+                             QStyle, QToolTip, QStatusBar, QStyledItemDelegate, QMenuBar, QScrollArea,
+                             QTabWidget)
 from PyQt5.QtCore import (QThread, pyqtSignal, Qt, QSortFilterProxyModel, QDate, QEvent,
                           QStandardPaths, QUrl, QTimer)
 from PyQt5.QtGui import QStandardItemModel, QStandardItem, QColor, QBrush, QIcon, QFontMetrics, QDesktopServices
@@ -18,10 +22,28 @@ import pandas as pd
 import sqlite3
 import config
 from secure_dropbox_auth import SecureDropboxAuth
+from model_router import ModelRouter, estimate_cost
+from ai_usage import AIUsageLog, file_sha256, request_cache_key
+from page_filter import classify_page, record_corpus_label
+from pdf_raster import has_text_layer, render_pages
+from dropbox_transfer import (upload_if_changed, dropbox_content_hash, save_sync_state, download_file_streaming,
+                              SyncConflictError)
+from storage_backend import DropboxBackend, LocalBackend
+from changeset_sync import ChangesetSync
+from db_snapshot import create_snapshot, download_snapshot_streaming
+from expiry_snapshot import publish_expiry_snapshot
+from expiry_buckets import ExpiryBuckets, horizon_bucket, INVALID, EXPIRED, TODAY
+from auto_sync import AutoSyncScheduler, OfflineError, transfer_lock
+from backup_manager import BackupManager
+from undo_journal import UndoJournal, install_undo_journal, record_snapshot_group, reset_journal
+from product_repository import get_repository, PRODUCT_COLUMNS
+from db_writer import release_wal
+from db_worker import DbWorker, EventLoopStallMonitor
+from cell_edit_buffer import CellEditBuffer
 import dropbox
 import warnings
 warnings.filterwarnings("ignore", category=DeprecationWarning)
-from openai import OpenAI
+from openai import OpenAI, APIConnectionError, APITimeoutError, RateLimitError, InternalServerError
 import json
 import PyPDF2
 from dotenv import load_dotenv
@@ -34,6 +56,11 @@ load_dotenv()  # Tilføj denne linje
 logging.info(f"API Key loaded: {'OPENAI_API_KEY' in os.environ}")
 
 
+_model_router = None
+_ai_usage_log = None
+_backup_manager = None
+
+
 def get_app_data_dir():
     data_dir = QStandardPaths.writableLocation(QStandardPaths.AppDataLocation)
     app_data_dir = os.path.join(data_dir, "Sweetspot Data Håndtering")
@@ -41,6 +68,75 @@ def get_app_data_dir():
     return app_data_dir
 
 
+def get_sync_state_path():
+    """Fil med rev og content hash for den senest synkroniserede version i Dropbox"""
+    return os.path.join(get_app_data_dir(), 'dropbox_sync_state.json')
+
+
+def get_device_id():
+    """Stabilt id for denne installation. Gemmes uden for databasen, da databasefilen deles mellem enheder"""
+    device_file = os.path.join(get_app_data_dir(), 'device_id.txt')
+    if os.path.exists(device_file):
+        with open(device_file, 'r', encoding='utf-8') as f:
+            device_id = f.read().strip()
+        if device_id:
+            return device_id
+    device_id = uuid.uuid4().hex[:12]
+    with open(device_file, 'w', encoding='utf-8') as f:
+        f.write(device_id)
+    return device_id
+
+
+def prepare_upload_snapshot(db_path, vacuum_path=None):
+    """Laver et komprimeret snapshot af databasen til upload.
+
+    Et uændret snapshot beholdes som den eksisterende fil, så en afbrudt upload af det
+    stadig kan genoptages efter genstart. Med vacuum_path beholdes den vacuumede kopi snapshottet
+    er lavet af; se create_snapshot.
+    """
+    snapshot_path = os.path.join(get_app_data_dir(), 'products_snapshot.db.gz')
+    new_snapshot_path = snapshot_path + ".new"
+    raw_size, vacuum_size, snapshot_size = create_snapshot(db_path, new_snapshot_path, vacuum_path=vacuum_path)
+    logging.info(f"Snapshot oprettet: {raw_size} bytes rå, {vacuum_size} bytes efter VACUUM, "
+                 f"{snapshot_size} bytes komprimeret")
+    if os.path.exists(snapshot_path) and file_sha256(snapshot_path) == file_sha256(new_snapshot_path):
+        os.remove(new_snapshot_path)
+    else:
+        os.replace(new_snapshot_path, snapshot_path)
+    return snapshot_path
+
+
+def upload_database_snapshot(storage, db_path, progress_callback=None):
+    """Uploader et snapshot af databasen hvis det afviger fra Dropbox-kopien. Kaldes med transfer_lock holdt"""
+    start_time = time.perf_counter()
+    # Udløbs-snapshottet bygges af den samme vacuumede kopi som det uploadede snapshot, så
+    # skrivninger imellem de to ikke giver et dokument med en forkert database_hash
+    vacuum_path = os.path.join(get_app_data_dir(), 'products_snapshot.vacuum.db')
+    try:
+        snapshot_path = prepare_upload_snapshot(db_path, vacuum_path=vacuum_path)
+        uploaded, metadata = upload_if_changed(
+            storage, snapshot_path, config.DROPBOX_SNAPSHOT_PATH, get_sync_state_path(),
+            chunk_size=config.DROPBOX_UPLOAD_CHUNK_SIZE,
+            progress_callback=progress_callback,
+            resume_state_path=os.path.join(get_app_data_dir(), 'upload_session.json')
+        )
+        # Rapporten læser kun det lille udløbs-snapshot, så længe det hører til den uploadede database
+        try:
+            publish_expiry_snapshot(storage, vacuum_path, config.DROPBOX_EXPIRY_SNAPSHOT_PATH,
+                                    os.path.join(get_app_data_dir(), 'expiry_snapshot.json.gz'),
+                                    config.EXPIRY_SNAPSHOT_HORIZON_DAYS, database_hash=metadata.content_hash)
+        except Exception as e:
+            # Uden et matchende udløbs-snapshot henter rapporten blot hele databasen
+            logging.warning(f"Kunne ikke publicere udløbs-snapshot: {e}")
+    finally:
+        if os.path.exists(vacuum_path):
+            os.remove(vacuum_path)
+    logging.info(f"Dropbox-synkronisering: database {os.path.getsize(db_path)} bytes, "
+                 f"{os.path.getsize(snapshot_path) if uploaded else 0} bytes sendt "
+                 f"på {time.perf_counter() - start_time:.2f} sekunder")
+    return uploaded
+
+
 def setup_logging():
     log_dir = get_app_data_dir()
     log_file = os.path.join(log_dir, 'sweetspot.log')
@@ -57,6 +153,30 @@ def setup_logging():
     logging.info("Logging setup completed")
 
 
+def verify_database_file(path):
+    """Kontrollerer at en databasefil er intakt og har products-tabellen.
+
+    Returnerer None hvis filen er gyldig, ellers en beskrivelse af problemet.
+    """
+    try:
+        conn = sqlite3.connect(path)
+        try:
+            result = conn.execute("PRAGMA quick_check").fetchone()
+            if not result or result[0] != 'ok':
+                return f"integritetskontrol fejlede ({result[0] if result else 'intet svar'})"
+            columns = [info[1] for info in conn.execute("PRAGMA table_info(products)").fetchall()]
+            if not columns:
+                return "tabellen 'products' mangler"
+            missing = [col for col in ["Article Description Batch", "Expiry Date"] if col not in columns]
+            if missing:
+                return f"kolonner mangler i 'products': {', '.join(missing)}"
+            return None
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError as e:
+        return f"filen er ikke en gyldig SQLite database ({e})"
+
+
 def resource_path(relative_path):
     try:
         base_path = sys._MEIPASS
@@ -72,6 +192,15 @@ def resource_path(relative_path):
     return os.path.join(base_path, relative_path)
 
 
+# Baggrundsfarve for udløbsdatoen pr. spand: rød for udløbet og ugyldige datoer, orange inden for
+# 14 dage og gul for de længere perioder
+EXPIRY_BUCKET_COLORS = {INVALID: QColor(255, 0, 0, 100), EXPIRED: QColor(255, 0, 0, 100), TODAY: QColor(255, 0, 0, 100)}
+EXPIRY_BUCKET_COLORS.update({
+    horizon_bucket(days): QColor(255, 165, 0, 100) if days <= 14 else QColor(255, 255, 0, 100)
+    for days in config.EXPIRY_HORIZONS
+})
+
+
 class DateSortFilterProxyModel(QSortFilterProxyModel):
     def __init__(self, date_column_index, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -99,41 +228,190 @@ class DateSortFilterProxyModel(QSortFilterProxyModel):
 
 class DropboxSync(QThread):
     status = pyqtSignal(str)
-    finished = pyqtSignal()
+    progress = pyqtSignal(int)
+    error = pyqtSignal(str, str)  # (titel, besked) - vises på GUI-tråden
+    finished = pyqtSignal(str)  # id på backuppen fra før uploaden, eller "" hvis den ikke blev taget
 
-    def __init__(self, local_file_path, dbx_client):
+    def __init__(self, local_file_path, storage):
         super().__init__()
         self.local_file_path = local_file_path
-        self.dbx_client = dbx_client
+        self.storage = storage
+        self.failed = False
 
     def run(self):
+        backup_id = ""
         try:
             file_name = os.path.basename(self.local_file_path)
             if not os.path.exists(self.local_file_path):
                 raise FileNotFoundError(f"Filen {self.local_file_path} blev ikke fundet.")
-            with open(self.local_file_path, 'rb') as f:
-                self.dbx_client.files_upload(f.read(), f'/{file_name}', mode=dropbox.files.WriteMode.overwrite)
-            self.status.emit(f"Fil uploadet til Dropbox: {file_name}")
+            # Backuppen tages her og ikke på GUI-tråden, da den kopierer hele databasen
+            self.status.emit("Opretter backup før upload...")
+            backup_id = get_backup_manager().create_snapshot(self.local_file_path, label='upload')
+            with transfer_lock:
+                uploaded = upload_database_snapshot(self.storage, self.local_file_path, self.report_progress)
+            if uploaded:
+                self.status.emit(f"Fil uploadet til Dropbox: {file_name}")
+            else:
+                self.progress.emit(100)
+                self.status.emit(f"Ingen ændringer siden sidste synkronisering - {file_name} er allerede opdateret i Dropbox")
+        except SyncConflictError as e:
+            logging.warning(f"Dropbox konflikt: {e}")
+            self.status.emit("Dropbox-kopien er nyere end den lokale database. Upload afbrudt.")
+            self.fail("Dropbox Konflikt", str(e))
         except dropbox.exceptions.AuthError as e:
             logging.error(f"Dropbox autentificeringsfejl: {e}")
             self.status.emit("Dropbox autentificeringsfejl. Kontroller din Dropbox adgang.")
-            QMessageBox.critical(None, "Dropbox Fejl",
-                                 "Autentificeringsfejl med Dropbox. Kontroller din adgangstoken.")
+            self.fail("Dropbox Fejl", "Autentificeringsfejl med Dropbox. Kontroller din adgangstoken.")
         except dropbox.exceptions.ApiError as e:
             logging.error(f"Dropbox API fejl: {e}")
             self.status.emit("Dropbox API fejl. Prøv igen senere.")
-            QMessageBox.critical(None, "Dropbox Fejl",
-                                 "Der opstod en fejl med Dropbox API'en. Prøv igen senere.")
+            self.fail("Dropbox Fejl", "Der opstod en fejl med Dropbox API'en. Prøv igen senere.")
         except dropbox.exceptions.HttpError as e:
             logging.error(f"Dropbox netværksfejl: {e}")
             self.status.emit("Netværksfejl. Kontroller din internetforbindelse.")
-            QMessageBox.critical(None, "Netværksfejl",
-                                 "Der opstod en netværksfejl. Kontroller din internetforbindelse.")
+            self.fail("Netværksfejl", "Der opstod en netværksfejl. Kontroller din internetforbindelse.")
         except Exception as e:
             logging.error(f"Fejl ved upload til Dropbox: {e}")
             self.status.emit(f"Fejl ved upload til Dropbox: {str(e)}")
-            QMessageBox.critical(None, "Fejl ved upload til Dropbox",
-                                 f"Der opstod en fejl ved upload til Dropbox:\n{e}")
+            self.fail("Fejl ved upload til Dropbox", f"Der opstod en fejl ved upload til Dropbox:\n{e}")
+        finally:
+            self.finished.emit(backup_id)
+
+    def fail(self, title, message):
+        # Tråden må ikke vise dialoger selv, så fejlen sendes til GUI-tråden
+        self.failed = True
+        self.error.emit(title, message)
+
+    def report_progress(self, uploaded, total):
+        self.progress.emit(int(uploaded * 100 / total) if total else 100)
+        self.status.emit(f"Uploader til Dropbox: {uploaded / (1024 * 1024):.1f} af {total / (1024 * 1024):.1f} MB")
+
+
+class DropboxDownload(QThread):
+    """Henter databasen fra Dropbox i baggrunden, verificerer den og bytter den ind.
+
+    Før udskiftningen tages en backup af den lokale database. replace_database(sti, backup_id)
+    udskifter den lokale fil og kaldes på denne tråd med transfer_lock holdt, så hverken auto-sync
+    eller GUI-tråden venter på hinanden under udskiftningen. completed sendes først bagefter, så
+    GUI-tråden kun skal genindlæse tabellen.
+    """
+    status = pyqtSignal(str)
+    progress = pyqtSignal(int)
+    completed = pyqtSignal(bool, object, str)  # (databasen blev udskiftet, metadata, backup-id)
+    error = pyqtSignal(str, str)  # (titel, besked)
+    finished = pyqtSignal()
+
+    def __init__(self, db_path, storage, replace_database, remote_path=config.DROPBOX_SNAPSHOT_PATH):
+        super().__init__()
+        self.db_path = db_path
+        self.storage = storage
+        self.replace_database = replace_database
+        self.remote_path = remote_path
+
+    def run(self):
+        # Ingen download mens en upload kører, da den lokale fil ellers kan skifte under uploaden
+        with transfer_lock:
+            self.download()
+
+    def download(self):
+        temp_db_path = self.db_path + ".download"
+        try:
+            remote = self.storage.stat(self.remote_path)
+            if remote is None and self.remote_path == config.DROPBOX_SNAPSHOT_PATH:
+                # Intet snapshot endnu (uploadet af en ældre version af programmet) - hent den rå fil
+                logging.info("Intet snapshot i Dropbox, henter den rå databasefil")
+                self.remote_path = config.DROPBOX_DATABASE_PATH
+                remote = self.storage.stat(self.remote_path)
+            if remote is None:
+                raise FileNotFoundError(f"{self.remote_path} findes ikke i Dropbox.")
+
+            is_snapshot = self.remote_path == config.DROPBOX_SNAPSHOT_PATH
+            if os.path.exists(self.db_path):
+                # Snapshots er deterministiske, så et lokalt snapshot kan sammenlignes direkte
+                local_path = prepare_upload_snapshot(self.db_path) if is_snapshot else self.db_path
+                if remote.content_hash == dropbox_content_hash(local_path):
+                    save_sync_state(get_sync_state_path(), self.remote_path, remote)
+                    logging.info("Lokal database er identisk med Dropbox-kopien, download sprunget over")
+                    self.completed.emit(False, remote, "")
+                    return
+
+            self.status.emit("Henter database fra Dropbox...")
+            start_time = time.perf_counter()
+            if is_snapshot:
+                metadata = download_snapshot_streaming(self.storage, self.remote_path, temp_db_path,
+                                                       progress_callback=self.report_progress)
+            else:
+                metadata = download_file_streaming(self.storage, self.remote_path, temp_db_path,
+                                                   progress_callback=self.report_progress)
+            logging.info(f"Database hentet fra {self.remote_path}: {metadata.size} bytes over nettet "
+                         f"på {time.perf_counter() - start_time:.2f} sekunder")
+
+            self.status.emit("Kontrollerer den hentede database...")
+            problem = verify_database_file(temp_db_path)
+            if problem:
+                raise ValueError(f"Den hentede database er ugyldig: {problem}")
+
+            self.status.emit("Opretter backup af den lokale database...")
+            backup_id = get_backup_manager().create_snapshot(self.db_path, label='download', force=True)
+            self.status.emit("Udskifter den lokale database...")
+            try:
+                self.replace_database(temp_db_path, backup_id)
+            except Exception as e:
+                logging.error(f"Fejl ved udskiftning af databasen efter download: {e}")
+                self.error.emit("Fejl", f"Der opstod en fejl ved opdatering af den lokale database: {e}")
+                return
+            save_sync_state(get_sync_state_path(), self.remote_path, metadata)
+            self.completed.emit(True, metadata, backup_id)
+        except dropbox.exceptions.AuthError as e:
+            logging.error(f"Dropbox autentificeringsfejl: {e}")
+            self.error.emit("Dropbox Fejl", "Autentificeringsfejl med Dropbox. Kontroller din adgangstoken.")
+        except dropbox.exceptions.HttpError as e:
+            logging.error(f"Dropbox netværksfejl: {e}")
+            self.error.emit("Netværksfejl", "Netværksfejl. Kontroller din internetforbindelse.")
+        except Exception as e:
+            logging.error(f"Fejl ved hentning af databasen fra Dropbox: {e}")
+            self.error.emit("Fejl", f"Der opstod en fejl ved hentning af databasen: {e}\n\n"
+                                    f"Din lokale database er ikke blevet ændret.")
+        finally:
+            # En fejlet eller ufuldstændig download må aldrig ligge tilbage og forveksles med en gyldig
+            if os.path.exists(temp_db_path):
+                os.remove(temp_db_path)
+            self.finished.emit()
+
+    def report_progress(self, received, total):
+        self.progress.emit(int(received * 100 / total) if total else 0)
+        self.status.emit(f"Henter database: {received / (1024 * 1024):.1f} af {total / (1024 * 1024):.1f} MB")
+
+
+class ChangesetSyncWorker(QThread):
+    """Udveksler rækkeændringer med de andre enheder via changeset-filer i Dropbox"""
+    status = pyqtSignal(str)
+    completed = pyqtSignal(dict)
+    error = pyqtSignal(str, str)  # (titel, besked)
+    finished = pyqtSignal()
+
+    def __init__(self, db_path, storage):
+        super().__init__()
+        self.db_path = db_path
+        self.storage = storage
+
+    def run(self):
+        try:
+            self.status.emit("Synkroniserer ændringer med Dropbox...")
+            sync = ChangesetSync(get_repository(self.db_path), self.storage, get_device_id(),
+                                compact_after_files=config.CHANGESET_COMPACT_AFTER_FILES)
+            with transfer_lock:
+                stats = sync.sync()
+            self.completed.emit(stats)
+        except dropbox.exceptions.AuthError as e:
+            logging.error(f"Dropbox autentificeringsfejl: {e}")
+            self.error.emit("Dropbox Fejl", "Autentificeringsfejl med Dropbox. Kontroller din adgangstoken.")
+        except dropbox.exceptions.HttpError as e:
+            logging.error(f"Dropbox netværksfejl: {e}")
+            self.error.emit("Netværksfejl", "Netværksfejl. Kontroller din internetforbindelse.")
+        except Exception as e:
+            logging.error(f"Fejl ved synkronisering af ændringer: {e}")
+            self.error.emit("Fejl", f"Der opstod en fejl ved synkronisering af ændringer: {e}")
         finally:
             self.finished.emit()
 
@@ -145,11 +423,12 @@ class PDFProcessor(QThread):
     error = pyqtSignal(str)  # Ny signal for fejlhåndtering
     info = pyqtSignal(str, str)  # Ny signal for info beskeder (titel, besked)
 
-    def __init__(self, pdf_path, db_path):
+    def __init__(self, pdf_path, db_path, refresh_ai_cache=False):
         super().__init__()
         self.pdf_path = pdf_path
         self.pdf_name = os.path.basename(pdf_path)
         self.db_path = db_path
+        self.refresh_ai_cache = refresh_ai_cache
         self.total_products = 0
         self._is_running = True
 
@@ -205,11 +484,12 @@ class PDFProcessor(QThread):
                 with open(page_file, 'w', encoding='utf-8') as txt_file:
                     txt_file.write(text)
                 
-                # Gem side information
+                # Gem side information. Sider uden tekstlag sendes senere gennem Vision
                 pages_content.append({
                     'text': text,
                     'page_num': page_num,
-                    'file_path': str(page_file)
+                    'file_path': str(page_file),
+                    'scanned': not has_text_layer(text, config.SCAN_MIN_TEXT_CHARS)
                 })
                 
                 # Opdater progress
@@ -222,44 +502,69 @@ class PDFProcessor(QThread):
                 txt_file.write(all_text)
             
             logging.info(f"Komplet tekst gemt til {complete_file}")
+
+            scanned_pages = [page['page_num'] for page in pages_content if page['scanned']]
+            if scanned_pages:
+                self.safe_emit(self.status, f"Rasteriserer {len(scanned_pages)} scannede sider...")
+                logging.info(f"Sider uden tekstlag: {scanned_pages}")
+                rendered = render_pages(filename, scanned_pages, str(output_dir), config.SCAN_RENDER_DPI,
+                                        config.SCAN_RENDER_WORKERS)
+                for page in pages_content:
+                    if page['page_num'] in rendered:
+                        page['image_path'], page['pixel_count'] = rendered[page['page_num']]
+
             return pages_content
             
         except Exception as e:
             logging.error(f"Fejl under behandling af PDF sider: {str(e)}")
             raise
 
+    def process_scanned_page(self, page_data, client, document_hash, all_products):
+        """Sender en side uden tekstlag gennem Vision og tilføjer produkterne i sideorden"""
+        page_num = page_data['page_num']
+        if not page_data.get('image_path'):
+            logging.error(f"Scannet side {page_num} kunne ikke rasteriseres og springes over")
+            self.safe_emit(self.error, f"Side {page_num} har intet tekstlag og kunne ikke rasteriseres.")
+            return
+
+        self.safe_emit(self.status, f"Side {page_num} er scannet - analyserer billede med Vision AI...")
+        logging.info(f"Starter Vision analyse af scannet side {page_num}")
+        try:
+            call_context = {'document_hash': document_hash, 'document_name': self.pdf_name, 'page': page_num,
+                            'refresh_cache': self.refresh_ai_cache}
+            result = route_and_extract_image(page_data['image_path'], client, call_context,
+                                             extractor=extract_products_from_scan,
+                                             pixel_count=page_data.get('pixel_count'),
+                                             layout_key='scannet leveringsseddel')
+            products = result.get('products', [])
+            for product in products:
+                product['PDF Source'] = f"{self.pdf_name} (Side {page_num})"
+            all_products.extend(products)
+            self.total_products += len(products)
+            logging.info(f"Fandt {len(products)} produkter på scannet side {page_num}")
+            self.safe_emit(self.status,
+                f"Side {page_num} (scannet): Fundet {len(products)} produkter. Total: {self.total_products}")
+        except Exception as e:
+            logging.error(f"Fejl ved behandling af scannet side {page_num}: {str(e)}")
+            self.safe_emit(self.error, f"Fejl ved analyse af scannet side {page_num}:\n{str(e)}")
+
     def save_to_database(self, structured_data):
-        conn = sqlite3.connect(self.db_path)
-        df = pd.DataFrame(structured_data)
         try:
-            df.to_sql('products', conn, if_exists='append', index=False)
-        except sqlite3.OperationalError as e:
-            logging.error(f"Fejl ved gemning til database: {e}")
-            logging.info("Prøver at tilføje manglende kolonner...")
-            cursor = conn.cursor()
-            for column in df.columns:
-                try:
-                    cursor.execute(f'ALTER TABLE products ADD COLUMN "{column}" TEXT')
-                    logging.info(f"Kolonne '{column}' tilføjet til databasen.")
-                except sqlite3.OperationalError:
-                    pass
-            conn.commit()
-            df.to_sql('products', conn, if_exists='append', index=False)
+            # Alle rækker fra PDF'en fortrydes samlet som én handling. Manglende kolonner tilføjes først.
+            # Skrivningen går gennem den fælles skrivertråd, så den ikke låser for GUI'en
+            get_repository(self.db_path).insert_many(structured_data, undo_label=f"PDF-upload: {self.pdf_name}")
         except Exception as e:
             logging.error(f"Uventet fejl ved gemning til database: {e}")
             QMessageBox.critical(None, "Database Fejl",
                                  f"Der opstod en fejl ved gemning til databasen:\n{e}\n\n"
                                  f"En logfil er blevet gemt i {get_app_data_dir()}\n"
                                  f"Venligst send denne logfil til support for hjælp.")
-        finally:
-            conn.close()
 
     def run(self):
         try:
             self.safe_emit(self.status, "Ekstraherer tekst fra PDF...")
             pages_content = self.extract_text_from_pdf()
             if not pages_content or not self._is_running:
-                self.safe_emit(self.finished)
                 return
 
             # Hent API nøgle
@@ -267,7 +572,8 @@ class PDFProcessor(QThread):
             if not api_key:
                 raise Exception("OpenAI API nøgle ikke fundet. Konfigurer venligst API nøglen i indstillinger.")
             
-            client = OpenAI(api_key=api_key)
+            client = OpenAI(api_key=api_key, max_retries=0)
+            document_hash = file_sha256(self.pdf_path)
             
             all_products = []
             total_pages = len(pages_content)
@@ -278,11 +584,29 @@ class PDFProcessor(QThread):
                     break
 
                 page_num = page_data['page_num']
+
+                if page_data['scanned']:
+                    self.process_scanned_page(page_data, client, document_hash, all_products)
+                    self.safe_emit(self.progress, 25 + int(progress_per_page * page_num))
+                    continue
+
+                # Spring sider over der tydeligvis ikke indeholder varer med udløbsdato
+                relevance = classify_page(page_data['text'])
+                if not relevance.relevant:
+                    logging.info(f"Side {page_num} sprunget over: {relevance.reason} ({relevance.signals})")
+                    if config.PAGE_FILTER_ENABLED and not config.PAGE_FILTER_SHADOW_MODE:
+                        self.safe_emit(self.status, f"Side {page_num} sprunget over: {relevance.reason}")
+                        self.safe_emit(self.progress, 25 + int(progress_per_page * page_num))
+                        continue
+
                 self.safe_emit(self.status, f"Analyserer side {page_num} af {total_pages} med AI...")
                 logging.info(f"Starter AI analyse af side {page_num}")
                 
                 try:
-                    result = extract_products_with_gpt(page_data['text'], client)
+                    call_context = {'document_hash': document_hash, 'document_name': self.pdf_name,
+                                    'page': page_num, 'refresh_cache': self.refresh_ai_cache}
+                    result = route_and_extract_text(page_data['text'], client, call_context)
+                    record_corpus_label(page_data['file_path'], bool(result.get('products')), relevance.relevant)
                     if result and 'products' in result:
                         products = result['products']
                         logging.info(f"Fandt {len(products)} produkter på side {page_num}")
@@ -321,7 +645,8 @@ class PDFProcessor(QThread):
             self.safe_emit(self.error, f"Der opstod en fejl under behandling af PDF'en:\n{str(e)}")
         finally:
             self._is_running = False
-            self.safe_emit(self.finished)
+            # Sendes altid, også efter stop(), så hovedvinduet genindlæser tabellen og auto-sync får besked
+            self.finished.emit()
 
 
 class EditRowDialog(QDialog):
@@ -353,21 +678,25 @@ class EditRowDialog(QDialog):
 
     def validate_and_accept(self):
         data = self.get_data()
-        errors = []
-
-        if not data.get("Article Description Batch", "").strip():
-            errors.append("Feltet 'Article Description Batch' må ikke være tomt.")
-
-        expiry_date = data.get("Expiry Date", "").strip()
-        if not self.validate_date_format(expiry_date):
-            errors.append("Ugyldigt datoformat for 'Expiry Date'. Formatet skal være DD.MM.YYYY.")
+        errors = [error for error in (self.validate_field(column, data.get(column, ""))
+                                      for column in ("Article Description Batch", "Expiry Date")) if error]
 
         if errors:
             QMessageBox.warning(self, "Valideringsfejl", "\n".join(errors))
         else:
             self.accept()
 
-    def validate_date_format(self, date_string):
+    @staticmethod
+    def validate_field(column, value):
+        """Fejlbeskeden for en ugyldig værdi i kolonnen, eller None. Bruges også ved redigering i tabellen"""
+        if column == "Article Description Batch" and not value.strip():
+            return "Feltet 'Article Description Batch' må ikke være tomt."
+        if column == "Expiry Date" and not EditRowDialog.validate_date_format(value.strip()):
+            return "Ugyldigt datoformat for 'Expiry Date'. Formatet skal være DD.MM.YYYY."
+        return None
+
+    @staticmethod
+    def validate_date_format(date_string):
         pattern = r'^\d{2}\.\d{2}\.\d{4}$'
         if not re.match(pattern, date_string):
             return False
@@ -381,7 +710,76 @@ class EditRowDialog(QDialog):
         return {label: field.text() for label, field in self.fields}
 
 
+class BatchEditDialog(QDialog):
+    """Sætter ét felt til samme værdi for flere produkter"""
+    def __init__(self, parent=None, count=0):
+        super().__init__(parent)
+        self.setWindowTitle(f"Ret felt for {count} produkter")
+        self.setMinimumWidth(400)
+        layout = QFormLayout()
+
+        self.column_combo = QComboBox()
+        self.column_combo.addItems(PRODUCT_COLUMNS)
+        self.column_combo.currentTextChanged.connect(self.update_placeholder)
+        layout.addRow("Felt", self.column_combo)
+        self.value_edit = QLineEdit()
+        layout.addRow("Ny værdi", self.value_edit)
+        self.update_placeholder(self.column_combo.currentText())
+
+        buttons = QHBoxLayout()
+        save_button = QPushButton("Gem")
+        save_button.clicked.connect(self.validate_and_accept)
+        cancel_button = QPushButton("Annuller")
+        cancel_button.clicked.connect(self.reject)
+        buttons.addWidget(save_button)
+        buttons.addWidget(cancel_button)
+
+        layout.addRow(buttons)
+        self.setLayout(layout)
+
+    def update_placeholder(self, column):
+        self.value_edit.setPlaceholderText("DD.MM.YYYY" if column == "Expiry Date" else "")
+
+    def validate_and_accept(self):
+        error = EditRowDialog.validate_field(*self.get_data())
+        if error:
+            QMessageBox.warning(self, "Valideringsfejl", error)
+        else:
+            self.accept()
+
+    def get_data(self):
+        column = self.column_combo.currentText()
+        value = self.value_edit.text()
+        return column, value.strip() if column == "Expiry Date" else value
+
+
 class TruncatedItemDelegate(QStyledItemDelegate):
+    cell_edited = pyqtSignal(object, str)  # (indeks i kildemodellen, ny værdi) efter en gyldig redigering
+    invalid_edit = pyqtSignal(str)  # fejlbesked når en redigering afvises
+
+    def createEditor(self, parent, option, index):
+        editor = super().createEditor(parent, option, index)
+        if isinstance(editor, QLineEdit) and index.model().headerData(index.column(), Qt.Horizontal) == "Expiry Date":
+            editor.setPlaceholderText("DD.MM.YYYY")
+        return editor
+
+    def setModelData(self, editor, model, index):
+        # Værdien valideres med samme regler som i redigeringsdialogen, før den skrives i modellen
+        if not isinstance(editor, QLineEdit):
+            return super().setModelData(editor, model, index)
+        column = model.headerData(index.column(), Qt.Horizontal)
+        value = editor.text().strip() if column == "Expiry Date" else editor.text()
+        error = EditRowDialog.validate_field(column, value)
+        if error:
+            self.invalid_edit.emit(error)
+            return
+        if value == index.data(Qt.EditRole):
+            return
+        # Proxyen kan sortere rækken et andet sted hen, så kildeindekset hentes før værdien skrives
+        source_index = model.mapToSource(index) if isinstance(model, QSortFilterProxyModel) else index
+        model.setData(index, value, Qt.EditRole)
+        self.cell_edited.emit(source_index, value)
+
     def paint(self, painter, option, index):
         if index.column() in [2, 3]:
             text = index.data(Qt.DisplayRole)
@@ -399,6 +797,8 @@ class TruncatedItemDelegate(QStyledItemDelegate):
 
 
 class MainWindow(QMainWindow):
+    auto_sync_status = pyqtSignal(str)  # Sendes fra auto-sync tråden, vises på GUI-tråden
+
     def __init__(self):
         super().__init__()
         # Konfigurerer vinduets ikon, titel, geometri osv.
@@ -409,10 +809,25 @@ class MainWindow(QMainWindow):
         self.db_path = os.path.join(user_data_dir, 'products.db')
         self.dropbox_auth = SecureDropboxAuth()
         self.dbx_client = None
+        self.storage = None
 
         self.DATE_COLUMN_INDEX = -1
         self.model = QStandardItemModel()
         self.threads = []
+        self.repository = get_repository(self.db_path)
+        self.expiry_buckets = ExpiryBuckets(self.db_path, config.EXPIRY_HORIZONS)
+        # Redigeringer kører på en baggrundstråd, så brugerfladen ikke fryser mens databasen arbejder
+        self.db_worker = DbWorker(self)
+        self.db_worker.busy_changed.connect(self.on_db_busy_changed)
+        self.file_swap_pending = False
+        self.undo_group_info = self.redo_group_info = None
+        # Rettelser i tabellen samles og skrives i én transaktion, når brugeren holder en pause
+        self.cell_edits = CellEditBuffer(self.write_cell_edits, debounce_ms=config.CELL_EDIT_DEBOUNCE_MS,
+                                         max_delay_ms=config.CELL_EDIT_MAX_DELAY_MS, parent=self)
+        self.stall_monitor = None
+        if config.GUI_STALL_MONITOR_ENABLED:
+            self.stall_monitor = EventLoopStallMonitor(threshold_ms=config.GUI_STALL_THRESHOLD_MS, parent=self)
+            self.stall_monitor.start()
 
         # Menu bar oprettes allerede i setup_ui()
         self.setup_ui()               # Her oprettes menulinjen inklusive "Fil" menuen
@@ -421,7 +836,11 @@ class MainWindow(QMainWindow):
         self.ensure_local_database()
         self.load_existing_data()
         self.initialize_dropbox_client()
-        self.undo_stack = []
+        self.undo_journal = UndoJournal(self.repository, max_groups=config.UNDO_MAX_GROUPS,
+                                        max_rows=config.UNDO_MAX_ROWS)
+        self.refresh_undo_history()
+        self.auto_sync = None
+        self.start_auto_sync()
 
     def get_column_index(self, column_name):
         for col in range(self.model.columnCount()):
@@ -431,25 +850,7 @@ class MainWindow(QMainWindow):
         return -1
 
     def create_empty_database(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS products (
-            UniqueID INTEGER PRIMARY KEY AUTOINCREMENT,
-            ProductID TEXT,
-            SKU TEXT,
-            "Article Description Batch" TEXT,
-            "Expiry Date" TEXT,
-            "EAN Serial No" TEXT,
-            Remark TEXT,
-            "Order QTY" TEXT,
-            "Ship QTY" TEXT,
-            UOM TEXT,
-            "PDF Source" TEXT
-        )
-        ''')
-        conn.commit()
-        conn.close()
+        self.repository.create_schema(get_device_id())
         logging.info(f"Tom database oprettet: {self.db_path}")
 
     def sort_table(self, column_index):
@@ -560,6 +961,14 @@ class MainWindow(QMainWindow):
         export_logs_action.triggered.connect(self.export_log_files)
         help_menu.addAction(export_logs_action)
 
+        ai_usage_action = QAction("AI forbrug og omkostninger", self)
+        ai_usage_action.triggered.connect(self.show_ai_usage_dialog)
+        help_menu.addAction(ai_usage_action)
+
+        backup_status_action = QAction("Backup status", self)
+        backup_status_action.triggered.connect(self.show_backup_status)
+        help_menu.addAction(backup_status_action)
+
         settings_menu = menu_bar.addMenu("Indstillinger")
         api_key_action = QAction("Konfigurer API Nøgle", self)
         api_key_action.triggered.connect(self.show_api_key_dialog)
@@ -602,6 +1011,13 @@ class MainWindow(QMainWindow):
         self.undo_button.setEnabled(False)
         button_layout.addWidget(self.undo_button)
 
+        self.redo_button = QPushButton("Gentag")
+        self.redo_button.setIcon(self.style().standardIcon(QStyle.SP_ArrowForward))
+        self.redo_button.setToolTip("Klik her for at gentage den senest fortrudte handling")
+        self.redo_button.clicked.connect(self.redo_last_action)
+        self.redo_button.setEnabled(False)
+        button_layout.addWidget(self.redo_button)
+
         self.add_row_button = QPushButton("Tilføj række")
         self.add_row_button.setIcon(self.style().standardIcon(QStyle.SP_FileDialogNewFolder))
         self.add_row_button.setToolTip("Klik her for at tilføje en ny produktrække manuelt")
@@ -649,15 +1065,25 @@ class MainWindow(QMainWindow):
         table_label = QLabel("Produktoversigt:")
         main_layout.addWidget(table_label)
 
+        self.expiry_summary_label = QLabel()
+        self.expiry_summary_label.setToolTip("Antal produkter pr. udløbsperiode. Hvert produkt tælles kun i én periode")
+        main_layout.addWidget(self.expiry_summary_label)
+
         self.table_view = QTableView()
         self.table_view.setAlternatingRowColors(True)
         self.table_view.setSelectionBehavior(QTableView.SelectRows)
+        self.table_view.setSelectionMode(QTableView.ExtendedSelection)
         self.table_view.setStyleSheet("QTableView { border: 1px solid #ddd; } QTableView::item { padding: 5px; }")
         self.table_view.setContextMenuPolicy(Qt.CustomContextMenu)
         self.table_view.customContextMenuRequested.connect(self.show_context_menu)
 
         delegate = TruncatedItemDelegate(self.table_view)
+        delegate.cell_edited.connect(self.on_cell_edited)
+        delegate.invalid_edit.connect(lambda message: QMessageBox.warning(self, "Valideringsfejl", message))
         self.table_view.setItemDelegate(delegate)
+        # Cellerne kan rettes direkte: dobbeltklik, F2 eller bare begynd at skrive
+        self.table_edit_triggers = QTableView.DoubleClicked | QTableView.EditKeyPressed | QTableView.AnyKeyPressed
+        self.table_view.setEditTriggers(self.table_edit_triggers)
 
         main_layout.addWidget(self.table_view)
 
@@ -699,16 +1125,22 @@ class MainWindow(QMainWindow):
         
         # Database-handlings actions:
         # Action for at rydde hele databasen. Backup oprettes først for sikkerhed.
-        clear_db_action = QAction("Ryd Database", self)
-        clear_db_action.setStatusTip("Ryd hele databasen (opretter backup først)")
-        clear_db_action.triggered.connect(self.clear_database)
-        file_menu.addAction(clear_db_action)
+        self.clear_db_action = QAction("Ryd Database", self)
+        self.clear_db_action.setStatusTip("Ryd hele databasen (opretter backup først)")
+        self.clear_db_action.triggered.connect(self.clear_database)
+        file_menu.addAction(self.clear_db_action)
+
+        # Sletter alle produkter hvis udløbsdato er passeret, i én handling der kan fortrydes samlet
+        self.delete_expired_action = QAction("Slet Udløbne Produkter", self)
+        self.delete_expired_action.setStatusTip("Slet alle produkter hvis udløbsdato er passeret")
+        self.delete_expired_action.triggered.connect(self.delete_expired_products)
+        file_menu.addAction(self.delete_expired_action)
         
         # Action for at oprette en ny, tom database. Først laves der backup af den nuværende database.
-        create_empty_db_action = QAction("Opret Tom Database", self)
-        create_empty_db_action.setStatusTip("Opret en ny tom database")
-        create_empty_db_action.triggered.connect(self.create_new_empty_database)
-        file_menu.addAction(create_empty_db_action)
+        self.create_empty_db_action = QAction("Opret Tom Database", self)
+        self.create_empty_db_action.setStatusTip("Opret en ny tom database")
+        self.create_empty_db_action.triggered.connect(self.create_new_empty_database)
+        file_menu.addAction(self.create_empty_db_action)
 
         # Tilføj nedenfor en ny action til Multi-upload:
         multi_upload_action = QAction("Upload Flere Filer", self)
@@ -716,10 +1148,43 @@ class MainWindow(QMainWindow):
         multi_upload_action.triggered.connect(self.upload_multiple)
         file_menu.addAction(multi_upload_action)
 
+        # Rækkevis synkronisering: udveksler kun ændrede rækker i stedet for hele databasefilen
+        changeset_sync_action = QAction("Synkroniser Ændringer (Rækkevis)", self)
+        changeset_sync_action.setStatusTip("Send og hent kun ændrede rækker via Dropbox")
+        changeset_sync_action.triggered.connect(self.sync_changesets)
+        file_menu.addAction(changeset_sync_action)
+
     def open_log_folder(self):
         log_dir = get_app_data_dir()
         QDesktopServices.openUrl(QUrl.fromLocalFile(log_dir))
 
+    def show_ai_usage_dialog(self):
+        try:
+            dialog = AIUsageDialog(get_ai_usage_log(), self)
+            dialog.exec_()
+        except Exception as e:
+            logging.error(f"Fejl ved visning af AI forbrug: {str(e)}")
+            QMessageBox.critical(self, "Fejl", f"Kunne ikke indlæse AI forbrug: {e}")
+
+    def show_backup_status(self):
+        try:
+            manager = get_backup_manager()
+            usage = manager.usage()
+            snapshots = manager.list_snapshots()
+            latest = snapshots[-1] if snapshots else "Ingen"
+            QMessageBox.information(
+                self,
+                "Backup status",
+                f"Snapshots: {usage['snapshots']} (seneste: {latest})\n"
+                f"Unikke sider: {usage['pages']}\n"
+                f"Diskforbrug: {usage['disk_bytes'] / (1024 * 1024):.1f} MB\n"
+                f"Som fulde kopier: {usage['logical_bytes'] / (1024 * 1024):.1f} MB\n\n"
+                f"Placering: {manager.backup_dir}"
+            )
+        except Exception as e:
+            logging.error(f"Fejl ved visning af backup status: {str(e)}")
+            QMessageBox.critical(self, "Fejl", f"Kunne ikke indlæse backup status: {e}")
+
     def export_log_files(self):
         log_dir = get_app_data_dir()
         log_file = os.path.join(log_dir, 'sweetspot.log')
@@ -734,7 +1199,9 @@ class MainWindow(QMainWindow):
         else:
             QMessageBox.warning(self, "Ingen logfil", "Ingen logfil blev fundet.")
 
-    def initialize_database(self):
+    def initialize_database(self, show_migration_notice=True):
+        """Opretter eller opdaterer databasen. Uden show_migration_notice vises ingen dialog, så den
+        kan kaldes fra en baggrundstråd"""
         if not os.path.exists(self.db_path):
             self.create_empty_database()
         else:
@@ -753,8 +1220,9 @@ class MainWindow(QMainWindow):
                 has_uniqueid = any(info[1].lower() == 'uniqueid' and info[5] == 1 for info in columns_info)
                 if not has_uniqueid:
                     logging.info("Migrating database to add 'UniqueID' primary key and resolve column conflicts.")
-                    QMessageBox.information(self, "Database Opdatering",
-                                            "Din lokale database opdateres til det nye format. Dette kan tage et øjeblik.")
+                    if show_migration_notice:
+                        QMessageBox.information(self, "Database Opdatering",
+                                                "Din lokale database opdateres til det nye format. Dette kan tage et øjeblik.")
                     cursor.execute('ALTER TABLE products RENAME TO products_old')
                     cursor.execute('''
                     CREATE TABLE products (
@@ -799,6 +1267,8 @@ class MainWindow(QMainWindow):
                         logging.info(f"Kolonne '{col}' tilføjet til eksisterende tabel.")
                     conn.commit()
             conn.close()
+            # Change tracking, fortryd-journal og indekser oprettes hvis de mangler
+            self.repository.create_schema(get_device_id())
 
     def ensure_local_database(self):
         if not os.path.exists(self.db_path):
@@ -808,8 +1278,16 @@ class MainWindow(QMainWindow):
                                     "Du kan nu begynde at tilføje data eller hente en eksisterende database fra Dropbox.")
 
     def initialize_dropbox_client(self):
-        self.dbx_client = self.dropbox_auth.get_dropbox_client()
-        if self.dbx_client is None:
+        if config.STORAGE_LOCAL_DIR:
+            # Lokalt lager med simuleret netværk til test og benchmarks uden Dropbox
+            logging.info(f"Bruger lokalt lager i {config.STORAGE_LOCAL_DIR} i stedet for Dropbox")
+            self.storage = LocalBackend(config.STORAGE_LOCAL_DIR, latency=config.STORAGE_LOCAL_LATENCY,
+                                        bandwidth=config.STORAGE_LOCAL_BANDWIDTH)
+        else:
+            self.dbx_client = self.dropbox_auth.get_dropbox_client()
+            if self.dbx_client is not None:
+                self.storage = DropboxBackend(self.dbx_client)
+        if self.storage is None:
             QMessageBox.warning(self, "Dropbox Fejl", "Dropbox-klient ikke initialiseret. Kontroller dine indstillinger i config.py.")
             self.upload_to_dropbox_button.setEnabled(False)
             self.download_from_dropbox_button.setEnabled(False)
@@ -821,12 +1299,12 @@ class MainWindow(QMainWindow):
         file_path, _ = QFileDialog.getOpenFileName(self, "Vælg PDF-fil med produktdata", "", "PDF Filer (*.pdf)")
         if file_path:
             self.statusBar().showMessage(f"Behandler fil: {os.path.basename(file_path)}")
-            self.processor = PDFProcessor(file_path, self.db_path)
+            self.processor = PDFProcessor(file_path, self.db_path, refresh_ai_cache=self.ask_refresh_ai_cache(file_path))
             
             # Tilføj signal connections
             self.processor.progress.connect(self.update_progress)
             self.processor.status.connect(self.update_status)
-            self.processor.finished.connect(self.on_pdf_processing_finished)
+            self.processor.finished.connect(lambda it=self.processor: self.on_pdf_processing_finished(it))
             self.processor.error.connect(self.show_error)
             self.processor.info.connect(self.show_info)
             
@@ -853,19 +1331,23 @@ class MainWindow(QMainWindow):
         self.statusBar().showMessage(message)
 
     def load_existing_data(self):
-        conn = sqlite3.connect(self.db_path)
+        """Genindlæser tabellen på DbWorker. Ventende rettelser sendes først, så genindlæsningen
+        kører efter dem og ikke viser de gamle værdier eller skriver dem i en ny databasefil"""
+        self.cell_edits.flush()
+        self.reload_table_async()
+
+    def fetch_table_data(self):
+        """Læser produkterne og udløbsspandene. Rører ingen widgets, så den kan køre på DbWorker"""
         try:
-            df = pd.read_sql_query("SELECT * FROM products", conn)
+            columns, rows = self.repository.fetch_all()
+            df = pd.DataFrame(rows, columns=columns)
             df = df.fillna('')
             df.columns = [col if col.lower() != 'uniqueid' else 'UniqueID' for col in df.columns]
-        except pd.io.sql.DatabaseError:
-            df = pd.DataFrame(columns=["UniqueID", "ProductID", "SKU", "Article Description Batch", "Expiry Date",
-                                       "EAN Serial No", "Remark", "Order QTY", "Ship QTY", "UOM", "PDF Source"])
-        finally:
-            conn.close()
-        self.update_table(df)
+        except sqlite3.Error:
+            df = pd.DataFrame(columns=["UniqueID"] + PRODUCT_COLUMNS)
+        return df, self.expiry_buckets.compute()
 
-    def update_table(self, df):
+    def update_table(self, df, buckets=None):
         self.model.clear()
         if not df.empty:
             if 'UniqueID' not in df.columns:
@@ -888,37 +1370,43 @@ class MainWindow(QMainWindow):
 
             self.model.setHorizontalHeaderLabels(headers)
 
-            for _, row in df.iterrows():
+            # Udløbsspandene beregnes af én indekseret forespørgsel i stedet for at parse datoen pr. række
+            buckets = buckets or self.expiry_buckets.compute()
+            bucket_of = buckets['bucket_of']
+            id_index = headers.index('UniqueID')
+            description_index = headers.index('Article Description Batch') if 'Article Description Batch' in headers else -1
+            tooltip_columns = {i for i, column in enumerate(headers) if column in ["SKU", "Article Description Batch"]}
+            invalid_products = []
+            # Tuplerne fra itertuples er meget hurtigere end iterrows, som bygger en Series pr. række
+            for row in df.itertuples(index=False, name=None):
                 items = []
-                for column in headers:
-                    item = QStandardItem(str(row[column]))
-                    if column in ["SKU", "Article Description Batch"]:
-                        item.setToolTip(str(row[column]))
-                    if column == "Expiry Date":
-                        try:
-                            expiry_date = datetime.strptime(row[column], "%d.%m.%Y")
-                            today = datetime.now()
-                            days_until_expiry = (expiry_date - today).days
-
-                            if days_until_expiry <= 0:
-                                item.setBackground(QBrush(QColor(255, 0, 0, 100)))
-                            elif days_until_expiry <= 14:
-                                item.setBackground(QBrush(QColor(255, 165, 0, 100)))
-                            elif days_until_expiry <= 30:
-                                item.setBackground(QBrush(QColor(255, 255, 0, 100)))
-                        except ValueError:
-                            item.setBackground(QBrush(QColor(255, 0, 0, 100)))
-                            logging.error(f"Fejl ved parsing af dato: {row[column]} for Article Description Batch: {row['Article Description Batch']}")
-
-                            QMessageBox.warning(
-                                self,
-                                "Ugyldig dato",
-                                f"Ugyldig dato fundet: {row[column]} for produkt: {row['Article Description Batch']}\n"
-                                f"Venligst ret datoen til formatet DD.MM.YYYY."
-                            )
+                for i, value in enumerate(row):
+                    item = QStandardItem(str(value))
+                    if i == id_index:
+                        item.setEditable(False)
+                    if i in tooltip_columns:
+                        item.setToolTip(str(value))
+                    if i == self.DATE_COLUMN_INDEX:
+                        bucket = bucket_of.get(row[id_index])
+                        if bucket in EXPIRY_BUCKET_COLORS:
+                            item.setBackground(QBrush(EXPIRY_BUCKET_COLORS[bucket]))
+                        if bucket == INVALID:
+                            description = row[description_index] if description_index != -1 else ''
+                            logging.error(f"Fejl ved parsing af dato: {value} for Article Description Batch: {description}")
+                            invalid_products.append(f"{value} for produkt: {description}")
                     items.append(item)
                 self.model.appendRow(items)
 
+            if invalid_products:
+                QMessageBox.warning(
+                    self,
+                    "Ugyldig dato",
+                    f"Ugyldig dato fundet for {len(invalid_products)} produkt(er):\n" +
+                    "\n".join(invalid_products[:10]) +
+                    ("\n..." if len(invalid_products) > 10 else "") +
+                    "\nVenligst ret datoen til formatet DD.MM.YYYY."
+                )
+
         self.table_view.resizeColumnsToContents()
         self.table_view.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
         if self.DATE_COLUMN_INDEX != -1:
@@ -926,8 +1414,88 @@ class MainWindow(QMainWindow):
         else:
             self.table_view.sortByColumn(0, Qt.AscendingOrder)
 
+        self.update_expiry_summary(buckets)
         self.update_status_bar()
 
+    def update_expiry_summary(self, buckets=None):
+        counts = (buckets or self.expiry_buckets.compute())['counts']
+        parts = [f"Udløbet: {counts[EXPIRED]}", f"I dag: {counts[TODAY]}"]
+        parts += [f"Inden for {days} dage: {counts[horizon_bucket(days)]}" for days in self.expiry_buckets.horizons]
+        if counts[INVALID]:
+            parts.append(f"Ugyldig dato: {counts[INVALID]}")
+        self.expiry_summary_label.setText(" | ".join(parts))
+
+    def on_cell_edited(self, source_index, value):
+        """En celle er rettet direkte i tabellen. Modellen har allerede den nye værdi; skrivningen
+        til databasen samles i cell_edits"""
+        id_column_index = self.get_column_index('UniqueID')
+        if id_column_index == -1:
+            return
+        row_id = self.model.item(source_index.row(), id_column_index).text()
+        column = self.model.headerData(source_index.column(), Qt.Horizontal)
+        if not row_id or column == 'UniqueID':
+            return
+        if column in ["SKU", "Article Description Batch"]:
+            self.model.item(source_index.row(), source_index.column()).setToolTip(value)
+        self.cell_edits.add(row_id, column, value)
+        self.statusBar().showMessage(f"{self.cell_edits.pending} ændring(er) venter på at blive gemt")
+
+    def write_cell_edits(self, cells):
+        """Skriver de samlede cellerettelser som én UPDATE pr. celle i én transaktion og én fortryd-gruppe"""
+        label = f"Ret {cells[0][1]}" if len(cells) == 1 else f"Ret {len(cells)} felter"
+        self.perform_critical_operation(
+            self.repository.update_cells, cells, label,
+            update_model=lambda updated, buckets: self.update_model_cells(cells, buckets['bucket_of']),
+            on_success=lambda updated: self.statusBar().showMessage(f"{updated} ændring(er) gemt."),
+            error_message="Der opstod en fejl ved gemning af ændringerne")
+
+    def model_rows_by_id(self, row_ids):
+        """Rækkenumrene i modellen for de givne UniqueID'er som {UniqueID: række}"""
+        id_column_index = self.get_column_index('UniqueID')
+        wanted = {str(row_id) for row_id in row_ids}
+        rows = {}
+        if id_column_index == -1:
+            return rows
+        for row in range(self.model.rowCount()):
+            row_id = self.model.item(row, id_column_index).text()
+            if row_id in wanted:
+                rows[row_id] = row
+        return rows
+
+    def remove_model_rows(self, row_ids):
+        """Fjerner rækker fra modellen uden at genindlæse tabellen. Sammenhængende rækker fjernes
+        med ét kald, så visningen kun opdateres én gang pr. blok"""
+        rows = sorted(self.model_rows_by_id(row_ids).values(), reverse=True)
+        while rows:
+            end = start = rows.pop(0)
+            while rows and rows[0] == start - 1:
+                start = rows.pop(0)
+            self.model.removeRows(start, end - start + 1)
+
+    def update_model_cells(self, cells, bucket_of):
+        """Skriver (UniqueID, kolonne, værdi) ind i modellen og farver ændrede udløbsdatoer efter
+        deres nye spand, uden at genindlæse tabellen"""
+        cells = list(cells)
+        rows = self.model_rows_by_id(row_id for row_id, _, _ in cells)
+        columns = {column: self.get_column_index(column) for column in {column for _, column, _ in cells}}
+        # Proxyen sorterer først igen når alle celler er skrevet
+        self.proxy_model.setDynamicSortFilter(False)
+        try:
+            for row_id, column, value in cells:
+                row = rows.get(str(row_id))
+                if row is None or columns[column] == -1:
+                    continue
+                item = self.model.item(row, columns[column])
+                item.setText(str(value))
+                if column in ["SKU", "Article Description Batch"]:
+                    item.setToolTip(str(value))
+                if column == "Expiry Date":
+                    bucket = bucket_of.get(int(row_id))
+                    item.setBackground(QBrush(EXPIRY_BUCKET_COLORS[bucket]) if bucket in EXPIRY_BUCKET_COLORS
+                                       else QBrush())
+        finally:
+            self.proxy_model.setDynamicSortFilter(True)
+
     def apply_filter(self):
         filter_text = self.filter_input.text()
         filter_column = self.filter_combo.currentText()
@@ -955,39 +1523,24 @@ class MainWindow(QMainWindow):
         dialog = EditRowDialog(self)
         if dialog.exec_():
             new_data = dialog.get_data()
-            try:
-                last_id = self.perform_critical_operation(self.add_to_database, new_data)
-                self.load_existing_data()
-                QMessageBox.information(self, "Produkt tilføjet", f"Nyt produkt med SKU {new_data['SKU']} er blevet tilføjet.")
-                self.add_to_undo_stack("add_row", last_id)
-            except Exception as e:
-                QMessageBox.critical(self, "Fejl", f"Der opstod en fejl ved tilføjelse af rækken: {str(e)}\n\n"
-                                                   f"En logfil er blevet gemt i {get_app_data_dir()}\n"
-                                                   f"Venligst send denne logfil til support for hjælp.")
-
-    def add_to_database(self, data, include_id=False):
-        conn = sqlite3.connect(self.db_path)
+            self.perform_critical_operation(
+                self.add_to_database, new_data,
+                on_success=lambda last_id: QMessageBox.information(
+                    self, "Produkt tilføjet", f"Nyt produkt med SKU {new_data['SKU']} er blevet tilføjet."),
+                error_message="Der opstod en fejl ved tilføjelse af rækken")
+
+    def add_to_database(self, data, include_id=False, undo_label="Tilføj produkt"):
+        """Kører på DbWorker - kalderen sørger for notify_database_changed"""
         try:
-            cursor = conn.cursor()
             if not include_id and 'UniqueID' in data:
                 del data['UniqueID']
-            columns = list(data.keys())
-            placeholders = ', '.join('?' for _ in columns)
-            column_names = ', '.join(f'"{col}"' for col in columns)
-            sql = f'INSERT INTO products ({column_names}) VALUES ({placeholders})'
-            cursor.execute(sql, tuple(data.values()))
-            conn.commit()
-            last_id = cursor.lastrowid
-            return last_id
+            return self.repository.insert(data, undo_label=undo_label)
         except sqlite3.Error as e:
-            conn.rollback()
             logging.error(f"Database fejl: {str(e)}")
             raise
-        finally:
-            conn.close()
 
     def upload_to_dropbox(self):
-        if not self.dbx_client:
+        if not self.storage:
             QMessageBox.warning(self, "Fejl", "Dropbox-klient ikke tilgængelig. Kontroller dine indstillinger.")
             return
 
@@ -998,79 +1551,207 @@ class MainWindow(QMainWindow):
             self.upload_to_dropbox_button.setEnabled(False)
             self.statusBar().showMessage("Uploader til Dropbox...")
 
-            backup_path = self.create_backup()
-
             try:
-                self.dropbox_sync = DropboxSync(self.db_path, self.dbx_client)
+                self.dropbox_sync = DropboxSync(self.db_path, self.storage)
                 self.dropbox_sync.status.connect(self.update_status)
+                self.dropbox_sync.progress.connect(self.update_progress)
+                self.dropbox_sync.error.connect(self.on_dropbox_upload_error)
                 self.dropbox_sync.finished.connect(self.on_dropbox_upload_finished)
                 self.dropbox_sync.start()
                 self.threads.append(self.dropbox_sync)
-                self.add_to_undo_stack("upload_to_dropbox")
             except Exception as e:
                 logging.error(f"Fejl under upload til Dropbox: {str(e)}")
                 QMessageBox.critical(self, "Fejl", f"Der opstod en fejl under upload: {str(e)}\n\n"
                                                    f"En logfil er blevet gemt i {get_app_data_dir()}\n"
                                                    f"Venligst send denne logfil til support for hjælp.")
-                if backup_path:
-                    self.restore_from_backup(backup_path)
             finally:
                 self.upload_to_dropbox_button.setEnabled(True)
 
-    def create_backup(self):
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_dir = os.path.join(get_app_data_dir(), 'backups')
-        os.makedirs(backup_dir, exist_ok=True)
-        backup_path = os.path.join(backup_dir, f'products_backup_{timestamp}.db')
-        shutil.copy2(self.db_path, backup_path)
-        logging.info(f"Backup oprettet: {backup_path}")
-        self.statusBar().showMessage(f"Backup oprettet: {backup_path}")
-        return backup_path
-
-    def restore_from_backup(self, backup_path):
-        if backup_path and os.path.exists(backup_path):
-            try:
-                shutil.copy2(backup_path, self.db_path)
-                logging.info("Database gendannet fra backup")
-                self.load_existing_data()
-            except Exception as e:
-                logging.error(f"Fejl ved gendannelse fra backup: {str(e)}")
-                QMessageBox.critical(self, "Backup Fejl", "Der opstod en fejl ved gendannelse fra backup. Kontakt venligst support.")
-        else:
-            logging.error("Ingen gyldig backup-fil fundet")
+    def restore_from_backup(self, snapshot_id, on_restored=None):
+        """Gendanner databasen fra backuppen, så snart ingen overførsel kører, og kalder derefter on_restored()"""
+        manager = get_backup_manager()
+        if not manager.exists(snapshot_id):
+            logging.error(f"Ingen gyldig backup fundet: {snapshot_id}")
+            return
+
+        def restore():
+            self.close_database_connection()
+            manager.restore(snapshot_id, self.db_path)
+            logging.info(f"Database gendannet fra backup {snapshot_id}")
 
-    def perform_critical_operation(self, operation, *args):
-        backup_path = self.create_backup()
+        def restored(_):
+            self.notify_database_changed()
+            self.load_existing_data()
+            if on_restored:
+                on_restored()
+
+        def failed(error):
+            logging.error(f"Fejl ved gendannelse fra backup: {str(error)}")
+            QMessageBox.critical(self, "Backup Fejl", "Der opstod en fejl ved gendannelse fra backup. Kontakt venligst support.")
+        self.run_with_transfer_lock(restore, restored, failed)
+
+    def run_with_transfer_lock(self, operation, on_success, on_error):
+        """Kører operation() på GUI-tråden med transfer_lock holdt og derefter on_success(resultat)
+        eller on_error(undtagelse), når låsen er frigivet.
+
+        Kører en overførsel, ventes der ikke på låsen; i stedet prøves igen efter
+        TRANSFER_LOCK_RETRY_MS, så brugerfladen ikke fryser under en upload. Indtil da er de
+        skrivende handlinger spærret, så databasen ikke ændres imellem.
+        """
+        if not transfer_lock.acquire(blocking=False):
+            self.set_file_swap_pending(True)
+            self.statusBar().showMessage("Venter på at synkroniseringen med Dropbox bliver færdig...")
+            QTimer.singleShot(config.TRANSFER_LOCK_RETRY_MS,
+                              lambda: self.run_with_transfer_lock(operation, on_success, on_error))
+            return
         try:
-            result = operation(*args)
-            return result
+            try:
+                result = operation()
+            finally:
+                transfer_lock.release()
+                self.set_file_swap_pending(False)
+            on_success(result)
         except Exception as e:
-            if backup_path:
-                self.restore_from_backup(backup_path)
-            raise e
-
-    def execute_db_operation(self, operation, args=()):
-        conn = sqlite3.connect(self.db_path)
+            on_error(e)
+
+    def perform_critical_operation(self, operation, *args, on_success=None, error_message=None, update_model=None):
+        """Tager en backup og kører operation(*args) på DbWorker. Se run_db_operation"""
+        # Operationen kører i én transaktion der rulles tilbage ved fejl, så backuppen er kun
+        # et sikkerhedsnet. Den gendannes ikke automatisk, da den kan være op til
+        # BACKUP_MIN_INTERVAL_SECONDS gammel
+        def critical():
+            get_backup_manager().create_snapshot(self.db_path, label='edit')
+            return operation(*args)
+        return self.run_db_operation(critical, on_success, error_message, update_model)
+
+    def run_db_operation(self, operation, on_success=None, error_message=None, update_model=None):
+        """Kører operation() på DbWorker og genindlæser tabel, udløbsspande og fortryd-historik i
+        samme baggrundsjob. Tabellen opdateres på GUI-tråden før on_success(resultat) kaldes.
+
+        Med update_model genindlæses tabellen ikke; i stedet kaldes update_model(resultat, spande), som
+        kun retter de berørte rækker i modellen. operation må ikke røre widgets. Ved fejl vises
+        error_message med fejlen og henvisning til logfilen.
+        """
+        # Ventende rettelser fra tabellen skal skrives før operationen, så rækkefølgen bevares
+        self.cell_edits.flush()
+
+        def job():
+            result = operation()
+            table_data = (None, self.expiry_buckets.compute()) if update_model else self.fetch_table_data()
+            return result, table_data, self.read_undo_history()
+
+        def done(outcome):
+            result, (df, buckets), undo_history = outcome
+            self.notify_database_changed(undo_history)
+            if update_model:
+                update_model(result, buckets)
+                self.update_expiry_summary(buckets)
+                self.update_status_bar()
+            else:
+                self.update_table(df, buckets)
+            if on_success:
+                on_success(result)
+
+        def failed(error):
+            # Transaktionen er rullet tilbage, men tabellen genindlæses, hvis fejlen kom efter skrivningen
+            self.reload_table_async()
+            self.show_database_error(error_message or "Der opstod en fejl i databasen", error)
+
+        return self.db_worker.run(job, done, failed)
+
+    def reload_table_async(self):
+        self.db_worker.run(self.fetch_table_data, lambda table_data: self.update_table(*table_data))
+
+    def show_database_error(self, message, error):
+        QMessageBox.critical(self, "Fejl", f"{message}: {str(error)}\n\n"
+                                           f"En logfil er blevet gemt i {get_app_data_dir()}\n"
+                                           f"Venligst send denne logfil til support for hjælp.")
+
+    def on_db_busy_changed(self, busy):
+        """Spærrer de handlinger der skriver til databasen, mens en databaseoperation kører"""
+        self.update_write_controls()
+        if busy:
+            self.statusBar().showMessage("Gemmer ændringer...")
+
+    def set_file_swap_pending(self, pending):
+        """Spærrer de skrivende handlinger, mens databasefilen hentes, udskiftes eller gendannes"""
+        self.file_swap_pending = pending
+        self.update_write_controls()
+
+    def update_write_controls(self):
+        """Tabellen kan heller ikke redigeres, da en ny rettelse ellers ville gå tabt ved genindlæsningen"""
+        blocked = self.db_worker.busy or self.file_swap_pending
+        self.table_view.setEditTriggers(QTableView.NoEditTriggers if blocked else self.table_edit_triggers)
+        for control in (self.add_row_button, self.clear_db_action, self.delete_expired_action,
+                        self.create_empty_db_action):
+            control.setEnabled(not blocked)
+        self.download_from_dropbox_button.setEnabled(not blocked and self.storage is not None)
+        self.update_undo_buttons()
+
+    def execute_db_operation(self, operation, args=(), undo_label=None):
         try:
-            cursor = conn.cursor()
-            conn.execute('BEGIN')
-            cursor.execute(operation, args)
-            conn.commit()
-            return cursor.fetchall()
+            result = self.repository.execute(operation, args, undo_label=undo_label)
+            self.notify_database_changed()
+            return result
         except sqlite3.Error as e:
-            conn.rollback()
             logging.error(f"Database fejl: {str(e)}")
             raise
-        finally:
-            conn.close()
 
-    def on_dropbox_upload_finished(self):
+    def start_auto_sync(self):
+        if not config.AUTO_SYNC_ENABLED or not self.storage:
+            return
+        self.auto_sync_status.connect(self.update_status)
+        self.auto_sync = AutoSyncScheduler(
+            self.run_auto_sync,
+            debounce_seconds=config.AUTO_SYNC_DEBOUNCE_SECONDS,
+            retry_seconds=config.AUTO_SYNC_RETRY_SECONDS,
+            max_delay_seconds=config.AUTO_SYNC_MAX_DELAY_SECONDS,
+            is_online=self.storage.is_online,
+            status_callback=self.auto_sync_status.emit
+        )
+        self.auto_sync.start()
+        logging.info("Automatisk synkronisering med Dropbox startet")
+
+    def run_auto_sync(self):
+        """Kører på auto-sync tråden med transfer_lock holdt - må ikke røre widgets"""
+        try:
+            upload_database_snapshot(self.storage, self.db_path)
+        except SyncConflictError as e:
+            # En konflikt løses ikke af at prøve igen - brugeren skal hente den nyeste version først
+            logging.warning(f"Automatisk synkronisering sprunget over: {e}")
+            self.auto_sync_status.emit("Dropbox-kopien er nyere end den lokale database. Hent den fra Dropbox.")
+        except (dropbox.exceptions.HttpError, requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout) as e:
+            raise OfflineError(str(e)) from e
+
+    def notify_database_changed(self, undo_history=None):
+        """Kaldes efter hver lokal skrivning, så auto-sync kan samle dem til én upload. undo_history er
+        (fortryd, gentag) fra read_undo_history, hvis den allerede er læst på DbWorker"""
+        if self.auto_sync:
+            self.auto_sync.notify_write()
+        if undo_history is None:
+            self.refresh_undo_history()
+        else:
+            self.apply_undo_history(*undo_history)
+
+    def log_dropbox_session_stats(self):
+        if self.dropbox_auth.session_manager:
+            self.dropbox_auth.session_manager.log_stats()
+
+    def on_dropbox_upload_error(self, title, message):
+        QMessageBox.warning(self, title, message)
+
+    def on_dropbox_upload_finished(self, backup_id):
         self.upload_to_dropbox_button.setEnabled(True)
-        QMessageBox.information(self, "Dropbox Upload", "Upload til Dropbox fuldført.")
+        if backup_id:
+            logging.info(f"Backup før upload: {backup_id}")
+        self.log_dropbox_session_stats()
+        if not self.dropbox_sync.failed:
+            QMessageBox.information(self, "Dropbox Upload", "Upload til Dropbox fuldført.")
         self.update_status_bar()
 
     def download_from_dropbox(self):
-        if not self.dbx_client:
+        if not self.storage:
             QMessageBox.warning(self, "Fejl", "Dropbox-klient ikke tilgængelig. Kontroller dine indstillinger.")
             return
 
@@ -1078,49 +1759,79 @@ class MainWindow(QMainWindow):
                                     "Er du sikker på, at du vil hente databasen fra Dropbox? Dette vil overskrive din lokale database.",
                                     QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
-            self.download_from_dropbox_button.setEnabled(False)
             self.statusBar().showMessage("Henter database fra Dropbox...")
 
-            backup_path = self.create_backup()
-
-            try:
-                _, response = self.dbx_client.files_download("/products.db")
-                data = response.content
+            # Ventende rettelser skrives før downloaden, og ingen nye skrivninger startes, før filen er udskiftet
+            self.cell_edits.flush()
+            self.set_file_swap_pending(True)
+
+            self.dropbox_download = DropboxDownload(self.db_path, self.storage, self.replace_database_file)
+            self.dropbox_download.status.connect(self.update_status)
+            self.dropbox_download.progress.connect(self.update_progress)
+            self.dropbox_download.error.connect(self.on_dropbox_download_error)
+            self.dropbox_download.completed.connect(self.on_dropbox_download_completed)
+            self.dropbox_download.finished.connect(self.on_dropbox_download_finished)
+            self.threads.append(self.dropbox_download)
+            self.dropbox_download.start()
+
+    def replace_database_file(self, new_path, backup_id=None):
+        """Udskifter databasefilen med new_path og opretter skema, triggers og indekser i den.
+
+        Kaldes med transfer_lock holdt, typisk på downloadtråden, og rører derfor ingen widgets.
+        Ventende rettelser i tabellen skal være sendt til DbWorker først. Fejler opsætningen af den
+        nye fil, gendannes backup_id, før fejlen rejses igen.
+        """
+        self.close_connections()
+        os.replace(new_path, self.db_path)
+        try:
+            self.initialize_database(show_migration_notice=False)
+        except Exception:
+            if backup_id:
+                self.close_connections()
+                get_backup_manager().restore(backup_id, self.db_path)
+                logging.info(f"Database gendannet fra backup {backup_id}")
+            raise
 
-                temp_db_path = self.db_path + ".temp"
-                with open(temp_db_path, "wb") as temp_file:
-                    temp_file.write(data)
+    def on_dropbox_download_completed(self, replaced, metadata, backup_id):
+        """Kører på GUI-tråden, når downloadtråden har byttet filen ind: genindlæser tabellen én gang"""
+        if not replaced:
+            self.statusBar().showMessage("Databasen er allerede opdateret - intet at hente.")
+            QMessageBox.information(self, "Dropbox Download",
+                                    "Din lokale database er allerede identisk med versionen i Dropbox.")
+            return
+        # Historikken i den hentede fil hører til en anden enhed. Downloaden selv fortrydes fra backup
+        self.record_file_replacement("Hent database fra Dropbox", backup_id)
+        self.load_existing_data()
+        self.statusBar().showMessage("Database hentet fra Dropbox og opdateret lokalt.")
+        QMessageBox.information(self, "Dropbox Download", "Download fra Dropbox fuldført og lokal database opdateret.")
 
-                self.close_database_connection()
+    def sync_changesets(self):
+        if not self.storage:
+            QMessageBox.warning(self, "Fejl", "Dropbox-klient ikke tilgængelig. Kontroller dine indstillinger.")
+            return
+        self.statusBar().showMessage("Synkroniserer ændringer med Dropbox...")
+        self.changeset_sync_worker = ChangesetSyncWorker(self.db_path, self.storage)
+        self.changeset_sync_worker.status.connect(self.update_status)
+        self.changeset_sync_worker.error.connect(self.on_dropbox_download_error)
+        self.changeset_sync_worker.completed.connect(self.on_changeset_sync_completed)
+        self.threads.append(self.changeset_sync_worker)
+        self.changeset_sync_worker.start()
+
+    def on_changeset_sync_completed(self, stats):
+        if stats['applied']:
+            self.load_existing_data()
+        self.statusBar().showMessage(
+            f"Ændringer synkroniseret: {stats['pushed']} sendt, {stats['applied']} modtaget "
+            f"({(stats['pushed_bytes'] + stats['pulled_bytes']) / 1024:.1f} KB)"
+        )
 
-                os.replace(temp_db_path, self.db_path)
+    def on_dropbox_download_error(self, title, message):
+        QMessageBox.critical(self, title, message)
 
-                self.initialize_database()
-                self.statusBar().showMessage("Database hentet fra Dropbox og opdateret lokalt.")
-                self.load_existing_data()
-                QMessageBox.information(self, "Dropbox Download", "Download fra Dropbox fuldført og lokal database opdateret.")
-                self.add_to_undo_stack("download_from_dropbox", backup_path)
-            except dropbox.exceptions.AuthError as e:
-                error_msg = "Autentificeringsfejl med Dropbox. Kontroller din adgangstoken."
-                logging.error(f"Dropbox autentificeringsfejl: {e}")
-                QMessageBox.critical(self, "Dropbox Fejl", error_msg)
-                if backup_path:
-                    self.restore_from_backup(backup_path)
-            except dropbox.exceptions.HttpError as e:
-                error_msg = "Netværksfejl. Kontroller din internetforbindelse."
-                logging.error(f"Dropbox netværksfejl: {e}")
-                QMessageBox.critical(self, "Netværksfejl", error_msg)
-                if backup_path:
-                    self.restore_from_backup(backup_path)
-            except Exception as e:
-                error_msg = f"Der opstod en fejl ved hentning af databasen: {e}"
-                logging.error(f"Fejl ved hentning af databasen fra Dropbox: {e}")
-                QMessageBox.critical(self, "Fejl", error_msg)
-                if backup_path:
-                    self.restore_from_backup(backup_path)
-            finally:
-                self.download_from_dropbox_button.setEnabled(True)
-                self.update_status_bar()
+    def on_dropbox_download_finished(self):
+        self.set_file_swap_pending(False)
+        self.log_dropbox_session_stats()
+        self.update_status_bar()
 
     def close_database_connection(self):
         # Hvis du har en vedvarende databaseforbindelse, skal du lukke den her
@@ -1128,15 +1839,107 @@ class MainWindow(QMainWindow):
 
     def show_context_menu(self, pos):
         index = self.table_view.indexAt(pos)
-        if index.isValid():
-            menu = QMenu(self)
+        menu = QMenu(self)
+        selected = self.selected_products()
+        if len(selected) > 1:
+            edit_action = QAction(f"Ret felt for {len(selected)} valgte produkter...", self)
+            edit_action.triggered.connect(lambda: self.edit_selected_rows(selected))
+            delete_action = QAction(f"Slet {len(selected)} valgte produkter", self)
+            delete_action.triggered.connect(lambda: self.delete_selected_rows(selected))
+            menu.addAction(edit_action)
+            menu.addAction(delete_action)
+        elif index.isValid():
             edit_action = QAction("Rediger produkt", self)
             edit_action.triggered.connect(lambda: self.edit_row(index))
             delete_action = QAction("Slet produkt", self)
             delete_action.triggered.connect(lambda: self.delete_row(index))
             menu.addAction(edit_action)
             menu.addAction(delete_action)
-            menu.exec_(self.table_view.viewport().mapToGlobal(pos))
+        menu.addSeparator()
+        menu.addAction(self.delete_expired_action)
+        for action in menu.actions():
+            action.setEnabled(not self.db_worker.busy)
+        menu.exec_(self.table_view.viewport().mapToGlobal(pos))
+
+    def selected_products(self):
+        """De markerede rækker som [(UniqueID, beskrivelse)] i visningens rækkefølge"""
+        id_column_index = self.get_column_index('UniqueID')
+        description_index = self.get_column_index('Article Description Batch')
+        if id_column_index == -1:
+            return []
+        products = []
+        for index in sorted(self.table_view.selectionModel().selectedRows(), key=lambda index: index.row()):
+            row = self.proxy_model.mapToSource(index).row()
+            row_id = self.model.item(row, id_column_index).text()
+            if row_id:
+                description = self.model.item(row, description_index).text() if description_index != -1 else ''
+                products.append((row_id, description))
+        return products
+
+    def confirm_batch_delete(self, title, products):
+        names = "\n".join(description for _, description in products[:10])
+        more = f"\n... og {len(products) - 10} flere" if len(products) > 10 else ""
+        reply = QMessageBox.question(
+            self,
+            title,
+            f"Er du sikker på, at du vil slette {len(products)} produkter?\n\n{names}{more}\n\n"
+            f"Sletningen kan fortrydes samlet.",
+            QMessageBox.Yes | QMessageBox.No,
+            QMessageBox.No
+        )
+        return reply == QMessageBox.Yes
+
+    def delete_selected_rows(self, products):
+        """Sletter de markerede produkter i én transaktion og én fortryd-gruppe"""
+        if not products or not self.confirm_batch_delete('Bekræft sletning', products):
+            return
+        row_ids = [row_id for row_id, _ in products]
+        self.perform_critical_operation(
+            self.repository.delete_many, row_ids, f"Slet {len(row_ids)} produkter",
+            update_model=lambda deleted, buckets: self.remove_model_rows(row_ids),
+            on_success=lambda deleted: self.statusBar().showMessage(f"{deleted} produkter er blevet slettet."),
+            error_message="Der opstod en fejl ved sletning af produkterne")
+
+    def edit_selected_rows(self, products):
+        """Sætter ét felt til samme værdi for alle markerede produkter i én transaktion"""
+        dialog = BatchEditDialog(self, len(products))
+        if not dialog.exec_():
+            return
+        column, value = dialog.get_data()
+        cells = [(row_id, column, value) for row_id, _ in products]
+        self.perform_critical_operation(
+            self.repository.update_cells, cells, f"Ret {column} for {len(cells)} produkter",
+            update_model=lambda updated, buckets: self.update_model_cells(cells, buckets['bucket_of']),
+            on_success=lambda updated: self.statusBar().showMessage(f"{column} er rettet for {updated} produkter."),
+            error_message="Der opstod en fejl ved redigering af produkterne")
+
+    def delete_expired_products(self):
+        """Sletter alle produkter hvis udløbsdato er passeret, i én transaktion og én fortryd-gruppe"""
+        expired_ids = set(self.expiry_buckets.compute()['ids'][EXPIRED])
+        if not expired_ids:
+            QMessageBox.information(self, "Ingen udløbne produkter", "Der er ingen produkter hvis udløbsdato er passeret.")
+            return
+        id_column_index = self.get_column_index('UniqueID')
+        description_index = self.get_column_index('Article Description Batch')
+        products = [(self.model.item(row, id_column_index).text(),
+                     self.model.item(row, description_index).text() if description_index != -1 else '')
+                    for row in self.model_rows_by_id(expired_ids).values()]
+        if not products or not self.confirm_batch_delete('Slet udløbne produkter', products):
+            return
+        confirmed_ids = {int(row_id) for row_id, _ in products}
+
+        def delete_expired():
+            # Spandene læses igen på DbWorker, så produkter der er rettet i mellemtiden ikke slettes. Kun
+            # produkter brugeren har set og bekræftet slettes, også hvis flere er udløbet i mellemtiden
+            row_ids = [row_id for row_id in self.expiry_buckets.compute()['ids'][EXPIRED] if row_id in confirmed_ids]
+            self.repository.delete_many(row_ids, undo_label=f"Slet {len(row_ids)} udløbne produkter")
+            return row_ids
+
+        self.perform_critical_operation(
+            delete_expired,
+            update_model=lambda row_ids, buckets: self.remove_model_rows(row_ids),
+            on_success=lambda row_ids: self.statusBar().showMessage(f"{len(row_ids)} udløbne produkter er blevet slettet."),
+            error_message="Der opstod en fejl ved sletning af de udløbne produkter")
 
     def edit_row(self, index):
         source_index = self.proxy_model.mapToSource(index)
@@ -1162,15 +1965,10 @@ class MainWindow(QMainWindow):
         dialog = EditRowDialog(self, data)
         if dialog.exec_():
             new_data = dialog.get_data()
-            try:
-                self.perform_critical_operation(self.update_database_row, row_id, new_data)
-                self.load_existing_data()
-                self.statusBar().showMessage(f"Produkt er blevet opdateret.")
-                self.add_to_undo_stack("edit_row", row_id, data)
-            except Exception as e:
-                QMessageBox.critical(self, "Fejl", f"Der opstod en fejl ved redigering af produktet: {str(e)}\n\n"
-                                                   f"En logfil er blevet gemt i {get_app_data_dir()}\n"
-                                                   f"Venligst send denne logfil til support for hjælp.")
+            self.perform_critical_operation(
+                self.update_database_row, row_id, new_data,
+                on_success=lambda _: self.statusBar().showMessage("Produkt er blevet opdateret."),
+                error_message="Der opstod en fejl ved redigering af produktet")
 
     def delete_row(self, index):
         source_index = self.proxy_model.mapToSource(index)
@@ -1202,113 +2000,94 @@ class MainWindow(QMainWindow):
         )
 
         if reply == QMessageBox.Yes:
-            try:
-                self.perform_critical_operation(self.delete_from_database, row_id)
-                self.load_existing_data()
-                self.statusBar().showMessage(f"Produkt er blevet slettet.")
-                self.add_to_undo_stack("delete_row", row_id, data)
-            except Exception as e:
-                QMessageBox.critical(self, "Fejl", f"Der opstod en fejl ved sletning af produktet: {str(e)}\n\n"
-                                                   f"En logfil er blevet gemt i {get_app_data_dir()}\n"
-                                                   f"Venligst send denne logfil til support for hjælp.")
+            self.perform_critical_operation(
+                self.delete_from_database, row_id,
+                on_success=lambda _: self.statusBar().showMessage("Produkt er blevet slettet."),
+                error_message="Der opstod en fejl ved sletning af produktet")
 
     def delete_from_database(self, row_id):
-        self.execute_db_operation('''
-            DELETE FROM products 
-            WHERE UniqueID=?
-        ''', (row_id,))
+        try:
+            return self.repository.delete(row_id, undo_label="Slet produkt")
+        except sqlite3.Error as e:
+            logging.error(f"Database fejl: {str(e)}")
+            raise
 
     def update_database_row(self, row_id, new_data):
-        columns = ["ProductID", "SKU", "Article Description Batch", "Expiry Date", "EAN Serial No",
-                   "Remark", "Order QTY", "Ship QTY", "UOM", "PDF Source"]
-        values = [new_data.get(col, '') for col in columns]
-        self.execute_db_operation(f'''
-            UPDATE products
-            SET {', '.join([f'"{col}"=?' for col in columns])}
-            WHERE UniqueID=?
-        ''', tuple(values) + (row_id,))
-
-    def add_to_undo_stack(self, action, *args):
-        self.undo_stack.append((action, args))
-        self.undo_button.setEnabled(True)
+        try:
+            return self.repository.update(row_id, new_data, undo_label="Rediger produkt")
+        except sqlite3.Error as e:
+            logging.error(f"Database fejl: {str(e)}")
+            raise
+
+    def read_undo_history(self):
+        """Beskærer fortryd-historikken og returnerer (fortryd, gentag). Rører ingen widgets"""
+        try:
+            self.undo_journal.prune()
+            return self.undo_journal.peek_undo(), self.undo_journal.peek_redo()
+        except sqlite3.Error as e:
+            logging.error(f"Fejl ved læsning af fortryd-historik: {str(e)}")
+            return None, None
+
+    def refresh_undo_history(self):
+        """Beskærer fortryd-historikken og opdaterer knapperne efter den"""
+        self.apply_undo_history(*self.read_undo_history())
+
+    def apply_undo_history(self, undo_group_info, redo_group_info):
+        self.undo_group_info = undo_group_info
+        self.redo_group_info = redo_group_info
+        self.update_undo_buttons()
+
+    def update_undo_buttons(self):
+        busy = self.db_worker.busy or self.file_swap_pending
+        self.undo_button.setEnabled(self.undo_group_info is not None and not busy)
+        self.undo_button.setToolTip(f"Fortryd: {self.undo_group_info['label']}" if self.undo_group_info
+                                    else "Klik her for at fortryde den seneste handling")
+        self.redo_button.setEnabled(self.redo_group_info is not None and not busy)
+        self.redo_button.setToolTip(f"Gentag: {self.redo_group_info['label']}" if self.redo_group_info
+                                    else "Klik her for at gentage den senest fortrudte handling")
+
+    def record_file_replacement(self, label, backup_id):
+        """Registrerer en handling der erstattede hele databasefilen, så den kan fortrydes fra backup"""
+        def record(conn):
+            install_undo_journal(conn)
+            reset_journal(conn)
+            record_snapshot_group(conn, label, backup_id)
+        self.repository.run_alone(record)
+        self.refresh_undo_history()
 
     def undo_last_action(self):
-        if not self.undo_stack:
+        group = self.undo_group_info
+        if group is None:
             return
-        action, args = self.undo_stack.pop()
-        try:
-            if action == "add_row":
-                self.undo_add_row(args[0])
-            elif action == "edit_row":
-                self.undo_edit_row(args[0], args[1])
-            elif action == "delete_row":
-                self.undo_delete_row(args[0], args[1])
-            elif action == "upload_pdf":
-                self.undo_pdf_upload(args[0])
-            elif action == "upload_to_dropbox":
-                self.undo_dropbox_upload()
-            elif action == "download_from_dropbox":
-                self.undo_download_from_dropbox(args[0])
-            elif action == "clear_database":
-                self.undo_clear_database(args[0])
-        except Exception as e:
-            logging.error(f"Fejl ved undo-handling: {str(e)}")
-            QMessageBox.critical(self, "Fejl", f"Der opstod en fejl ved fortryd-handlingen: {str(e)}\n\n"
-                                               f"En logfil er blevet gemt i {get_app_data_dir()}\n"
-                                               f"Venligst send denne logfil til support for hjælp.")
-        finally:
-            self.load_existing_data()
-            if not self.undo_stack:
-                self.undo_button.setEnabled(False)
-
-    def undo_add_row(self, row_id):
-        self.delete_from_database(row_id)
-        self.statusBar().showMessage(f"Fortryd: Fjernet nyligt tilføjet produkt")
-
-    def undo_edit_row(self, row_id, old_data):
-        self.update_database_row(row_id, old_data)
-        self.statusBar().showMessage(f"Fortryd: Gendannet original data for produkt")
-
-    def undo_delete_row(self, row_id, data):
-        data['UniqueID'] = row_id
-        self.add_to_database(data, include_id=True)
-        self.statusBar().showMessage(f"Fortryd: Gendannet slettet produkt")
-
-    def undo_pdf_upload(self, file_path):
-        self.execute_db_operation('DELETE FROM products WHERE "PDF Source"=?', (os.path.basename(file_path),))
-        self.statusBar().showMessage(f"Fortryd: Fjernet data fra PDF-fil: {os.path.basename(file_path)}")
-
-    def undo_dropbox_upload(self):
-        QMessageBox.information(self, "Fortryd Upload",
-                                "Fortrydelse af Dropbox-upload er ikke mulig. Venligst upload den seneste version igen, hvis nødvendigt.")
-        self.statusBar().showMessage("Fortryd: Kan ikke fortryde Dropbox-upload.")
-
-    def undo_download_from_dropbox(self, backup_path):
-        self.restore_from_backup(backup_path)
-        self.statusBar().showMessage("Fortryd: Gendannet lokal database fra backup efter download fra Dropbox.")
-
-    def undo_clear_database(self, backup_path):
-        """Gendan database fra backup efter rydning"""
-        if os.path.exists(backup_path):
-            try:
-                # Luk forbindelse til databasen
-                self.close_database_connection()
-                
-                # Gendan fra backup
-                shutil.copy2(backup_path, self.db_path)
-                
-                # Genindlæs data
-                self.load_existing_data()
-                self.statusBar().showMessage("Database gendannet fra backup")
-                logging.info(f"Database gendannet fra backup: {backup_path}")
-                
-            except Exception as e:
-                logging.error(f"Fejl ved gendannelse af database: {str(e)}")
-                QMessageBox.critical(
-                    self,
-                    "Fejl",
-                    f"Der opstod en fejl ved gendannelse af databasen:\n{str(e)}"
-                )
+        if group['snapshot_id']:
+            # Gendannelsen udskifter databasefilen og sker, når ingen overførsel bruger den
+            self.undo_file_replacement(group)
+            return
+
+        def undone(group):
+            if group is not None and not group['snapshot_id']:
+                self.statusBar().showMessage(f"Fortryd: {group['label']} ({group['row_count']} rækker)")
+        self.run_db_operation(self.undo_journal.undo, undone, "Der opstod en fejl ved fortryd-handlingen")
+
+    def redo_last_action(self):
+        def redone(group):
+            if group is not None:
+                self.statusBar().showMessage(f"Gentag: {group['label']} ({group['row_count']} rækker)")
+        self.run_db_operation(self.undo_journal.redo, redone, "Der opstod en fejl ved gentag-handlingen")
+
+    def undo_file_replacement(self, group):
+        """Fortryder en download eller ny database ved at gendanne backuppen fra før handlingen.
+
+        Den gendannede fil har sin egen historik fra før handlingen, så fortryd fortsætter derfra.
+        """
+        if not get_backup_manager().exists(group['snapshot_id']):
+            self.undo_journal.discard(group['group_id'])
+            self.refresh_undo_history()
+            QMessageBox.warning(self, "Fortryd", f"Backuppen fra før \"{group['label']}\" findes ikke længere "
+                                                 f"og handlingen kan ikke fortrydes.")
+            return
+        self.restore_from_backup(group['snapshot_id'], lambda: self.statusBar().showMessage(
+            f"Fortryd: {group['label']} - lokal database gendannet fra backup"))
 
     def update_status_bar(self):
         total_products = self.model.rowCount()
@@ -1333,6 +2112,24 @@ class MainWindow(QMainWindow):
 
             if reply == QMessageBox.Yes:
                 self.terminate_threads()
+                # Alle lokale skrivninger skal være udført før den sidste synkronisering: ventende
+                # cellerettelser og operationer på DbWorker. Deres callbacks når ikke at køre, så
+                # auto-sync får besked her
+                unsynced_writes = self.cell_edits.pending > 0 or self.db_worker.busy
+                self.cell_edits.flush()
+                self.db_worker.shutdown()
+                logging.info(f"DbWorker statistik: {self.db_worker.stats()}")
+                if self.auto_sync:
+                    if unsynced_writes:
+                        self.auto_sync.notify_write()
+                    # Send ventende ændringer før programmet lukkes
+                    self.auto_sync.stop(timeout=config.AUTO_SYNC_SHUTDOWN_TIMEOUT, flush=True)
+                    logging.info(f"Auto-sync statistik: {self.auto_sync.stats()}")
+                if self.stall_monitor:
+                    self.stall_monitor.log_summary("hele sessionen")
+                # Ventende skrivninger udføres og WAL'en checkpointes ind i databasefilen
+                logging.info(f"Skriver-statistik: {self.repository.stats()}")
+                self.close_database_connection(replace_file=False)
 
                 # Luk alle logging handlers
                 for handler in logging.root.handlers[:]:
@@ -1379,15 +2176,8 @@ class MainWindow(QMainWindow):
     def create_backup_before_clear(self):
         """Opret backup af databasen før rydning"""
         try:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_dir = os.path.join(get_app_data_dir(), "backups")
-            os.makedirs(backup_dir, exist_ok=True)
-            
-            backup_path = os.path.join(backup_dir, f"database_backup_before_clear_{timestamp}.db")
-            shutil.copy2(self.db_path, backup_path)
-            
-            logging.info(f"Backup oprettet: {backup_path}")
-            return backup_path
+            # Altid et nyt snapshot, så rydningen kan fortrydes til præcis denne tilstand
+            return get_backup_manager().create_snapshot(self.db_path, label='before_clear', force=True)
             
         except Exception as e:
             logging.error(f"Fejl ved oprettelse af backup: {str(e)}")
@@ -1406,42 +2196,26 @@ class MainWindow(QMainWindow):
         )
         
         if reply == QMessageBox.Yes:
-            try:
+            def clear():
                 # Opret backup først
-                backup_path = self.create_backup_before_clear()
-                
-                # Ryd databasen
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                cursor.execute('DELETE FROM products')
-                conn.commit()
-                conn.close()
-                
-                # Opdater visning
-                self.load_existing_data()
-                self.update_status_bar()
-                
-                # Tilføj til undo stack
-                self.add_to_undo_stack("clear_database", backup_path)
-                
+                backup_id = self.create_backup_before_clear()
+                # Ryd databasen. Sletningen journaliseres, så fortryd kun genindsætter de slettede rækker
+                self.repository.clear(undo_label="Ryd database")
+                return backup_id
+
+            def cleared(backup_id):
                 QMessageBox.information(
                     self,
                     "Database Ryddet",
                     f"Databasen er blevet ryddet.\n"
-                    f"En backup er gemt her:\n{backup_path}"
+                    f"En backup er gemt som:\n{backup_id}"
                 )
-                
                 logging.info("Database ryddet succesfuldt")
-                
-            except Exception as e:
-                logging.error(f"Fejl ved rydning af database: {str(e)}")
-                QMessageBox.critical(
-                    self,
-                    "Fejl",
-                    f"Der opstod en fejl ved rydning af databasen:\n{str(e)}\n\n"
-                    f"Hvis der blev oprettet en backup, kan den findes i:\n"
-                    f"{get_app_data_dir()}/backups/"
-                )
+
+            self.run_db_operation(clear, cleared,
+                                  f"Der opstod en fejl ved rydning af databasen.\n"
+                                  f"Hvis der blev oprettet en backup, kan den findes i:\n"
+                                  f"{get_app_data_dir()}/backups/\n\nFejl")
 
     def create_new_empty_database(self):
         """Opret en ny tom database efter bekræftelse"""
@@ -1457,43 +2231,63 @@ class MainWindow(QMainWindow):
         if reply == QMessageBox.Yes:
             try:
                 # Opret backup først
-                backup_path = self.create_backup_before_clear()
-                
-                # Luk forbindelse til databasen
+                backup_id = self.create_backup_before_clear()
+            except Exception as e:
+                self.show_new_database_error(e)
+                return
+
+            def replace():
+                # Luk forbindelse til databasen, slet den og opret en ny tom database
                 self.close_database_connection()
-                
-                # Slet eksisterende database
                 if os.path.exists(self.db_path):
                     os.remove(self.db_path)
-                
-                # Opret ny tom database
                 self.create_empty_database()
-                
+
+            def replaced(_):
                 # Opdater visning
                 self.load_existing_data()
                 self.update_status_bar()
-                
-                # Tilføj til undo stack
-                self.add_to_undo_stack("clear_database", backup_path)
-                
+
+                # Den nye fil har ingen historik; oprettelsen fortrydes ved at gendanne backuppen
+                self.record_file_replacement("Ny tom database", backup_id)
+
                 QMessageBox.information(
                     self,
                     "Database Oprettet",
                     f"En ny tom database er blevet oprettet.\n"
-                    f"En backup af den gamle database er gemt her:\n{backup_path}"
+                    f"En backup af den gamle database er gemt som:\n{backup_id}"
                 )
-                
+
                 logging.info("Ny tom database oprettet succesfuldt")
-                
-            except Exception as e:
-                logging.error(f"Fejl ved oprettelse af ny database: {str(e)}")
-                QMessageBox.critical(
-                    self,
-                    "Fejl",
-                    f"Der opstod en fejl ved oprettelse af ny database:\n{str(e)}\n\n"
-                    f"Hvis der blev oprettet en backup, kan den findes i:\n"
-                    f"{get_app_data_dir()}/backups/"
-                )
+
+            # Auto-sync må ikke røre filen, mens den udskiftes
+            self.run_with_transfer_lock(replace, replaced, self.show_new_database_error)
+
+    def show_new_database_error(self, error):
+        logging.error(f"Fejl ved oprettelse af ny database: {str(error)}")
+        QMessageBox.critical(
+            self,
+            "Fejl",
+            f"Der opstod en fejl ved oprettelse af ny database:\n{str(error)}\n\n"
+            f"Hvis der blev oprettet en backup, kan den findes i:\n"
+            f"{get_app_data_dir()}/backups/"
+        )
+
+    def ask_refresh_ai_cache(self, file_path):
+        """Spørger om en fil der er behandlet før skal sendes til AI'en igen i stedet for at genbruge
+        de gemte svar. Uden det ville en ny kørsel efter et forkert resultat give samme resultat"""
+        if not config.AI_CACHE_ENABLED or not get_ai_usage_log().has_document(file_sha256(file_path)):
+            return False
+        reply = QMessageBox.question(
+            self,
+            'Fil behandlet før',
+            f"{os.path.basename(file_path)} er behandlet før.\n\n"
+            f"Vil du sende den til AI'en igen? Vælg Ja hvis det forrige resultat var forkert, "
+            f"eller Nej for at genbruge de gemte svar.",
+            QMessageBox.Yes | QMessageBox.No,
+            QMessageBox.No
+        )
+        return reply == QMessageBox.Yes
 
     def handle_image_upload(self):
         """Håndter upload af billede"""
@@ -1502,14 +2296,15 @@ class MainWindow(QMainWindow):
                 self, "Vælg billede", "", "Image Files (*.png *.jpg *.jpeg)"
             )
             if file_path:
+                refresh_ai_cache = self.ask_refresh_ai_cache(file_path)
                 self.statusBar().showMessage("Behandler billede...")
-                self.process_image_file(file_path)
+                self.process_image_file(file_path, refresh_ai_cache)
         except Exception as e:
             logging.error(f"Fejl ved billedupload: {str(e)}")
             QMessageBox.critical(self, "Fejl", 
                 f"Der opstod en fejl ved upload af billedet:\n{str(e)}")
 
-    def process_image_file(self, image_path):
+    def process_image_file(self, image_path, refresh_ai_cache=False):
         """Behandl uploadet billede"""
         try:
             # Opret OpenAI klient
@@ -1517,10 +2312,13 @@ class MainWindow(QMainWindow):
             if not api_key:
                 raise Exception("OpenAI API nøgle ikke fundet. Konfigurer venligst API nøglen i indstillinger.")
             
-            client = OpenAI(api_key=api_key)
+            client = OpenAI(api_key=api_key, max_retries=0)
             
             # Få data fra Vision API
-            json_data = extract_products_with_vision(image_path, client)
+            call_context = {'document_hash': file_sha256(image_path),
+                            'document_name': os.path.basename(image_path),
+                            'refresh_cache': refresh_ai_cache}
+            json_data = route_and_extract_image(image_path, client, call_context)
             
             # Parse JSON og konverter til database format
             products = []
@@ -1555,53 +2353,40 @@ class MainWindow(QMainWindow):
 
     def save_to_database(self, products):
         """Gem produkter i databasen"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            for product in products:
-                cursor.execute('''
-                    INSERT INTO products (
-                        ProductID, SKU, "Article Description Batch", 
-                        "Expiry Date", "EAN Serial No", Remark,
-                        "Order QTY", "Ship QTY", UOM, "PDF Source"
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    product['ProductID'],
-                    product['SKU'],
-                    product['Article Description Batch'],
-                    product['Expiry Date'],
-                    product['EAN Serial No'],
-                    product['Remark'],
-                    product['Order QTY'],
-                    product['Ship QTY'],
-                    product['UOM'],
-                    product['PDF Source']
-                ))
-                
-            conn.commit()
-            conn.close()
-            
-            # Opdater visning
-            self.load_existing_data()
-            self.update_status_bar()
-            
-            QMessageBox.information(self, "Success", 
-                f"Gemt {len(products)} produkter i databasen")
-            
-        except Exception as e:
-            logging.error(f"Fejl ved gemning i database: {str(e)}")
-            QMessageBox.critical(self, "Fejl", 
-                f"Der opstod en fejl ved gemning i databasen:\n{str(e)}")
+        rows = [{col: product[col] for col in PRODUCT_COLUMNS} for product in products]
+        self.run_db_operation(
+            lambda: self.repository.insert_many(rows, undo_label=f"Tilføj {len(products)} produkter fra billede"),
+            lambda count: QMessageBox.information(self, "Success", f"Gemt {count} produkter i databasen"),
+            "Der opstod en fejl ved gemning i databasen")
 
-    def close_database_connection(self):
-        """Luk database forbindelse sikkert"""
+    def close_database_connection(self, replace_file=True):
+        """Luk database forbindelse sikkert.
+
+        Med replace_file forlades WAL-tilstand også, så databasefilen kan udskiftes eller slettes
+        bagefter. Lykkes det ikke, rejses fejlen, og filen må ikke røres.
+        """
+        # Ventende rettelser skal sendes til DbWorker, før forbindelserne lukkes
+        self.cell_edits.flush()
+        self.close_connections(replace_file)
+
+    def close_connections(self, replace_file=True):
+        """Venter på DbWorker og lukker alle forbindelser; se close_database_connection. Rører ingen
+        widgets, så den også kan kaldes fra downloadtråden"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.close()
+            # Igangværende operationer på DbWorker skal være færdige, før forbindelserne lukkes
+            self.db_worker.drain()
+            # Alle vedvarende forbindelser lukkes, før WAL'en forlades; skriveren checkpointer ved lukning
+            self.expiry_buckets.close()
+            self.repository.close()
+            if replace_file:
+                # SQLite fjerner selv -wal og -shm, når den sidste forbindelse skifter til DELETE.
+                # Er en anden forbindelse stadig åben, fejler skiftet i stedet for at filen udskiftes under den
+                release_wal(self.db_path)
             logging.info("Database forbindelse lukket")
         except Exception as e:
             logging.error(f"Fejl ved lukning af database forbindelse: {str(e)}")
+            if replace_file:
+                raise
 
     def handle_pdf_upload(self):
         """Håndter upload af PDF fil"""
@@ -1623,8 +2408,6 @@ class MainWindow(QMainWindow):
                 self.threads.append(processor)
                 processor.start()
                 
-                # Tilføj til undo stack
-                self.add_to_undo_stack("upload_pdf", file_path)
                 
         except Exception as e:
             logging.error(f"Fejl ved PDF upload: {str(e)}")
@@ -1646,6 +2429,7 @@ class MainWindow(QMainWindow):
 
     def on_pdf_processing_finished(self, processor):
         """Håndter færdig PDF processering"""
+        self.notify_database_changed()
         self.load_existing_data()
         self.update_status_bar()
         if hasattr(self, 'progress_bar'):
@@ -1666,6 +2450,7 @@ class MainWindow(QMainWindow):
         if dialog.exec_() == QDialog.Accepted:
             # Efter at dialogen er lukket med accept,
             # opdater dashboardet med de nye data fra databasen.
+            self.notify_database_changed()
             self.load_existing_data()
             self.update_status_bar()
 
@@ -1701,12 +2486,14 @@ class ImageProcessor(QThread):
             if not api_key:
                 raise Exception("OpenAI API nøgle ikke fundet. Konfigurer venligst API nøglen i indstillinger.")
             
-            client = OpenAI(api_key=api_key)
+            client = OpenAI(api_key=api_key, max_retries=0)
             self.progress.emit(20)
             
             self.status.emit("Analyserer billede med Vision AI...")
             try:
-                json_data = extract_products_with_vision(self.image_path, client)
+                call_context = {'document_hash': file_sha256(self.image_path),
+                                'document_name': os.path.basename(self.image_path)}
+                json_data = route_and_extract_image(self.image_path, client, call_context)
                 if not json_data or 'products' not in json_data:
                     raise Exception("Intet brugbart resultat fra Vision AI")
             except Exception as e:
@@ -1738,31 +2525,9 @@ class ImageProcessor(QThread):
             self.progress.emit(80)
             
             self.status.emit("Gemmer i database...")
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            for product in products:
-                cursor.execute('''
-                    INSERT INTO products (
-                        ProductID, SKU, "Article Description Batch", 
-                        "Expiry Date", "EAN Serial No", Remark,
-                        "Order QTY", "Ship QTY", UOM, "PDF Source"
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    product['ProductID'],
-                    product['SKU'],
-                    product['Article Description Batch'],
-                    product['Expiry Date'],
-                    product['EAN Serial No'],
-                    product['Remark'],
-                    product['Order QTY'],
-                    product['Ship QTY'],
-                    product['UOM'],
-                    product['PDF Source']
-                ))
-            
-            conn.commit()
-            conn.close()
+            get_repository(self.db_path).insert_many(
+                [{col: product[col] for col in PRODUCT_COLUMNS} for product in products],
+                undo_label=f"Billede-upload: {os.path.basename(self.image_path)}")
             
             self.progress.emit(100)
             self.status.emit(f"Færdig! Tilføjet {len(products)} produkter")
@@ -1783,10 +2548,372 @@ def exception_hook(exctype, value, traceback):
     sys.exit(1)
 
 
-def extract_products_with_gpt(text_content, client):
+def get_model_router():
+    """Returnerer den delte model-router (oprettes ved første kald)"""
+    global _model_router
+    if _model_router is None:
+        _model_router = ModelRouter(os.path.join(get_app_data_dir(), 'model_routing.json'))
+    return _model_router
+
+
+def get_backup_manager():
+    """Returnerer den delte backup-manager for databasen (oprettes ved første kald)"""
+    global _backup_manager
+    if _backup_manager is None:
+        _backup_manager = BackupManager(
+            os.path.join(get_app_data_dir(), 'backups'),
+            min_interval=config.BACKUP_MIN_INTERVAL_SECONDS,
+            keep_recent_hours=config.BACKUP_KEEP_RECENT_HOURS,
+            hourly_hours=config.BACKUP_HOURLY_HOURS,
+            retention_days=config.BACKUP_RETENTION_DAYS,
+        )
+    return _backup_manager
+
+
+def get_ai_usage_log():
+    """Returnerer den delte forbrugslog for AI-kald (oprettes ved første kald)"""
+    global _ai_usage_log
+    if _ai_usage_log is None:
+        _ai_usage_log = AIUsageLog(os.path.join(get_app_data_dir(), 'ai_usage.db'),
+                                   cache_max_entries=config.AI_CACHE_MAX_ENTRIES,
+                                   cache_max_age_days=config.AI_CACHE_MAX_AGE_DAYS)
+    return _ai_usage_log
+
+
+def chat_completion_with_retry(client, max_retries=config.AI_MAX_RETRIES, **request):
+    """Kalder chat completion API'et og prøver igen ved forbigående fejl. Returnerer (response, retries).
+    Fejler kaldet, har undtagelsen antallet af forsøg ud over det første i attributten retries"""
+    retries = 0
+    while True:
+        try:
+            return client.chat.completions.create(**request), retries
+        except Exception as e:
+            transient = isinstance(e, (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError))
+            if not transient or retries >= max_retries:
+                e.retries = retries
+                raise
+            retries += 1
+            delay = 2 ** retries
+            logging.warning(f"Forbigående AI-fejl ({e.__class__.__name__}), forsøg {retries} af {max_retries} "
+                            f"om {delay} sekunder")
+            time.sleep(delay)
+
+
+def ai_chat_completion(client, purpose, call_context=None, **request):
+    """Udfører et AI-kald via cache og retry og skriver forbruget til ai_calls.
+
+    Med call_context['refresh_cache'] springes cachen over, og det nye svar erstatter det gemte, så en
+    fil der gav et forkert resultat kan køres igen. call_context['escalated'] markerer et eskaleret kald,
+    som ikke tælles med i baseline_cost, da siden allerede er talt med ved første forsøg.
+    Returnerer (content, stats) hvor stats indeholder model, tokens, latenstid, retries og cache hit.
+    """
+    call_context = call_context or {}
+    usage_log = get_ai_usage_log()
+    model = request['model']
+    cache_key = request_cache_key(**request)
+
+    start_time = time.perf_counter()
+    use_cache = config.AI_CACHE_ENABLED and not call_context.get('refresh_cache')
+    cached = usage_log.get_cached(cache_key) if use_cache else None
+    if cached:
+        content, prompt_tokens, completion_tokens = cached
+        retries = 0
+        logging.info(f"AI-cache hit for {purpose} ({model})")
+    else:
+        try:
+            response, retries = chat_completion_with_retry(client, **request)
+        except Exception as e:
+            # Også et kald der fejler efter alle forsøg skal med i forbruget, med sin latenstid og sine retries
+            usage_log.record_call(
+                purpose, model, 0, 0, time.perf_counter() - start_time, retries=getattr(e, 'retries', 0),
+                document_hash=call_context.get('document_hash'), document_name=call_context.get('document_name'),
+                page=call_context.get('page'), error=f"{e.__class__.__name__}: {e}")
+            raise
+        choice = response.choices[0]
+        content = choice.message.content
+        usage = getattr(response, 'usage', None)
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+        # Afkortede svar caches ikke, så et nyt forsøg faktisk kalder modellen igen
+        if config.AI_CACHE_ENABLED and content and getattr(choice, 'finish_reason', 'stop') == 'stop':
+            usage_log.store_cached(cache_key, model, content, prompt_tokens, completion_tokens)
+    latency = time.perf_counter() - start_time
+
+    usage_log.record_call(
+        purpose, model, prompt_tokens, completion_tokens, latency, retries=retries,
+        cache_hit=bool(cached), document_hash=call_context.get('document_hash'),
+        document_name=call_context.get('document_name'), page=call_context.get('page'),
+        cost=estimate_cost(model, prompt_tokens, completion_tokens),
+        baseline_cost=0.0 if call_context.get('escalated') else
+        estimate_cost(config.AI_STRONG_MODEL, prompt_tokens, completion_tokens)
+    )
+
+    stats = {
+        'model': model,
+        'latency': latency,
+        # Et cache hit koster ingen tokens
+        'prompt_tokens': 0 if cached else prompt_tokens,
+        'completion_tokens': 0 if cached else completion_tokens,
+        'retries': retries,
+        'cache_hit': bool(cached),
+    }
+    return content, stats
+
+
+def route_and_extract_text(text_content, client, call_context=None):
+    """Udtrækker produkter fra en tekstside med den model routeren vælger, og eskalerer ved behov"""
+    router = get_model_router()
+    decision = router.route_text(text_content)
+    result = extract_products_with_gpt(text_content, client, model=decision.model, call_context=call_context)
+    router.record_outcome(decision, result.get('stats', {}))
+
+    if router.should_escalate(decision, result.get('stats', {})):
+        logging.info(f"Eskalerer side til {router.strong_model}")
+        escalated = decision._replace(model=router.strong_model)
+        result = extract_products_with_gpt(text_content, client, model=router.strong_model,
+                                           call_context=dict(call_context or {}, escalated=True))
+        router.record_outcome(escalated, result.get('stats', {}), escalated=True)
+    return result
+
+
+def route_and_extract_image(image_path, client, call_context=None, extractor=None, pixel_count=None,
+                            layout_key='billede'):
+    """Udtrækker produkter fra et billede med den model routeren vælger, og eskalerer ved fejl.
+
+    extractor er extract_products_with_vision (udløbsdatolister) eller extract_products_from_scan
+    (scannede leveringssedler).
+    """
+    extractor = extractor or extract_products_with_vision
+    router = get_model_router()
+    if pixel_count is None:
+        try:
+            pixmap = fitz.Pixmap(image_path)
+            pixel_count = pixmap.width * pixmap.height
+        except Exception as e:
+            logging.warning(f"Kunne ikke læse billedets opløsning: {e}")
+    decision = router.route_image(os.path.getsize(image_path), pixel_count, layout_key)
+
+    try:
+        result = extractor(image_path, client, model=decision.model, call_context=call_context)
+        stats = result.get('stats', {})
+        router.record_outcome(decision, stats)
+        if not router.should_escalate(decision, stats):
+            return result
+    except Exception as e:
+        if decision.model == router.strong_model:
+            raise
+        logging.warning(f"Vision med {decision.model} fejlede, eskalerer: {e}")
+
+    escalated = decision._replace(model=router.strong_model)
+    result = extractor(image_path, client, model=router.strong_model,
+                       call_context=dict(call_context or {}, escalated=True))
+    router.record_outcome(escalated, result.get('stats', {}), escalated=True)
+    return result
+
+
+def normalize_product_fields(product):
+    """Normaliserer alternative feltnavne fra AI'en til databasens kolonnenavne"""
+    if 'ArticleDescriptionBatch' in product:
+        product['Article Description Batch'] = product.pop('ArticleDescriptionBatch')
+    if 'EANSerialNo' in product:
+        product['EAN Serial No'] = product.pop('EANSerialNo')
+    if 'ExpiryDate' in product:
+        product['Expiry Date'] = product.pop('ExpiryDate')
+    if 'OrderQTY' in product:
+        product['Order QTY'] = product.pop('OrderQTY')
+    if 'ShipQTY' in product:
+        product['Ship QTY'] = product.pop('ShipQTY')
+    return product
+
+
+def validate_product(product):
+    """Validerer et produkt og returnerer en liste af valideringsfejl (tom hvis gyldigt)"""
+    validation_errors = []
+
+    # SKU validering
+    sku = str(product.get('SKU', ''))
+    if not (len(sku) == 5 and sku.isdigit()):
+        validation_errors.append(f"SKU: {sku} (skal være 5 cifre)")
+
+    # ProductID validering
+    product_id = str(product.get('ProductID', ''))
+    if not re.match(r'^\d{1,3}$', product_id):
+        validation_errors.append(f"ProductID: {product_id} (skal være 1-3 cifre)")
+
+    # EAN validering
+    ean = str(product.get('EAN Serial No', ''))
+    if ean and not re.match(r'^\d{13,14}$', ean):
+        validation_errors.append(f"EAN: {ean} (skal være tomt eller 13-14 cifre)")
+
+    # Expiry Date validering
+    expiry_date = str(product.get('Expiry Date', ''))
+    if not re.match(r'^\d{2}\.\d{2}\.\d{4}$', expiry_date):
+        validation_errors.append(f"Expiry Date: {expiry_date} (skal være DD.MM.YYYY)")
+
+    # Article Description Batch validering
+    if not product.get('Article Description Batch'):
+        validation_errors.append("Manglende Article Description Batch")
+
+    return validation_errors
+
+
+def find_source_lines(product, text_content, max_lines=3):
+    """Finder de linjer i sidens tekst som et afvist produkt sandsynligvis stammer fra"""
+    lines = [line.strip() for line in text_content.splitlines() if line.strip()]
+    if not lines:
+        return []
+
+    identifiers = [str(product.get(field, '')).strip() for field in ('SKU', 'EAN Serial No', 'ProductID')]
+    identifiers = [value for value in identifiers if len(value) >= 3]
+    description_words = {
+        word.lower() for word in re.findall(r'\w+', str(product.get('Article Description Batch', '')))
+        if len(word) > 2
+    }
+
+    scored = []
+    for line_num, line in enumerate(lines):
+        score = sum(3 for value in identifiers if value in line)
+        line_words = {word.lower() for word in re.findall(r'\w+', line)}
+        score += len(description_words & line_words)
+        if score:
+            scored.append((score, line_num, line))
+
+    scored.sort(key=lambda entry: (-entry[0], entry[1]))
+    best = sorted(scored[:max_lines], key=lambda entry: entry[1])
+    return [line for _, _, line in best]
+
+
+def repair_rejected_products(rejected, client, model=config.AI_REPAIR_MODEL, call_context=None):
+    """Sender afviste produkter og deres kildelinjer tilbage til AI'en i én samlet forespørgsel.
+
+    Returnerer de reparerede produkter der nu består valideringen.
+    """
+    if not rejected:
+        return []
+
+    rows = [
+        {
+            "index": index,
+            "product": entry['product'],
+            "errors": entry['errors'],
+            "source_lines": entry['source_lines'],
+        }
+        for index, entry in enumerate(rejected)
+    ]
+
+    system_prompt = """
+    Du retter produktlinjer fra en leveringsseddel fra Sweetspot A/S som fejlede validering.
+    For hver række får du det udtrukne produkt, valideringsfejlene og de originale tekstlinjer.
+    Ret KUN felterne ud fra kildelinjerne - gæt ikke værdier der ikke står i teksten.
+
+    Valideringsregler:
+    - SKU SKAL være præcis 5 cifre
+    - ProductID SKAL være 1-3 cifre
+    - EAN Serial No kan være enten 13-14 cifre eller tomt
+    - Expiry Date SKAL være i DD.MM.YYYY format
+    - Article Description Batch SKAL udfyldes
+    - UOM er altid "EACH"
+
+    Returner {"products": [...]} hvor hvert produkt har feltet "index" fra input samt
+    SKU, Article Description Batch, ProductID, EAN Serial No, Order QTY, Expiry Date, Ship QTY og UOM.
+    Udelad rækker der ikke kan rettes ud fra kildelinjerne.
+    """
+
+    start_time = time.perf_counter()
+    try:
+        content, _ = ai_chat_completion(
+            client, 'repair', call_context,
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": json.dumps({"rows": rows}, ensure_ascii=False)}
+            ],
+            response_format={"type": "json_object"},
+            max_tokens=2000,
+            temperature=0
+        )
+        result = json.loads(content)
+    except Exception as e:
+        logging.error(f"Reparation af afviste produkter fejlede: {str(e)}")
+        return []
+    finally:
+        latency = time.perf_counter() - start_time
+
+    repaired = []
+    seen_indexes = set()
+    for product in result.get('products', []) if isinstance(result, dict) else []:
+        if not isinstance(product, dict):
+            continue
+        index = product.pop('index', None)
+        if index in seen_indexes:
+            continue
+        normalize_product_fields(product)
+        validation_errors = validate_product(product)
+        if validation_errors:
+            logging.warning("Repareret produkt fejlede stadig validering:\n" + "\n".join(validation_errors))
+            continue
+        seen_indexes.add(index)
+        if not product.get('EAN Serial No'):
+            product['EAN Serial No'] = ''
+        repaired.append(product)
+
+    success_rate = len(repaired) / len(rejected)
+    logging.info(f"Reparation med {model}: {len(repaired)} af {len(rejected)} afviste produkter reddet "
+                 f"({success_rate:.0%}) på {latency:.2f} sekunder")
+    return repaired
+
+
+DELIVERY_NOTE_SYSTEM_PROMPT = """
+    Du er en specialiseret AI til at analysere leveringssedler fra Sweetspot A/S.
+    Din opgave er at udtrække information KUN om produkter med udløbsdato og returnere det som JSON data.
+    
+    VIGTIGE INSTRUKTIONER:
+    1. MEGET VIGTIGT - Inkluder KUN produkter der har en udløbsdato
+       - Ignorer produkter som bægre, handsker og andet udstyr
+       - Fokuser kun på fødevarer og andre produkter med udløbsdato
+    
+    2. Hver relevant produktlinje skal indeholde:
+       - SKU (præcis 5 cifre, f.eks. '16404', '12228')
+       - Article Description Batch (produktnavn og batch, f.eks. 'Ritter Sport Mælk', 'Twix Single 32x50g')
+       - ProductID (1-3 cifre, f.eks. '98', '64')
+       - EAN Serial No (13-14 cifre eller tomt hvis ingen stregkode)
+       - Order QTY (antal bestilt)
+       - Expiry Date (DD.MM.YYYY format, f.eks. '19.12.2024')
+       - Ship QTY (antal leveret)
+       - UOM (altid "EACH")
+
+    3. Valideringsregler:
+       - SKU SKAL være præcis 5 cifre
+       - Article Description Batch SKAL udfyldes
+       - ProductID SKAL være 1-3 cifre
+       - EAN Serial No kan være enten 13-14 cifre eller tomt
+       - Expiry Date SKAL være i DD.MM.YYYY format
+       - Ignorer headers, fodnoter og ikke-relevante produkter
+
+    VIGTIGT: Returner data i præcis dette format og brug PRÆCIS disse feltnavne:
+    {
+        "products": [
+            {
+                "SKU": "16404",
+                "Article Description Batch": "Ritter Sport Mælk",
+                "ProductID": "98",
+                "EAN Serial No": "4000417222602",
+                "Order QTY": "1",
+                "Expiry Date": "19.12.2024",
+                "Ship QTY": "1",
+                "UOM": "EACH"
+            }
+        ]
+    }
+    """
+
+
+def extract_products_with_gpt(text_content, client, model=None, repair=config.AI_REPAIR_ENABLED,
+                              repair_model=config.AI_REPAIR_MODEL, call_context=None):
     """Udtrækker produktinformation ved hjælp af GPT"""
+    model = model or config.AI_TEXT_MODEL
     try:
-        logging.info("Starter GPT analyse af tekst")
+        logging.info(f"Starter GPT analyse af tekst med {model}")
         
         # Rens teksten for potentielle problematiske tegn
         cleaned_text = text_content.replace('"', "'").replace('\n', ' ').strip()
@@ -1795,58 +2922,15 @@ def extract_products_with_gpt(text_content, client):
         print("\n=== TEKST SENDT TIL AI ===")
         print(cleaned_text)
         print("=== SLUT PÅ INPUT TEKST ===\n")
-        
-        system_prompt = """
-        Du er en specialiseret AI til at analysere leveringssedler fra Sweetspot A/S.
-        Din opgave er at udtrække information KUN om produkter med udløbsdato og returnere det som JSON data.
-        
-        VIGTIGE INSTRUKTIONER:
-        1. MEGET VIGTIGT - Inkluder KUN produkter der har en udløbsdato
-           - Ignorer produkter som bægre, handsker og andet udstyr
-           - Fokuser kun på fødevarer og andre produkter med udløbsdato
-        
-        2. Hver relevant produktlinje skal indeholde:
-           - SKU (præcis 5 cifre, f.eks. '16404', '12228')
-           - Article Description Batch (produktnavn og batch, f.eks. 'Ritter Sport Mælk', 'Twix Single 32x50g')
-           - ProductID (1-3 cifre, f.eks. '98', '64')
-           - EAN Serial No (13-14 cifre eller tomt hvis ingen stregkode)
-           - Order QTY (antal bestilt)
-           - Expiry Date (DD.MM.YYYY format, f.eks. '19.12.2024')
-           - Ship QTY (antal leveret)
-           - UOM (altid "EACH")
-
-        3. Valideringsregler:
-           - SKU SKAL være præcis 5 cifre
-           - Article Description Batch SKAL udfyldes
-           - ProductID SKAL være 1-3 cifre
-           - EAN Serial No kan være enten 13-14 cifre eller tomt
-           - Expiry Date SKAL være i DD.MM.YYYY format
-           - Ignorer headers, fodnoter og ikke-relevante produkter
-
-        VIGTIGT: Returner data i præcis dette format og brug PRÆCIS disse feltnavne:
-        {
-            "products": [
-                {
-                    "SKU": "16404",
-                    "Article Description Batch": "Ritter Sport Mælk",
-                    "ProductID": "98",
-                    "EAN Serial No": "4000417222602",
-                    "Order QTY": "1",
-                    "Expiry Date": "19.12.2024",
-                    "Ship QTY": "1",
-                    "UOM": "EACH"
-                }
-            ]
-        }
-        """
 
         logging.info("Sender forespørgsel til GPT")
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
+        content, stats = ai_chat_completion(
+            client, 'text', call_context,
+            model=model,
             messages=[
                 {
                     "role": "system",
-                    "content": system_prompt
+                    "content": DELIVERY_NOTE_SYSTEM_PROMPT
                 },
                 {
                     "role": "user",
@@ -1859,7 +2943,6 @@ def extract_products_with_gpt(text_content, client):
         )
         
         logging.info("GPT analyse fuldført, parser response")
-        content = response.choices[0].message.content
         
         # Log AI's response
         print("\n=== AI RESPONSE ===")
@@ -1870,68 +2953,54 @@ def extract_products_with_gpt(text_content, client):
             result = json.loads(content)
             if not isinstance(result, dict) or 'products' not in result:
                 logging.error("Ugyldigt response format - mangler 'products' key")
-                return {"products": []}
+                return {"products": [], "stats": stats}
             
             raw_products = result.get('products', [])
             logging.info(f"Fundet {len(raw_products)} produkter før validering")
             
             validated_products = []
+            rejected_products = []
             for product in raw_products:
                 # Log det originale produkt
                 logging.debug(f"Validerer produkt: {product}")
                 
                 # Normaliser feltnavne
-                if 'ArticleDescriptionBatch' in product:
-                    product['Article Description Batch'] = product.pop('ArticleDescriptionBatch')
-                if 'EANSerialNo' in product:
-                    product['EAN Serial No'] = product.pop('EANSerialNo')
-                if 'ExpiryDate' in product:
-                    product['Expiry Date'] = product.pop('ExpiryDate')
-                if 'OrderQTY' in product:
-                    product['Order QTY'] = product.pop('OrderQTY')
-                if 'ShipQTY' in product:
-                    product['Ship QTY'] = product.pop('ShipQTY')
+                normalize_product_fields(product)
 
                 # Valider felter
-                validation_errors = []
-                
-                # SKU validering
-                sku = str(product.get('SKU', ''))
-                if not (len(sku) == 5 and sku.isdigit()):
-                    validation_errors.append(f"SKU: {sku} (skal være 5 cifre)")
-
-                # ProductID validering
-                product_id = str(product.get('ProductID', ''))
-                if not re.match(r'^\d{1,3}$', product_id):
-                    validation_errors.append(f"ProductID: {product_id} (skal være 1-3 cifre)")
-
-                # EAN validering
-                ean = str(product.get('EAN Serial No', ''))
-                if ean and not re.match(r'^\d{13,14}$', ean):
-                    validation_errors.append(f"EAN: {ean} (skal være tomt eller 13-14 cifre)")
-
-                # Expiry Date validering
-                expiry_date = str(product.get('Expiry Date', ''))
-                if not re.match(r'^\d{2}\.\d{2}\.\d{4}$', expiry_date):
-                    validation_errors.append(f"Expiry Date: {expiry_date} (skal være DD.MM.YYYY)")
-
-                # Article Description Batch validering
-                if not product.get('Article Description Batch'):
-                    validation_errors.append("Manglende Article Description Batch")
+                validation_errors = validate_product(product)
 
                 if validation_errors:
                     logging.warning(f"Produkt validering fejlede:\n" + "\n".join(validation_errors))
+                    rejected_products.append({
+                        'product': product,
+                        'errors': validation_errors,
+                        'source_lines': find_source_lines(product, text_content),
+                    })
                     continue
                 
                 # Hvis EAN er tomt, sæt det til en tom streng
-                if not ean:
+                if not product.get('EAN Serial No'):
                     product['EAN Serial No'] = ''
                 
                 validated_products.append(product)
                 logging.debug(f"Produkt valideret og godkendt: {product}")
 
+            stats['raw_count'] = len(raw_products)
+            stats['initial_rejected_count'] = len(rejected_products)
+            stats['rejected_count'] = len(rejected_products)
+
+            # Send kun de afviste rækker tilbage til AI'en i stedet for at genbehandle hele siden.
+            # rejected_count er derefter antallet der stadig er afvist, så eskaleringen afgøres efter reparationen
+            if repair and rejected_products:
+                repaired_products = repair_rejected_products(rejected_products, client, repair_model, call_context)
+                stats['repaired_count'] = len(repaired_products)
+                stats['repair_model'] = repair_model
+                stats['rejected_count'] = len(rejected_products) - len(repaired_products)
+                validated_products.extend(repaired_products)
+
             logging.info(f"Validering færdig. {len(validated_products)} af {len(raw_products)} produkter godkendt")
-            return {"products": validated_products}
+            return {"products": validated_products, "stats": stats}
             
         except json.JSONDecodeError as e:
             logging.error(f"JSON parsing fejl: {str(e)}")
@@ -1943,6 +3012,62 @@ def extract_products_with_gpt(text_content, client):
         raise Exception(f"GPT Fejl: {str(e)}")
 
 
+
+def extract_products_from_scan(image_path, client, model=None, call_context=None):
+    """Udtrækker produkter fra en scannet side af en leveringsseddel ved hjælp af Vision"""
+    model = model or config.AI_STRONG_MODEL
+    with open(image_path, "rb") as image_file:
+        base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+
+    content, stats = ai_chat_completion(
+        client, 'scan', call_context,
+        model=model,
+        messages=[
+            {"role": "system", "content": DELIVERY_NOTE_SYSTEM_PROMPT},
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": "Dette er en scannet side af en leveringsseddel. "
+                                "Returner KUN produkter med udløbsdato som JSON."
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": f"data:image/png;base64,{base64_image}", "detail": "high"}
+                    }
+                ]
+            }
+        ],
+        response_format={"type": "json_object"},
+        max_tokens=4000,
+        temperature=0
+    )
+
+    try:
+        result = json.loads(content)
+    except json.JSONDecodeError as e:
+        logging.error(f"Problematisk JSON fra scannet side: {content}")
+        raise Exception(f"Fejl ved parsing af AI response: {str(e)}")
+
+    raw_products = result.get('products', []) if isinstance(result, dict) else []
+    validated_products = []
+    for product in raw_products:
+        normalize_product_fields(product)
+        validation_errors = validate_product(product)
+        if validation_errors:
+            logging.warning("Produkt fra scannet side fejlede validering:\n" + "\n".join(validation_errors))
+            continue
+        if not product.get('EAN Serial No'):
+            product['EAN Serial No'] = ''
+        validated_products.append(product)
+
+    stats['raw_count'] = len(raw_products)
+    stats['rejected_count'] = len(raw_products) - len(validated_products)
+    logging.info(f"Scannet side: {len(validated_products)} af {len(raw_products)} produkter godkendt")
+    return {"products": validated_products, "stats": stats}
+
+
 def process_pdf(pdf_path):
     client = OpenAI()  # Initialiser OpenAI client
     
@@ -1957,14 +3082,16 @@ def process_pdf(pdf_path):
     return result['products']
 
 
-def extract_products_with_vision(image_path, client):
+def extract_products_with_vision(image_path, client, model=None, call_context=None):
     """Udtrækker produktinformation fra billede ved hjælp af GPT-4 Vision"""
+    model = model or config.AI_STRONG_MODEL
     try:
         with open(image_path, "rb") as image_file:
             base64_image = base64.b64encode(image_file.read()).decode('utf-8')
             
-        response = client.chat.completions.create(
-            model="gpt-4o",  # Opdateret model navn
+        content, stats = ai_chat_completion(
+            client, 'vision', call_context,
+            model=model,
             messages=[
                 {
                     "role": "user",
@@ -2004,7 +3131,7 @@ def extract_products_with_vision(image_path, client):
         )
         
         # Hent response content og log det
-        content = response.choices[0].message.content.strip()
+        content = (content or '').strip()
         logging.info(f"Raw API response: {content}")
         
         # Find JSON i responset
@@ -2041,6 +3168,9 @@ def extract_products_with_vision(image_path, client):
                 raise ValueError(f"Ugyldig dato format for produkt: {product.get('product_name', 'Ukendt')}")
         
         logging.info(f"Fandt {len(result['products'])} produkter i billedet")
+        stats['raw_count'] = len(result['products'])
+        stats['rejected_count'] = 0
+        result['stats'] = stats
         return result
             
     except Exception as e:
@@ -2088,6 +3218,62 @@ class APIKeyDialog(QDialog):
         return self.api_key_input.text().strip()
 
 
+class AIUsageDialog(QDialog):
+    """Viser tokenforbrug, latenstid og pris for AI-kald pr. dag og pr. dokument"""
+
+    SUMMARY_HEADERS = ["Kald", "Cache hits", "Prompt tokens", "Completion tokens", "Gns. latenstid (s)",
+                       "Samlet tid (s)", "Retries", "Pris (USD)", "Sparet ved cache (USD)",
+                       "Sparet ved routing (USD)", "Fejlede kald"]
+
+    def __init__(self, usage_log, parent=None):
+        super().__init__(parent)
+        self.usage_log = usage_log
+        self.setWindowTitle("AI forbrug og omkostninger")
+        self.resize(1000, 500)
+        self.setup_ui()
+
+    def setup_ui(self):
+        layout = QVBoxLayout(self)
+        tabs = QTabWidget()
+        tabs.addTab(self.create_table(["Dato"], self.usage_log.daily_summary(), 1), "Pr. dag")
+        tabs.addTab(self.create_table(["Dokument", "Hash", "Sider"], self.usage_log.document_summary(), 3),
+                    "Pr. dokument")
+        layout.addWidget(tabs)
+
+        close_button = QPushButton("Luk")
+        close_button.clicked.connect(self.accept)
+        layout.addWidget(close_button)
+        self.setLayout(layout)
+
+    def create_table(self, key_headers, rows, key_count):
+        model = QStandardItemModel()
+        model.setHorizontalHeaderLabels(key_headers + self.SUMMARY_HEADERS)
+        for row in rows:
+            if key_count == 3:
+                # Vis dokumentnavn før den forkortede hash
+                keys = [row[1] or "Ukendt", (row[0] or "")[:12], str(row[2])]
+            else:
+                keys = [row[0]]
+            (calls, cache_hits, prompt_tokens, completion_tokens, avg_latency, total_latency,
+             retries, cost, cache_saved, baseline_cost, failed) = row[key_count:]
+            values = [
+                str(calls), str(cache_hits or 0), str(prompt_tokens or 0), str(completion_tokens or 0),
+                f"{avg_latency or 0:.2f}", f"{total_latency or 0:.1f}", str(retries or 0),
+                f"{cost or 0:.4f}", f"{cache_saved or 0:.4f}",
+                # Forskellen mellem prisen hvis alt var kørt på den stærke model og den faktiske pris
+                f"{max((baseline_cost or 0) - (cost or 0) - (cache_saved or 0), 0):.4f}",
+                str(failed or 0),
+            ]
+            model.appendRow([QStandardItem(value) for value in keys + values])
+
+        table = QTableView()
+        table.setModel(model)
+        table.setEditTriggers(QTableView.NoEditTriggers)
+        table.setAlternatingRowColors(True)
+        table.resizeColumnsToContents()
+        return table
+
+
 class UploadItemWidget(QWidget):
     def __init__(self, file_path, parent=None):
         super().__init__(parent)
@@ -2260,6 +3446,8 @@ class MultiUploadDialog(QDialog):
 
 
 if __name__ == "__main__":
+    # Nødvendig for procespuljen der rasteriserer scannede sider i den frosne .exe
+    multiprocessing.freeze_support()
     setup_logging()
     logging.info("Program startet")
 
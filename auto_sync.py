@@ -0,0 +1,165 @@
+import time
+import logging
+import threading
+
+# Delt lås for alle Dropbox-overførsler, så en manuel og en automatisk synkronisering aldrig kører samtidig
+transfer_lock = threading.Lock()
+
+
+class OfflineError(Exception):
+    """Synkroniseringen kunne ikke gennemføres fordi der ikke er forbindelse"""
+
+
+class AutoSyncScheduler:
+    """Samler bursts af lokale skrivninger til én synkronisering.
+
+    notify_write() kaldes efter hver skrivning og flytter deadline debounce_seconds frem, så
+    en række redigeringer tæt efter hinanden giver én upload. Synkroniseringen kører i en
+    baggrundstråd. Uden forbindelse bliver ændringerne liggende i køen og sendes, når
+    forbindelsen er tilbage. sync_func kaldes altid med transfer_lock holdt. is_online er typisk
+    lagerets StorageBackend.is_online.
+    """
+
+    def __init__(self, sync_func, debounce_seconds=30, retry_seconds=60, max_delay_seconds=300,
+                 is_online=lambda: True, status_callback=None):
+        self.sync_func = sync_func
+        self.debounce_seconds = debounce_seconds
+        self.retry_seconds = retry_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.is_online = is_online
+        self.status_callback = status_callback
+
+        self._condition = threading.Condition()
+        self._pending_writes = 0
+        self._first_write_at = None
+        self._deadline = None
+        self._stopped = False
+        self._flush_on_stop = False
+        self._thread = threading.Thread(target=self._run, name="AutoSync", daemon=True)
+
+        self._stats = {
+            'syncs': 0,
+            'writes': 0,
+            'coalesced_writes': 0,
+            'failures': 0,
+            'offline_waits': 0,
+            'last_latency': 0.0,
+            'total_latency': 0.0,
+        }
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout=None, flush=False):
+        """Stopper tråden. Med flush=True forsøges ventende ændringer sendt én sidste gang først"""
+        with self._condition:
+            self._stopped = True
+            self._flush_on_stop = flush
+            self._condition.notify_all()
+        self._thread.join(timeout)
+
+    def notify_write(self):
+        """Registrerer en lokal skrivning. Må kaldes fra enhver tråd"""
+        with self._condition:
+            now = time.monotonic()
+            self._pending_writes += 1
+            self._stats['writes'] += 1
+            if self._first_write_at is None:
+                self._first_write_at = now
+            # Debounce, men vent aldrig længere end max_delay_seconds fra den første skrivning
+            self._deadline = min(now + self.debounce_seconds, self._first_write_at + self.max_delay_seconds)
+            self._condition.notify_all()
+
+    def flush(self):
+        """Synkroniser ventende ændringer med det samme"""
+        with self._condition:
+            if self._pending_writes:
+                self._deadline = time.monotonic()
+                self._condition.notify_all()
+
+    @property
+    def pending_writes(self):
+        with self._condition:
+            return self._pending_writes
+
+    def stats(self):
+        with self._condition:
+            stats = dict(self._stats)
+            stats['pending_writes'] = self._pending_writes
+        stats['avg_latency'] = stats['total_latency'] / stats['syncs'] if stats['syncs'] else 0.0
+        return stats
+
+    def _report(self, message):
+        logging.info(message)
+        if self.status_callback:
+            self.status_callback(message)
+
+    def _wait_for_deadline(self):
+        """Venter til deadline er nået. Ved stop returneres True kun hvis ventende ændringer skal flushes"""
+        with self._condition:
+            while True:
+                if self._stopped:
+                    flush = self._flush_on_stop and self._pending_writes > 0
+                    self._flush_on_stop = False
+                    return flush
+                if self._deadline is not None:
+                    remaining = self._deadline - time.monotonic()
+                    if remaining <= 0:
+                        return True
+                    self._condition.wait(remaining)
+                else:
+                    self._condition.wait()
+
+    def _retry_later(self):
+        with self._condition:
+            self._deadline = time.monotonic() + self.retry_seconds
+
+    def _run(self):
+        while self._wait_for_deadline():
+            if not self.is_online():
+                with self._condition:
+                    self._stats['offline_waits'] += 1
+                self._report(f"Ingen forbindelse til Dropbox - {self.pending_writes} ændringer venter i køen")
+                self._retry_later()
+                continue
+
+            with self._condition:
+                writes = self._pending_writes
+                first_write_at = self._first_write_at
+                self._pending_writes = 0
+                self._first_write_at = None
+                self._deadline = None
+
+            try:
+                with transfer_lock:
+                    self.sync_func()
+            except OfflineError as e:
+                self._requeue(writes, first_write_at)
+                with self._condition:
+                    self._stats['offline_waits'] += 1
+                self._report(f"Automatisk synkronisering venter på forbindelse: {e}")
+                self._retry_later()
+                continue
+            except Exception as e:
+                self._requeue(writes, first_write_at)
+                with self._condition:
+                    self._stats['failures'] += 1
+                self._report(f"Automatisk synkronisering fejlede: {e}")
+                self._retry_later()
+                continue
+
+            latency = time.monotonic() - first_write_at
+            with self._condition:
+                self._stats['syncs'] += 1
+                self._stats['coalesced_writes'] += writes
+                self._stats['last_latency'] = latency
+                self._stats['total_latency'] += latency
+            self._report(f"Automatisk synkroniseret: {writes} ændringer samlet i én upload, "
+                         f"{latency:.1f} sekunder fra første ændring")
+
+    def _requeue(self, writes, first_write_at):
+        """Lægger skrivningerne tilbage i køen, så de tælles med i næste forsøg"""
+        with self._condition:
+            self._pending_writes += writes
+            if self._first_write_at is None or first_write_at < self._first_write_at:
+                self._first_write_at = first_write_at
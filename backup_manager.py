@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+from datetime import datetime
+
+MANIFEST_DIR = 'manifests'
+PAGE_DIR = 'pages'
+
+
+class BackupManager:
+    """Backups af databasen som deduplikerede sider.
+
+    Hvert snapshot tages med SQLites online backup-API, så det er konsistent selv mens databasen
+    bruges. Filen deles i databasens sider, og hver side gemmes zlib-komprimeret under sin SHA-256.
+    Et snapshot er blot et manifest med listen af side-hashes, så uændrede sider aldrig gemmes to gange.
+
+    Snapshots tages højst hvert min_interval sekund, medmindre force=True. prune() beholder alle
+    snapshots fra den seneste time, ét pr. time det seneste døgn og ét pr. dag i retention_days dage.
+    """
+
+    def __init__(self, backup_dir, min_interval=300, keep_recent_hours=1, hourly_hours=24, retention_days=30):
+        self.backup_dir = backup_dir
+        self.min_interval = min_interval
+        self.keep_recent_hours = keep_recent_hours
+        self.hourly_hours = hourly_hours
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(backup_dir, MANIFEST_DIR), exist_ok=True)
+        os.makedirs(os.path.join(backup_dir, PAGE_DIR), exist_ok=True)
+
+    def _manifest_path(self, snapshot_id):
+        return os.path.join(self.backup_dir, MANIFEST_DIR, f"{snapshot_id}.json")
+
+    def _page_path(self, page_hash):
+        return os.path.join(self.backup_dir, PAGE_DIR, page_hash[:2], f"{page_hash}.z")
+
+    def list_snapshots(self):
+        """Snapshot-id'er sorteret fra ældst til nyest. Id'et starter med tidsstemplet"""
+        names = os.listdir(os.path.join(self.backup_dir, MANIFEST_DIR))
+        return sorted(name[:-5] for name in names if name.endswith('.json'))
+
+    def load_manifest(self, snapshot_id):
+        with open(self._manifest_path(snapshot_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def create_snapshot(self, db_path, label='auto', force=False):
+        """Tager et snapshot og returnerer dets id.
+
+        Uden force genbruges det seneste snapshot, hvis det er yngre end min_interval.
+        """
+        with self._lock:
+            snapshots = self.list_snapshots()
+            if snapshots and not force:
+                age = time.time() - self.load_manifest(snapshots[-1])['timestamp']
+                if age < self.min_interval:
+                    logging.info(f"Backup sprunget over: seneste snapshot er {age:.0f} sekunder gammelt")
+                    return snapshots[-1]
+
+            start_time = time.perf_counter()
+            snapshot_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{label}"
+            temp_path = os.path.join(self.backup_dir, f"{snapshot_id}.tmp")
+            try:
+                source = sqlite3.connect(db_path)
+                target = sqlite3.connect(temp_path)
+                try:
+                    source.backup(target)
+                    page_size = target.execute('PRAGMA page_size').fetchone()[0]
+                finally:
+                    target.close()
+                    source.close()
+
+                pages = []
+                new_pages = 0
+                new_bytes = 0
+                digest = hashlib.sha256()
+                with open(temp_path, 'rb') as f:
+                    for page in iter(lambda: f.read(page_size), b''):
+                        digest.update(page)
+                        page_hash = hashlib.sha256(page).hexdigest()
+                        pages.append(page_hash)
+                        page_path = self._page_path(page_hash)
+                        if not os.path.exists(page_path):
+                            os.makedirs(os.path.dirname(page_path), exist_ok=True)
+                            compressed = zlib.compress(page, 6)
+                            with open(page_path + ".tmp", 'wb') as page_file:
+                                page_file.write(compressed)
+                            os.replace(page_path + ".tmp", page_path)
+                            new_pages += 1
+                            new_bytes += len(compressed)
+                db_size = os.path.getsize(temp_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+            manifest = {
+                'id': snapshot_id,
+                'label': label,
+                'timestamp': time.time(),
+                'page_size': page_size,
+                'size': db_size,
+                'sha256': digest.hexdigest(),
+                'pages': pages,
+            }
+            manifest_path = self._manifest_path(snapshot_id)
+            with open(manifest_path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump(manifest, f)
+            os.replace(manifest_path + ".tmp", manifest_path)
+
+            logging.info(f"Backup {snapshot_id} oprettet på {time.perf_counter() - start_time:.2f} sekunder: "
+                         f"{len(pages)} sider, {new_pages} nye ({new_bytes} bytes skrevet)")
+        self.prune()
+        return snapshot_id
+
+    def restore(self, snapshot_id, target_path):
+        """Genskaber databasen fra et snapshot. Forbindelser til target_path skal være lukket"""
+        manifest = self.load_manifest(snapshot_id)
+        temp_path = target_path + ".restore"
+        digest = hashlib.sha256()
+        try:
+            with open(temp_path, 'wb') as f:
+                for page_hash in manifest['pages']:
+                    with open(self._page_path(page_hash), 'rb') as page_file:
+                        page = zlib.decompress(page_file.read())
+                    digest.update(page)
+                    f.write(page)
+                f.flush()
+                os.fsync(f.fileno())
+            if digest.hexdigest() != manifest['sha256']:
+                raise IOError(f"Backup {snapshot_id} er beskadiget (checksum passer ikke)")
+            os.replace(temp_path, target_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        logging.info(f"Database gendannet fra backup {snapshot_id}")
+
+    def exists(self, snapshot_id):
+        return bool(snapshot_id) and os.path.exists(self._manifest_path(snapshot_id))
+
+    def _snapshots_to_keep(self, manifests, now):
+        keep = set()
+        hourly = {}
+        daily = {}
+        for manifest in manifests:
+            age = now - manifest['timestamp']
+            created = datetime.fromtimestamp(manifest['timestamp'])
+            if age <= self.keep_recent_hours * 3600:
+                keep.add(manifest['id'])
+            elif age <= self.hourly_hours * 3600:
+                hourly[created.strftime('%Y%m%d%H')] = manifest['id']
+            elif age <= self.retention_days * 86400:
+                daily[created.strftime('%Y%m%d')] = manifest['id']
+        # Manifesterne er sorteret ældst først, så hver bucket ender med sit nyeste snapshot
+        keep.update(hourly.values())
+        keep.update(daily.values())
+        return keep
+
+    def prune(self, now=None):
+        """Sletter snapshots uden for retention-politikken og sider ingen manifest længere bruger"""
+        with self._lock:
+            now = now or time.time()
+            manifests = [self.load_manifest(snapshot_id) for snapshot_id in self.list_snapshots()]
+            keep = self._snapshots_to_keep(manifests, now)
+            removed = [manifest for manifest in manifests if manifest['id'] not in keep]
+            if not removed:
+                return 0
+            for manifest in removed:
+                os.remove(self._manifest_path(manifest['id']))
+
+            referenced = set()
+            for manifest in manifests:
+                if manifest['id'] in keep:
+                    referenced.update(manifest['pages'])
+            freed = 0
+            page_root = os.path.join(self.backup_dir, PAGE_DIR)
+            for prefix in os.listdir(page_root):
+                for name in os.listdir(os.path.join(page_root, prefix)):
+                    if name[:-2] not in referenced:
+                        path = os.path.join(page_root, prefix, name)
+                        freed += os.path.getsize(path)
+                        os.remove(path)
+            logging.info(f"Backup oprydning: {len(removed)} snapshots slettet, {freed} bytes frigivet")
+            return len(removed)
+
+    def usage(self):
+        """Diskforbrug: antal snapshots og sider, bytes på disken og den samlede ukomprimerede størrelse"""
+        snapshots = self.list_snapshots()
+        logical = sum(self.load_manifest(snapshot_id)['size'] for snapshot_id in snapshots)
+        disk = 0
+        pages = 0
+        for root, _, files in os.walk(self.backup_dir):
+            for name in files:
+                disk += os.path.getsize(os.path.join(root, name))
+                if name.endswith('.z'):
+                    pages += 1
+        return {'snapshots': len(snapshots), 'pages': pages, 'disk_bytes': disk, 'logical_bytes': logical}
@@ -0,0 +1,680 @@
+"""Benchmarks for databasen, synkroniseringen og e-mail-udsendelsen.
+
+Brug: python benchmarks.py <navn> [argumenter]. Uden navn vises de tilgængelige benchmarks.
+Hvert benchmark sammenligner den gamle fremgangsmåde med den nuværende på en genereret database.
+"""
+import os
+import sys
+import time
+import sqlite3
+import logging
+import smtplib
+import tempfile
+import threading
+import socketserver
+from contextlib import contextmanager
+from datetime import datetime, date
+
+from backup_manager import BackupManager
+from db_snapshot import create_snapshot, restore_snapshot, download_snapshot_streaming
+from db_writer import DatabaseWriter, ReaderPool
+from dropbox_transfer import upload_if_changed, download_file_streaming
+from email_delivery import SMTPConnectionPool, build_message, render_report
+from expiry_buckets import ExpiryBuckets, EXPIRED, INVALID, TODAY
+from page_filter import evaluate_corpus
+from product_repository import ProductRepository, PRODUCT_COLUMNS, PRODUCTS_SCHEMA
+from storage_backend import LocalBackend
+from undo_journal import UndoJournal, install_undo_journal, undo_group
+
+_COLUMN_LIST = ', '.join(f'"{col}"' for col in PRODUCT_COLUMNS)
+_qt_app = None
+_INSERT_SQL = f'INSERT INTO products ({_COLUMN_LIST}) VALUES ({", ".join("?" for _ in PRODUCT_COLUMNS)})'
+
+
+def create_benchmark_database(db_path, rows):
+    """Opretter products med rows genererede rækker, uden change tracking og fortryd-journal"""
+    conn = sqlite3.connect(db_path)
+    conn.execute(PRODUCTS_SCHEMA)
+    conn.executemany(
+        _INSERT_SQL,
+        ((str(i), f"{10000 + i % 90000}", f"Chokolade {i % 500} 32x50g Batch {i}",
+          f"{1 + i % 28:02d}.{1 + i % 12:02d}.{2025 + i % 3}", f"57{i:011d}", "", str(i % 40), str(i % 40),
+          "STK", f"følgeseddel_{i // 200}.pdf") for i in range(rows))
+    )
+    conn.commit()
+    conn.close()
+
+
+def qt_application():
+    """QApplication til benchmarks med timere og signaler. Holdes i live til programmet slutter"""
+    global _qt_app
+    if _qt_app is None:
+        from PyQt5.QtWidgets import QApplication
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        _qt_app = QApplication.instance() or QApplication(sys.argv)
+    return _qt_app
+
+
+def benchmark_product(i):
+    return {"ProductID": str(i), "SKU": f"{10000 + i}", "Article Description Batch": f"Benchmark {i}",
+            "Expiry Date": f"{1 + i % 28:02d}.11.2026", "EAN Serial No": f"57{i:011d}", "Remark": "",
+            "Order QTY": "1", "Ship QTY": "1", "UOM": "STK", "PDF Source": "benchmark.pdf"}
+
+
+def bench_snapshot(rows=100000):
+    """Størrelse og tid for komprimerede snapshots, også efter 'Ryd Database'"""
+    def case(label, db_path, snapshot_path, restored_path):
+        start_time = time.perf_counter()
+        raw_size, vacuum_size, snapshot_size = create_snapshot(db_path, snapshot_path)
+        create_seconds = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        restore_snapshot(snapshot_path, restored_path)
+        restore_seconds = time.perf_counter() - start_time
+
+        print(f"{label}:")
+        print(f"  Rå databasefil:      {raw_size / 1024:10.0f} KB")
+        print(f"  Efter VACUUM INTO:   {vacuum_size / 1024:10.0f} KB")
+        print(f"  Komprimeret snapshot:{snapshot_size / 1024:10.0f} KB ({snapshot_size / raw_size:.1%} af rå fil)")
+        print(f"  Snapshot oprettet på {create_seconds:.2f} s, gendannet på {restore_seconds:.2f} s")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'products.db')
+        snapshot_path = os.path.join(temp_dir, 'products.db.gz')
+        restored_path = os.path.join(temp_dir, 'restored.db')
+        create_benchmark_database(db_path, rows)
+        case(f"{rows} rækker", db_path, snapshot_path, restored_path)
+
+        # Efter 'Ryd Database' ligger de slettede rækker tilbage som frie sider i den rå fil
+        conn = sqlite3.connect(db_path)
+        conn.execute('DELETE FROM products WHERE UniqueID % 10 != 0')
+        conn.commit()
+        conn.close()
+        case("Efter sletning af 90% af rækkerne", db_path, snapshot_path, restored_path)
+
+
+def bench_storage(rows=100000, latency_ms=50.0, bandwidth_mb=2.0):
+    """Upload og download af rå database og snapshot mod et simuleret netværk"""
+    latency = latency_ms / 1000
+    bandwidth = bandwidth_mb * 1024 * 1024 if bandwidth_mb else None
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'products.db')
+        snapshot_path = os.path.join(temp_dir, 'products.db.gz')
+        create_benchmark_database(db_path, rows)
+        create_snapshot(db_path, snapshot_path)
+        backend = LocalBackend(os.path.join(temp_dir, 'remote'), latency=latency, bandwidth=bandwidth)
+        state_path = os.path.join(temp_dir, 'sync_state.json')
+        cases = [
+            ("Rå database, upload", lambda: upload_if_changed(backend, db_path, '/products.db', state_path)),
+            ("Snapshot, upload", lambda: upload_if_changed(backend, snapshot_path, '/products.db.gz', state_path)),
+            ("Snapshot, uændret upload", lambda: upload_if_changed(backend, snapshot_path, '/products.db.gz',
+                                                                    state_path)),
+            ("Rå database, download", lambda: download_file_streaming(backend, '/products.db',
+                                                                      os.path.join(temp_dir, 'raw.db'))),
+            ("Snapshot, download", lambda: download_snapshot_streaming(backend, '/products.db.gz',
+                                                                       os.path.join(temp_dir, 'snap.db'))),
+        ]
+        print(f"{rows} rækker, latenstid {latency * 1000:.0f} ms, "
+              f"båndbredde {bandwidth / 1024 / 1024 if bandwidth else float('inf'):.1f} MB/s")
+        for label, run in cases:
+            before = dict(backend.stats)
+            start_time = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start_time
+            sent = backend.stats['bytes_sent'] - before['bytes_sent']
+            received = backend.stats['bytes_received'] - before['bytes_received']
+            print(f"  {label:28s} {elapsed:6.2f} s  {sent / 1024:8.0f} KB op  {received / 1024:8.0f} KB ned  "
+                  f"{backend.stats['requests'] - before['requests']:3d} kald")
+
+
+def bench_backup(rows=100000):
+    """Tid og diskforbrug for deduplikerede backups efter hver redigering"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'products.db')
+        create_benchmark_database(db_path, rows)
+        manager = BackupManager(os.path.join(temp_dir, 'backups'), min_interval=0)
+
+        edits = 20
+        start_time = time.perf_counter()
+        for i in range(edits):
+            conn = sqlite3.connect(db_path)
+            conn.execute('UPDATE products SET Remark=? WHERE UniqueID=?', (f"redigeret {i}", 1 + i * 997 % rows))
+            conn.commit()
+            conn.close()
+            manager.create_snapshot(db_path, label='edit')
+        elapsed = time.perf_counter() - start_time
+        usage = manager.usage()
+        print(f"{edits} redigeringer med backup af en database på {os.path.getsize(db_path) / 1024:.0f} KB")
+        print(f"  Gns. tid pr. backup: {elapsed / edits * 1000:.0f} ms")
+        print(f"  Diskforbrug: {usage['disk_bytes'] / 1024:.0f} KB for {usage['snapshots']} snapshots "
+              f"({usage['logical_bytes'] / 1024:.0f} KB som fulde kopier)")
+
+        restored = os.path.join(temp_dir, 'restored.db')
+        manager.restore(manager.list_snapshots()[0], restored)
+        print(f"  Gendannet ældste snapshot: {os.path.getsize(restored) / 1024:.0f} KB")
+
+
+def bench_expiry_buckets(rows=100000):
+    """Udløbsspande med dato-parsing pr. række i Python mod indekseret og cachet forespørgsel"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'products.db')
+        create_benchmark_database(db_path, rows)
+        today = datetime.now().date()
+
+        # Reference: datoen parses pr. række i Python, som update_table gjorde før
+        conn = sqlite3.connect(db_path)
+        start_time = time.perf_counter()
+        counts = {}
+        for row_id, expiry in conn.execute('SELECT UniqueID, "Expiry Date" FROM products'):
+            try:
+                days_until = (datetime.strptime(expiry, "%d.%m.%Y").date() - today).days
+            except ValueError:
+                counts[INVALID] = counts.get(INVALID, 0) + 1
+                continue
+            for name, limit in ((EXPIRED, -1), (TODAY, 0), ('within_7', 7), ('within_14', 14), ('within_30', 30)):
+                if days_until <= limit:
+                    counts[name] = counts.get(name, 0) + 1
+                    break
+        print(f"Python pr. række over {rows} rækker: {(time.perf_counter() - start_time) * 1000:.0f} ms {counts}")
+
+        buckets = ExpiryBuckets(db_path)
+        start_time = time.perf_counter()
+        result = buckets.compute(today)
+        print(f"Indekseret forespørgsel: {(time.perf_counter() - start_time) * 1000:.0f} ms "
+              f"(inkl. oprettelse af indeks) {result['counts']}")
+        start_time = time.perf_counter()
+        buckets.compute(today)
+        print(f"Cachet opslag: {(time.perf_counter() - start_time) * 1000:.2f} ms")
+
+        conn.execute('UPDATE products SET "Expiry Date"=? WHERE UniqueID=1', (today.strftime('%d.%m.%Y'),))
+        conn.commit()
+        conn.close()
+        start_time = time.perf_counter()
+        result = buckets.compute(today)
+        print(f"Efter skrivning fra anden forbindelse: {(time.perf_counter() - start_time) * 1000:.0f} ms, "
+              f"række 1 ligger i {result['bucket_of'].get(1)}")
+        print(f"Statistik: {buckets.stats()}")
+        buckets.close()
+
+
+def bench_writer(duration=5.0, writer_count=4, reader_count=4):
+    """Samtidige skrivere og læsere: rollback-journal med egne forbindelser mod WAL med én skrivertråd"""
+    insert_sql = ('INSERT INTO products (ProductID, SKU, "Article Description Batch", "Expiry Date", "PDF Source") '
+                  'VALUES (?, ?, ?, ?, ?)')
+    read_sql = 'SELECT COUNT(*), MAX(UniqueID) FROM products WHERE SKU >= ?'
+
+    class Counters:
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.writes = 0
+            self.reads = 0
+            self.lock_waits = 0
+            self.lock_wait_seconds = 0.0
+            self.write_latencies = []
+            self.read_latencies = []
+
+        def add(self, **values):
+            with self.lock:
+                for name, value in values.items():
+                    if isinstance(value, list):
+                        getattr(self, name).extend(value)
+                    else:
+                        setattr(self, name, getattr(self, name) + value)
+
+    def retry_locked(operation, counters):
+        # timeout=0 og egen ventesløjfe, så hver "database is locked" tælles som en låseventning
+        while True:
+            try:
+                return operation()
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e):
+                    raise
+                start_time = time.perf_counter()
+                time.sleep(0.001)
+                counters.add(lock_waits=1, lock_wait_seconds=time.perf_counter() - start_time)
+
+    def percentile(values, fraction):
+        values = sorted(values)
+        return values[int(fraction * (len(values) - 1))] * 1000 if values else 0.0
+
+    def rollback_writer(db_path, worker, stop, counters):
+        conn = sqlite3.connect(db_path, timeout=0)
+        latencies = []
+        i = 0
+        while not stop.is_set():
+            start_time = time.perf_counter()
+            args = (f"{worker}-{i}", f"{10000 + i % 90000}", f"Stress {worker} {i}", "01.12.2026", "stress.pdf")
+
+            def operation():
+                try:
+                    conn.execute(insert_sql, args)
+                    conn.commit()
+                except sqlite3.OperationalError:
+                    conn.rollback()
+                    raise
+            retry_locked(operation, counters)
+            latencies.append(time.perf_counter() - start_time)
+            i += 1
+        conn.close()
+        counters.add(writes=i, write_latencies=latencies)
+
+    def queued_writer(writer, worker, stop, counters):
+        latencies = []
+        i = 0
+        while not stop.is_set():
+            start_time = time.perf_counter()
+            args = (f"{worker}-{i}", f"{10000 + i % 90000}", f"Stress {worker} {i}", "01.12.2026", "stress.pdf")
+            writer.write(lambda conn, args=args: conn.execute(insert_sql, args).lastrowid)
+            latencies.append(time.perf_counter() - start_time)
+            i += 1
+        counters.add(writes=i, write_latencies=latencies)
+
+    def reader(get_connection, stop, counters):
+        latencies = []
+        i = 0
+        while not stop.is_set():
+            start_time = time.perf_counter()
+            with get_connection() as conn:
+                retry_locked(lambda: conn.execute(read_sql, (str(10000 + i % 90000),)).fetchone(), counters)
+            latencies.append(time.perf_counter() - start_time)
+            i += 1
+        counters.add(reads=i, read_latencies=latencies)
+
+    def run(label, make_writer, make_reader):
+        counters = Counters()
+        stop = threading.Event()
+        threads = [threading.Thread(target=make_writer, args=(worker, stop, counters)) for worker in range(writer_count)]
+        threads += [threading.Thread(target=make_reader, args=(stop, counters)) for _ in range(reader_count)]
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        print(f"{label}:")
+        print(f"  Skrivninger: {counters.writes / duration:.0f}/s, p50 {percentile(counters.write_latencies, 0.5):.2f} ms, "
+              f"p99 {percentile(counters.write_latencies, 0.99):.2f} ms")
+        print(f"  Læsninger:   {counters.reads / duration:.0f}/s, p50 {percentile(counters.read_latencies, 0.5):.2f} ms, "
+              f"p99 {percentile(counters.read_latencies, 0.99):.2f} ms")
+        print(f"  Låseventninger: {counters.lock_waits} ({counters.lock_wait_seconds:.2f} s i alt)")
+
+    print(f"{writer_count} skrivere og {reader_count} læsere i {duration:.0f} sekunder mod 20000 rækker")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'rollback.db')
+        create_benchmark_database(db_path, 20000)
+
+        @contextmanager
+        def own_connection():
+            conn = sqlite3.connect(db_path, timeout=0)
+            try:
+                yield conn
+            finally:
+                conn.close()
+
+        run("Rollback-journal, egen forbindelse pr. tråd (før)",
+            lambda worker, stop, counters: rollback_writer(db_path, worker, stop, counters),
+            lambda stop, counters: reader(own_connection, stop, counters))
+
+        wal_path = os.path.join(temp_dir, 'wal.db')
+        create_benchmark_database(wal_path, 20000)
+        writer = DatabaseWriter(wal_path)
+        readers = ReaderPool(wal_path, size=reader_count, timeout=0)
+        run("WAL, én skrivertråd med batch-kø og pulje af læsere (efter)",
+            lambda worker, stop, counters: queued_writer(writer, worker, stop, counters),
+            lambda stop, counters: reader(readers.connection, stop, counters))
+        stats = writer.stats()
+        print(f"  Skriver: {stats['jobs']} jobs i {stats['batches']} transaktioner "
+              f"(største batch {stats['largest_batch']}), {stats['lock_waits']} låseventninger")
+        writer.close()
+        readers.close()
+
+
+def bench_repository(rows=100000, operations=500):
+    """ProductRepository mod en ny forbindelse og ny kompilering af sætningen pr. kald"""
+    columns = ', '.join(f'"{col}"=?' for col in PRODUCT_COLUMNS)
+    update_sql = f'UPDATE products SET {columns} WHERE UniqueID=?'
+
+    def per_call_connection(db_path, sql, args):
+        # Som koden gjorde før: ny forbindelse og ny kompilering af sætningen for hvert kald
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.execute(sql, args)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def report(label, count, before, after):
+        print(f"  {label:<28} {before / count * 1e6:8.0f} µs -> {after / count * 1e6:6.0f} µs pr. operation "
+              f"({before / after:.1f}x)")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'products.db')
+        create_benchmark_database(db_path, rows)
+        repository = ProductRepository(db_path)
+        repository.create_schema('benchmark')
+        print(f"{operations} operationer mod en database med {rows} rækker (uden fortryd-gruppe)")
+
+        start_time = time.perf_counter()
+        for i in range(operations):
+            per_call_connection(db_path, _INSERT_SQL, tuple(benchmark_product(i).values()))
+        before = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        for i in range(operations):
+            repository.insert(benchmark_product(i), undo_label=None)
+        report("Tilføj produkt", operations, before, time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        for i in range(operations):
+            per_call_connection(db_path, update_sql, tuple(benchmark_product(i).values()) + (1 + i,))
+        before = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        for i in range(operations):
+            repository.update(1 + i, benchmark_product(i), undo_label=None)
+        report("Rediger produkt", operations, before, time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        for i in range(operations):
+            per_call_connection(db_path, 'DELETE FROM products WHERE UniqueID=?', (1 + i,))
+        before = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        for i in range(operations):
+            repository.delete(1 + operations + i, undo_label=None)
+        report("Slet produkt", operations, before, time.perf_counter() - start_time)
+
+        batch = [benchmark_product(i) for i in range(operations)]
+        start_time = time.perf_counter()
+        conn = sqlite3.connect(db_path)
+        for item in batch:
+            conn.execute(_INSERT_SQL, tuple(item.values()))
+        conn.commit()
+        conn.close()
+        before = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        repository.insert_many(batch)
+        report("Tilføj mange (pr. række)", operations, before, time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        conn = sqlite3.connect(db_path)
+        conn.execute('SELECT * FROM products').fetchall()
+        conn.close()
+        before = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        repository.fetch_all()
+        report("Hent alle produkter", 1, before, time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        for _ in range(20):
+            conn = sqlite3.connect(db_path)
+            conn.execute('''
+                SELECT "Article Description Batch", "Expiry Date", "EAN Serial No", "Ship QTY", "PDF Source"
+                FROM products
+                WHERE date(substr(`Expiry Date`, 7, 4) || '-' || substr(`Expiry Date`, 4, 2) || '-' ||
+                           substr(`Expiry Date`, 1, 2)) BETWEEN '2026-11-01' AND '2026-11-15'
+            ''').fetchall()
+            conn.close()
+        before = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        for _ in range(20):
+            repository.expiring(14, date(2026, 11, 1))
+        report("Udløbende produkter", 20, before, time.perf_counter() - start_time)
+        repository.close()
+
+
+def bench_undo(rows=100000):
+    """Fortryd-journalen ved en enkelt redigering og ved 'Ryd Database'"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'products.db')
+        create_benchmark_database(db_path, rows)
+        repository = ProductRepository(db_path)
+        journal = UndoJournal(repository)
+
+        conn = sqlite3.connect(db_path)
+        install_undo_journal(conn)
+        start_time = time.perf_counter()
+        with undo_group(conn, 'Rediger produkt'):
+            conn.execute('UPDATE products SET Remark=? WHERE UniqueID=?', ("redigeret", 42))
+        conn.commit()
+        edit_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        with undo_group(conn, 'Ryd database'):
+            conn.execute('DELETE FROM products')
+        conn.commit()
+        clear_time = time.perf_counter() - start_time
+        conn.close()
+
+        start_time = time.perf_counter()
+        journal.undo()
+        undo_clear_time = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        journal.undo()
+        undo_edit_time = time.perf_counter() - start_time
+        journal.redo()
+        repository.close()
+
+        conn = sqlite3.connect(db_path)
+        count, remark = conn.execute("SELECT COUNT(*), (SELECT Remark FROM products WHERE UniqueID=42) FROM products").fetchone()
+        conn.close()
+        print(f"Journal på {rows} rækker")
+        print(f"  Redigering med journal: {edit_time * 1000:.1f} ms, fortryd: {undo_edit_time * 1000:.1f} ms")
+        print(f"  Ryd database med journal: {clear_time * 1000:.0f} ms, fortryd: {undo_clear_time * 1000:.0f} ms")
+        print(f"  Efter fortryd og gentag: {count} rækker, Remark={remark!r}")
+
+
+def bench_db_worker(rows=100000, edits=20):
+    """Responsivitet: samme redigeringer udført synkront på GUI-tråden som før, og via DbWorker"""
+    import pandas as pd
+    from PyQt5.QtCore import QTimer
+    from db_worker import DbWorker, EventLoopStallMonitor
+
+    app = qt_application()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'products.db')
+        create_benchmark_database(db_path, rows)
+        repository = ProductRepository(db_path)
+        buckets = ExpiryBuckets(db_path)
+
+        def edit_and_fetch(i):
+            # Det en redigering gjorde på GUI-tråden før: skrivning, genindlæsning og udløbsspande
+            repository.update(1 + i % rows, {'Remark': f"Redigering {i}"}, undo_label=None, columns=('Remark',))
+            columns, fetched = repository.fetch_all()
+            df = pd.DataFrame(fetched, columns=columns).fillna('')
+            return df, buckets.compute()
+
+        def measure(label, start_edits):
+            monitor = EventLoopStallMonitor()
+            monitor.start()
+            started = time.perf_counter()
+            start_edits(app.quit)
+            app.exec_()
+            monitor.stop()
+            print(f"{label}: {edits} redigeringer på {time.perf_counter() - started:.2f} s, "
+                  f"hak over {monitor.threshold * 1000:.0f} ms: {monitor.summary()}")
+
+        def synchronous(done):
+            def step(i=0):
+                if i == edits:
+                    return done()
+                edit_and_fetch(i)
+                QTimer.singleShot(0, lambda: step(i + 1))
+            QTimer.singleShot(0, step)
+
+        worker = DbWorker()
+
+        def background(done):
+            def step(i=0):
+                if i == edits:
+                    return done()
+                worker.run(lambda: edit_and_fetch(i), on_success=lambda result: step(i + 1))
+            QTimer.singleShot(0, step)
+
+        print(f"{rows} rækker")
+        measure("Synkront på GUI-tråden", synchronous)
+        measure("DbWorker", background)
+        print(f"DbWorker statistik: {worker.stats()}")
+        worker.shutdown()
+        buckets.close()
+        repository.close()
+
+
+def bench_cell_edits(rows=20000, edits=200):
+    """En optælling med rettelser: dialog-opdatering af alle kolonner plus fuld genindlæsning pr.
+    rettelse som før, mod bufferede cellerettelser skrevet i én transaktion"""
+    import pandas as pd
+    from cell_edit_buffer import CellEditBuffer
+
+    qt_application()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'products.db')
+        create_benchmark_database(db_path, rows)
+        repository = ProductRepository(db_path)
+        # Fortryd-journalen skal findes, da begge varianter skriver med en fortryd-gruppe
+        repository.create_schema('benchmark')
+
+        start_time = time.perf_counter()
+        for i in range(edits):
+            data = dict(zip(PRODUCT_COLUMNS, (str(i),) * len(PRODUCT_COLUMNS)))
+            repository.update(1 + i, data)
+            columns, fetched = repository.fetch_all()
+            pd.DataFrame(fetched, columns=columns)
+        print(f"Dialog pr. rettelse: {edits} rettelser på {time.perf_counter() - start_time:.2f} s")
+
+        written = []
+        buffer = CellEditBuffer(lambda cells: written.append(repository.update_cells(cells)))
+        start_time = time.perf_counter()
+        for i in range(edits):
+            # Antal rettes to gange i træk på samme række, som ved en tastefejl
+            buffer.add(1 + i, 'Ship QTY', str(i + 1))
+            buffer.add(1 + i, 'Ship QTY', str(i))
+            buffer.add(1 + i, 'Remark', 'Optalt')
+        buffer.flush()
+        print(f"Bufferede celler: {edits * 3} rettelser på {time.perf_counter() - start_time:.3f} s, "
+              f"{sum(written)} celler skrevet i {len(written)} transaktion(er)")
+        print(f"Statistik: {buffer.stats()}")
+        repository.close()
+
+
+class _SinkHandler(socketserver.StreamRequestHandler):
+    """Minimal SMTP-modtager til benchmark: accepterer alt og tæller beskeder.
+    Hver fail_every'te besked afvises med 421, så genforsøg også bliver målt"""
+
+    def reply(self, line):
+        self.wfile.write(line + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        self.reply(b"220 localhost SMTP sink")
+        in_data = False
+        for line in self.rfile:
+            if in_data:
+                if line == b".\r\n":
+                    in_data = False
+                    with server.lock:
+                        server.received += 1
+                        reject = server.fail_every and server.received % server.fail_every == 0
+                    if reject:
+                        self.reply(b"421 Try again later")
+                        return
+                    self.reply(b"250 OK")
+                continue
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                self.reply(b"250 localhost")
+            elif command == b"DATA":
+                in_data = True
+                self.reply(b"354 Send data")
+            elif command == b"QUIT":
+                self.reply(b"221 Bye")
+                return
+            else:
+                self.reply(b"250 OK")
+
+
+class _SinkServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def bench_email(recipient_count=1000):
+    """Rapportudsendelse med ny SMTP-forbindelse pr. modtager mod en pulje af forbindelser"""
+    products = [(f"Produkt {i} & co", f"{(i % 28) + 1:02d}.11.2026", f"57{i:011d}", str(i % 7 + 1), f"faktura_{i}.pdf (Side 1)")
+                for i in range(300)]
+    start_time = time.perf_counter()
+    html, text = render_report(products, "01.11.2026")
+    message = build_message("rapport@example.com", "Dagens rapport: Udløbende Produkter", html, text)
+    print(f"Rapport renderet og MIME bygget én gang: {len(message)} bytes på "
+          f"{(time.perf_counter() - start_time) * 1000:.1f} ms")
+
+    server = _SinkServer(("127.0.0.1", 0), _SinkHandler)
+    server.lock = threading.Lock()
+    server.received = 0
+    server.fail_every = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    recipients = [f"modtager{i}@example.com" for i in range(recipient_count)]
+
+    # Reference: ny forbindelse pr. modtager, som den gamle løkke ville gøre uden genbrug
+    start_time = time.perf_counter()
+    for recipient in recipients[:min(200, recipient_count)]:
+        smtp = smtplib.SMTP("127.0.0.1", port)
+        smtp.sendmail("rapport@example.com", [recipient], f"To: {recipient}\r\n".encode('utf-8') + message)
+        smtp.quit()
+    baseline = min(200, recipient_count) / (time.perf_counter() - start_time)
+    print(f"Ny forbindelse pr. besked: {baseline:.0f} beskeder/s")
+
+    for size in (1, 4):
+        for fail_every in (0, 50):
+            server.fail_every = fail_every
+            with SMTPConnectionPool("127.0.0.1", port, starttls=False, size=size, retry_delay=0.01) as pool:
+                stats = pool.send("rapport@example.com", recipients, message)
+            print(f"Pulje med {size} forbindelse(r){', 421 hver 50. besked' if fail_every else ''}: "
+                  f"{stats['per_second']:.0f} beskeder/s, {stats['sent']} sendt, {len(stats['failed'])} fejlet, "
+                  f"{stats['retries']} genforsøg, {stats['connections']} forbindelser")
+    server.shutdown()
+
+
+def bench_page_filter(corpus_dir):
+    """Sidefilteret mod et mærket korpus: mappe med *.txt og labels.json"""
+    result = evaluate_corpus(corpus_dir)
+    print(f"Sider evalueret: {result['pages']}")
+    print(f"Fordeling: {result['counts']}")
+    print(f"False-negative rate: {result['false_negative_rate']:.2%}")
+    print(f"Andel sider sprunget over: {result['skipped_share']:.2%}")
+    for file_name, reason in result['false_negatives']:
+        print(f"  Overset: {file_name} ({reason})")
+
+
+# Navn -> (funktion, typer for kommandolinjens argumenter)
+BENCHMARKS = {
+    'snapshot': (bench_snapshot, (int,)),
+    'storage': (bench_storage, (int, float, float)),
+    'backup': (bench_backup, (int,)),
+    'expiry-buckets': (bench_expiry_buckets, (int,)),
+    'writer': (bench_writer, (float, int, int)),
+    'repository': (bench_repository, (int, int)),
+    'undo': (bench_undo, (int,)),
+    'db-worker': (bench_db_worker, (int, int)),
+    'cell-edits': (bench_cell_edits, (int, int)),
+    'email': (bench_email, (int,)),
+    'page-filter': (bench_page_filter, (str,)),
+}
+
+
+def main(argv):
+    function, types = BENCHMARKS.get(argv[1], (None, ())) if len(argv) > 1 else (None, ())
+    required = function.__code__.co_argcount - len(function.__defaults__ or ()) if function else 0
+    if function is None or len(argv) - 2 < required:
+        print("Brug: python benchmarks.py <navn> [argumenter]")
+        for name, (function, _) in BENCHMARKS.items():
+            print(f"  {name:15s} {function.__doc__.splitlines()[0]}")
+        return 1
+    args = [convert(value) for convert, value in zip(types, argv[2:])]
+    function(*args)
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(main(sys.argv))
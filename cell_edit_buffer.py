@@ -0,0 +1,54 @@
+import time
+
+from PyQt5.QtCore import QObject, QTimer
+
+
+class CellEditBuffer(QObject):
+    """Samler redigeringer af enkelte celler og sender dem videre samlet.
+
+    add() gemmer den nye værdi under (UniqueID, kolonne), så gentagne rettelser af samme celle kun
+    giver den sidste værdi. Bufferen tømmes debounce_ms efter den seneste redigering, dog senest
+    max_delay_ms efter den første, og flush_callback får så alle ventende celler som
+    [(UniqueID, kolonne, værdi)] i den rækkefølge de først blev rettet.
+    """
+
+    def __init__(self, flush_callback, debounce_ms=500, max_delay_ms=3000, parent=None):
+        super().__init__(parent)
+        self.flush_callback = flush_callback
+        self.max_delay = max_delay_ms / 1000
+        self._pending = {}
+        self._first_edit = None
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(debounce_ms)
+        self._timer.timeout.connect(self.flush)
+        self._stats = {'edits': 0, 'flushes': 0, 'cells_written': 0}
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def add(self, row_id, column, value):
+        self._stats['edits'] += 1
+        self._pending[(str(row_id), column)] = value
+        if self._first_edit is None:
+            self._first_edit = time.monotonic()
+        if time.monotonic() - self._first_edit >= self.max_delay:
+            self.flush()
+        else:
+            self._timer.start()
+
+    def flush(self):
+        """Sender de ventende celler videre med det samme"""
+        self._timer.stop()
+        if not self._pending:
+            return
+        cells = [(row_id, column, value) for (row_id, column), value in self._pending.items()]
+        self._pending = {}
+        self._first_edit = None
+        self._stats['flushes'] += 1
+        self._stats['cells_written'] += len(cells)
+        self.flush_callback(cells)
+
+    def stats(self):
+        return dict(self._stats)
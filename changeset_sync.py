@@ -0,0 +1,320 @@
+import json
+import time
+import uuid
+import hashlib
+import logging
+from datetime import datetime, timezone
+
+SYNCED_COLUMNS = ["ProductID", "SKU", "Article Description Batch", "Expiry Date", "EAN Serial No",
+                  "Remark", "Order QTY", "Ship QTY", "UOM", "PDF Source"]
+
+CHANGES_FOLDER = "/changes"
+
+_JSON_COLUMNS = ', '.join(f"'{col}', NEW.\"{col}\"" for col in SYNCED_COLUMNS)
+_DEVICE = "(SELECT value FROM sync_meta WHERE key='device_id')"
+_NOW = "strftime('%Y-%m-%dT%H:%M:%fZ', 'now')"
+_NOT_APPLYING = "(SELECT value FROM sync_meta WHERE key='applying_remote') IS NOT '1'"
+
+CHANGE_TRACKING_SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS sync_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS row_versions (
+    UniqueID INTEGER PRIMARY KEY,
+    row_uuid TEXT UNIQUE NOT NULL,
+    version INTEGER NOT NULL,
+    device_id TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tombstones (
+    row_uuid TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    device_id TEXT NOT NULL,
+    deleted_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS change_log (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    row_uuid TEXT NOT NULL,
+    op TEXT NOT NULL,
+    row_version INTEGER NOT NULL,
+    device_id TEXT NOT NULL,
+    changed_at TEXT NOT NULL,
+    data TEXT
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_products_sync_insert AFTER INSERT ON products
+WHEN {_NOT_APPLYING}
+BEGIN
+    INSERT OR REPLACE INTO row_versions (UniqueID, row_uuid, version, device_id, updated_at)
+    VALUES (NEW.UniqueID, lower(hex(randomblob(16))), 1, {_DEVICE}, {_NOW});
+    INSERT INTO change_log (row_uuid, op, row_version, device_id, changed_at, data)
+    SELECT row_uuid, 'insert', version, device_id, updated_at, json_object({_JSON_COLUMNS})
+    FROM row_versions WHERE UniqueID = NEW.UniqueID;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_products_sync_update AFTER UPDATE ON products
+WHEN {_NOT_APPLYING}
+BEGIN
+    INSERT OR IGNORE INTO row_versions (UniqueID, row_uuid, version, device_id, updated_at)
+    VALUES (NEW.UniqueID, lower(hex(randomblob(16))), 0, {_DEVICE}, {_NOW});
+    UPDATE row_versions SET version = version + 1, device_id = {_DEVICE}, updated_at = {_NOW}
+    WHERE UniqueID = NEW.UniqueID;
+    INSERT INTO change_log (row_uuid, op, row_version, device_id, changed_at, data)
+    SELECT row_uuid, 'update', version, device_id, updated_at, json_object({_JSON_COLUMNS})
+    FROM row_versions WHERE UniqueID = NEW.UniqueID;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_products_sync_delete AFTER DELETE ON products
+WHEN {_NOT_APPLYING}
+BEGIN
+    INSERT OR IGNORE INTO row_versions (UniqueID, row_uuid, version, device_id, updated_at)
+    VALUES (OLD.UniqueID, lower(hex(randomblob(16))), 0, {_DEVICE}, {_NOW});
+    INSERT OR REPLACE INTO tombstones (row_uuid, version, device_id, deleted_at)
+    SELECT row_uuid, version + 1, {_DEVICE}, {_NOW} FROM row_versions WHERE UniqueID = OLD.UniqueID;
+    INSERT INTO change_log (row_uuid, op, row_version, device_id, changed_at, data)
+    SELECT row_uuid, 'delete', version, device_id, deleted_at, NULL
+    FROM tombstones WHERE row_uuid = (SELECT row_uuid FROM row_versions WHERE UniqueID = OLD.UniqueID);
+    DELETE FROM row_versions WHERE UniqueID = OLD.UniqueID;
+END;
+'''
+
+
+def _legacy_row_uuid(values, occurrence):
+    """Nøgle for en række der fandtes før sporingen. Den afledes af rækkens indhold, så to kopier
+    kun er enige om en række, når indholdet er det samme; ens rækker skelnes med deres nummer"""
+    payload = json.dumps([values, occurrence], ensure_ascii=False)
+    return 'legacy-' + hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def install_change_tracking(conn, device_id):
+    """Opretter change log, versionstabeller og triggers på products.
+
+    Rækker der fandtes før sporingen blev slået til får en nøgle afledt af deres indhold. Har to
+    kopier udviklet sig hver for sig, får forskellige produkter med samme UniqueID derfor hver sin
+    nøgle, og en ændring af det ene overskriver aldrig det andet.
+    """
+    conn.executescript(CHANGE_TRACKING_SCHEMA)
+    conn.execute("INSERT OR REPLACE INTO sync_meta (key, value) VALUES ('device_id', ?)", (device_id,))
+    conn.execute("INSERT OR REPLACE INTO sync_meta (key, value) VALUES ('applying_remote', '0')")
+    untracked = conn.execute(f'''
+        SELECT UniqueID, {', '.join(f'"{col}"' for col in SYNCED_COLUMNS)} FROM products
+        WHERE UniqueID NOT IN (SELECT UniqueID FROM row_versions) ORDER BY UniqueID
+    ''').fetchall()
+    occurrences = {}
+    for unique_id, *values in untracked:
+        values = ['' if value is None else str(value) for value in values]
+        content = tuple(values)
+        occurrence = occurrences.get(content, 0)
+        row_uuid = _legacy_row_uuid(values, occurrence)
+        while conn.execute('SELECT 1 FROM row_versions WHERE row_uuid=?', (row_uuid,)).fetchone():
+            occurrence += 1
+            row_uuid = _legacy_row_uuid(values, occurrence)
+        occurrences[content] = occurrence + 1
+        conn.execute(f"INSERT INTO row_versions (UniqueID, row_uuid, version, device_id, updated_at) "
+                     f"VALUES (?, ?, 0, ?, {_NOW})", (unique_id, row_uuid, device_id))
+    conn.commit()
+
+
+def _change_key(version, changed_at, device_id):
+    """Total orden for konfliktløsning: højeste version vinder, derefter nyeste tid og til sidst enheds-id"""
+    return (version, changed_at or '', device_id or '')
+
+
+class ChangesetSync:
+    """Synkroniserer products række for række via changeset-filer i stedet for hele databasefilen.
+
+    Hver enhed skriver sine ændringer til /changes/<device_id>/<tidsstempel>-<id>.json i en
+    StorageBackend og læser de andre enheders filer siden sin sidste markør. Konflikter løses deterministisk med
+    last-writer-wins pr. række (version, tidspunkt, enheds-id), så alle kopier ender ens. Når en enhed
+    har mere end compact_after_files filer, samles de til én fil med den seneste ændring pr. række.
+
+    Databasen tilgås gennem repository (en ProductRepository), så skrivningerne går gennem dens ene
+    skrivertråd. Netværkskald sker uden for skriverjobbene, så de aldrig holder skrivelåsen.
+    """
+
+    def __init__(self, repository, backend, device_id, compact_after_files=50):
+        self.repository = repository
+        self.backend = backend
+        self.device_id = device_id
+        self.compact_after_files = compact_after_files
+
+    def _get_meta(self, conn, key, default=None):
+        row = conn.execute("SELECT value FROM sync_meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, conn, key, value):
+        conn.execute("INSERT OR REPLACE INTO sync_meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _unpushed(self, conn):
+        last_seq = int(self._get_meta(conn, f"pushed_seq:{self.device_id}", 0))
+        return conn.execute('''
+            SELECT seq, row_uuid, op, row_version, device_id, changed_at, data FROM change_log
+            WHERE seq > ? AND device_id = ? ORDER BY seq
+        ''', (last_seq, self.device_id)).fetchall()
+
+    def push(self):
+        """Skriver lokale ændringer siden sidste push som én changeset-fil. Returnerer (ændringer, bytes)"""
+        rows = self.repository.read(self._unpushed)
+        if not rows:
+            return 0, 0
+
+        # Kun den seneste ændring pr. række er relevant for last-writer-wins
+        latest = {}
+        for seq, row_uuid, op, row_version, device_id, changed_at, data in rows:
+            latest[row_uuid] = {'row_uuid': row_uuid, 'op': op, 'version': row_version,
+                                'device_id': device_id, 'changed_at': changed_at,
+                                'data': json.loads(data) if data else None}
+
+        payload = self._write_changeset(list(latest.values()))
+
+        max_seq = rows[-1][0]
+
+        def mark_pushed(conn):
+            self._set_meta(conn, f"pushed_seq:{self.device_id}", max_seq)
+            conn.execute("DELETE FROM change_log WHERE seq <= ? AND device_id = ?", (max_seq, self.device_id))
+        self.repository.write(mark_pushed)
+        return len(latest), len(payload)
+
+    def _write_changeset(self, changes):
+        """Gemmer changes som en ny fil i enhedens mappe. Navnet sorterer efter alle tidligere filer"""
+        payload = json.dumps({'device_id': self.device_id, 'changes': changes}, ensure_ascii=False).encode('utf-8')
+        file_name = f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')}-{uuid.uuid4().hex[:8]}.json"
+        self.backend.put(payload, f"{CHANGES_FOLDER}/{self.device_id}/{file_name}")
+        return payload
+
+    def compact(self):
+        """Samler enhedens egne changeset-filer til én, når der er flere end compact_after_files.
+
+        Den nye fil indeholder kun den seneste ændring pr. række og får et nyere navn end de gamle,
+        så enheder der endnu ikke har læst dem får alt med, og enheder der har, blot anvender de samme
+        ændringer igen uden virkning. Returnerer antal filer der blev samlet.
+        """
+        folder = f"{CHANGES_FOLDER}/{self.device_id}"
+        entries = [entry for entry in self.backend.list(folder) if not entry.is_folder]
+        if len(entries) <= self.compact_after_files:
+            return 0
+        latest = {}
+        for entry in entries:
+            changeset = json.loads(self.backend.get(f"{folder}/{entry.name}").decode('utf-8'))
+            for change in changeset.get('changes', []):
+                current = latest.get(change['row_uuid'])
+                if current is None or _change_key(change['version'], change['changed_at'], change['device_id']) > \
+                        _change_key(current['version'], current['changed_at'], current['device_id']):
+                    latest[change['row_uuid']] = change
+        self._write_changeset(list(latest.values()))
+        for entry in entries:
+            self.backend.delete(f"{folder}/{entry.name}")
+        logging.info(f"Changeset-filer samlet: {len(entries)} filer til én med {len(latest)} ændringer")
+        return len(entries)
+
+    def apply_change(self, conn, change):
+        """Anvender én fjern-ændring hvis den vinder over den lokale tilstand. Returnerer True hvis anvendt"""
+        remote_key = _change_key(change['version'], change['changed_at'], change['device_id'])
+        local = conn.execute('SELECT UniqueID, version, updated_at, device_id FROM row_versions WHERE row_uuid=?',
+                             (change['row_uuid'],)).fetchone()
+        tombstone = conn.execute('SELECT version, deleted_at, device_id FROM tombstones WHERE row_uuid=?',
+                                 (change['row_uuid'],)).fetchone()
+
+        if local and _change_key(local[1], local[2], local[3]) >= remote_key:
+            return False
+        if tombstone and _change_key(*tombstone) >= remote_key:
+            return False
+
+        if change['op'] == 'delete':
+            if local:
+                conn.execute('DELETE FROM products WHERE UniqueID=?', (local[0],))
+                conn.execute('DELETE FROM row_versions WHERE UniqueID=?', (local[0],))
+            conn.execute('INSERT OR REPLACE INTO tombstones (row_uuid, version, device_id, deleted_at) '
+                         'VALUES (?, ?, ?, ?)',
+                         (change['row_uuid'], change['version'], change['device_id'], change['changed_at']))
+            return True
+
+        data = change['data'] or {}
+        values = [data.get(col, '') for col in SYNCED_COLUMNS]
+        if local:
+            conn.execute(f'''
+                UPDATE products SET {', '.join(f'"{col}"=?' for col in SYNCED_COLUMNS)} WHERE UniqueID=?
+            ''', values + [local[0]])
+            unique_id = local[0]
+        else:
+            cursor = conn.execute(f'''
+                INSERT INTO products ({', '.join(f'"{col}"' for col in SYNCED_COLUMNS)})
+                VALUES ({', '.join('?' for _ in SYNCED_COLUMNS)})
+            ''', values)
+            unique_id = cursor.lastrowid
+            conn.execute('DELETE FROM tombstones WHERE row_uuid=?', (change['row_uuid'],))
+        conn.execute('INSERT OR REPLACE INTO row_versions (UniqueID, row_uuid, version, device_id, updated_at) '
+                     'VALUES (?, ?, ?, ?, ?)',
+                     (unique_id, change['row_uuid'], change['version'], change['device_id'], change['changed_at']))
+        return True
+
+    def _apply_changeset(self, conn, changeset, marker_key, file_name):
+        """Skriverjob: anvender én changeset-fil i én transaktion uden at triggerne logger ændringerne
+        som lokale. Returnerer (anvendte, tabte konflikter)"""
+        applied = skipped = 0
+        self._set_meta(conn, 'applying_remote', '1')
+        for change in changeset.get('changes', []):
+            if self.apply_change(conn, change):
+                applied += 1
+            else:
+                skipped += 1
+        self._set_meta(conn, 'applying_remote', '0')
+        self._set_meta(conn, marker_key, file_name)
+        return applied, skipped
+
+    def pull(self):
+        """Henter og anvender andre enheders changeset-filer siden sidste markør.
+
+        Returnerer (filer, anvendte ændringer, tabte konflikter, bytes)
+        """
+        files_read = applied = skipped = bytes_read = 0
+        for folder in self.backend.list(CHANGES_FOLDER):
+            device_id = folder.name
+            if not folder.is_folder or device_id == self.device_id:
+                continue
+            marker_key = f"pulled:{device_id}"
+            marker = self.repository.read(lambda conn: self._get_meta(conn, marker_key, ''))
+            for entry in self.backend.list(f"{CHANGES_FOLDER}/{device_id}"):
+                file_name = entry.name
+                if entry.is_folder or file_name <= marker:
+                    continue
+                remote_path = f"{CHANGES_FOLDER}/{device_id}/{file_name}"
+                try:
+                    data = self.backend.get(remote_path)
+                except Exception:
+                    # Enheden har samlet sine filer siden listningen; den samlede fil har et nyere navn
+                    if self.backend.stat(remote_path) is None:
+                        continue
+                    raise
+                changeset = json.loads(data.decode('utf-8'))
+                bytes_read += len(data)
+                files_read += 1
+
+                # Fejler en ændring, ruller skriveren hele filen tilbage, og markøren flyttes ikke
+                file_applied, file_skipped = self.repository.write(
+                    lambda conn: self._apply_changeset(conn, changeset, marker_key, file_name))
+                applied += file_applied
+                skipped += file_skipped
+        return files_read, applied, skipped, bytes_read
+
+    def sync(self):
+        """Push efterfulgt af pull. Returnerer statistik for synkroniseringen"""
+        start_time = time.perf_counter()
+        # Skemaændringen committer selv og kører derfor alene på skrivertråden
+        self.repository.run_alone(lambda conn: install_change_tracking(conn, self.device_id))
+        pushed, pushed_bytes = self.push()
+        compacted = self.compact()
+        files_read, applied, skipped, pulled_bytes = self.pull()
+        stats = {
+            'pushed': pushed,
+            'pushed_bytes': pushed_bytes,
+            'compacted_files': compacted,
+            'files_read': files_read,
+            'applied': applied,
+            'conflicts_lost': skipped,
+            'pulled_bytes': pulled_bytes,
+            'seconds': time.perf_counter() - start_time,
+        }
+        logging.info(f"Changeset-synkronisering: {stats}")
+        return stats
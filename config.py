@@ -19,13 +19,93 @@ def get_dropbox_app_secret():
 def get_dropbox_refresh_token():
     return decrypt_data(_DROPBOX_REFRESH_TOKEN)
 
+# Dropbox upload sendes i chunks af denne størrelse (bytes)
+DROPBOX_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Databasen sendes som komprimeret snapshot. Den rå fil bruges kun som fallback ved download
+DROPBOX_SNAPSHOT_PATH = "/products.db.gz"
+DROPBOX_DATABASE_PATH = "/products.db"
+# Lille snapshot med kun de produkter der udløber inden for horisonten. Den daglige rapport læser det
+# i stedet for hele databasen, så horisonten skal være mindst rapportens 14 dage
+DROPBOX_EXPIRY_SNAPSHOT_PATH = "/expiry_snapshot.json.gz"
+EXPIRY_SNAPSHOT_HORIZON_DAYS = 30
+
+# Automatisk synkronisering: ændringer inden for debounce-vinduet samles til én upload
+AUTO_SYNC_ENABLED = True
+AUTO_SYNC_DEBOUNCE_SECONDS = 30
+AUTO_SYNC_MAX_DELAY_SECONDS = 300
+AUTO_SYNC_RETRY_SECONDS = 60
+AUTO_SYNC_SHUTDOWN_TIMEOUT = 30
+# GUI-tråden venter aldrig på en igangværende overførsel; en gendannelse prøves igen efter dette interval
+TRANSFER_LOCK_RETRY_MS = 500
+
+# Sæt til en mappe for at synkronisere mod et lokalt lager i stedet for Dropbox (test og benchmarks).
+# Latenstid i sekunder pr. kald og båndbredde i bytes pr. sekund (None = ubegrænset)
+STORAGE_LOCAL_DIR = None
+STORAGE_LOCAL_LATENCY = 0.0
+STORAGE_LOCAL_BANDWIDTH = None
+
+# Rækkeændringer synkroniseres som changeset-filer. Har en enhed flere filer end dette, samles de til én
+CHANGESET_COMPACT_AFTER_FILES = 50
+
+# Lokale backups tages med SQLites backup-API og gemmes som deduplikerede sider.
+# Højst ét automatisk snapshot pr. interval; alle fra den seneste time, ét pr. time det seneste døgn
+# og ét pr. dag i retention-perioden beholdes
+BACKUP_MIN_INTERVAL_SECONDS = 300
+BACKUP_KEEP_RECENT_HOURS = 1
+BACKUP_HOURLY_HOURS = 24
+BACKUP_RETENTION_DAYS = 30
+
+# Udløbsperioder i dage ud over "udløbet" og "i dag". GUI'en farver og tæller produkterne pr. periode
+EXPIRY_HORIZONS = (7, 14, 30)
+
+# Fortryd-historikken ligger i databasen og begrænses til dette antal handlinger og journalrækker
+UNDO_MAX_GROUPS = 100
+UNDO_MAX_ROWS = 50000
+
 # Database konfiguration
 DATABASE_PATH = os.path.join(get_user_data_dir(), "products.db")
 
+# AI konfiguration
+AI_TEXT_MODEL = "gpt-4o-mini"
+AI_STRONG_MODEL = "gpt-4o"
+# Afviste rækker repareres på den hurtige model. Er der stadig mange afviste efter reparationen,
+# eskaleres hele siden til AI_STRONG_MODEL
+AI_REPAIR_MODEL = AI_TEXT_MODEL
+AI_REPAIR_ENABLED = True
+AI_CACHE_ENABLED = True
+# Cachede AI-svar bruges højst så længe, og kun de nyeste gemmes
+AI_CACHE_MAX_AGE_DAYS = 30
+AI_CACHE_MAX_ENTRIES = 2000
+AI_MAX_RETRIES = 3
+# Lokal sidefiltrering før AI-kald. I shadow mode sendes alle sider stadig til AI'en,
+# og resultatet gemmes som facit i extracted_pages/labels.json ved siden af PDF-filen. Filteret måles med
+# python benchmarks.py page-filter <mappe>
+PAGE_FILTER_ENABLED = True
+PAGE_FILTER_SHADOW_MODE = False
+# Scannede PDF-sider: sider med færre tegn end dette rasteriseres og sendes gennem Vision.
+# 200 DPI giver læsbar småtekst på A4 uden at billedet bliver unødigt stort
+SCAN_MIN_TEXT_CHARS = 20
+SCAN_RENDER_DPI = 200
+SCAN_RENDER_WORKERS = 4
+# Priser i USD pr. 1M tokens (input, output) - bruges til at estimere pris pr. kald
+AI_MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+
 # GUI konfiguration
 WINDOW_TITLE = "Nordisk Film Biografer Produktstyring - Aalborg City Syd"
 WINDOW_WIDTH = 1000
 WINDOW_HEIGHT = 800
+# Måling af hak i brugerfladen: hændelsesløkken regnes som blokeret, hvis den er mere end
+# GUI_STALL_THRESHOLD_MS forsinket. Resultatet logges når programmet lukkes
+GUI_STALL_MONITOR_ENABLED = True
+GUI_STALL_THRESHOLD_MS = 100
+# Rettelser direkte i tabellen gemmes samlet, når der ikke er rettet i CELL_EDIT_DEBOUNCE_MS,
+# dog senest CELL_EDIT_MAX_DELAY_MS efter den første ventende rettelse
+CELL_EDIT_DEBOUNCE_MS = 500
+CELL_EDIT_MAX_DELAY_MS = 3000
 
 # Filtrer muligheder
 FILTER_OPTIONS = ["Alle", "SKU", "Article Description", "ID", "EAN", "Expiry Date"]
\ No newline at end of file
@@ -1,12 +1,18 @@
-import sqlite3
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 import os
-import requests
-import dropbox
+import re
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import pytz
+from db_snapshot import download_snapshot_streaming
+from dropbox_session import DropboxSessionManager
+from dropbox_transfer import download_file_streaming, load_sync_state, save_sync_state
+from expiry_snapshot import load_expiry_snapshot, expiring_rows
+from expiry_buckets import install_expiry_index
+from product_repository import ProductRepository
+from email_delivery import render_report, render_summary, build_message, SMTPConnectionPool
+from storage_backend import DropboxBackend, LocalBackend
 
 # Hent miljøvariabler fra GitHub Secrets
 EMAIL_SENDER = os.getenv('EMAIL_SENDER')
@@ -15,257 +21,246 @@ EMAIL_RECIPIENTS = [email.strip() for email in os.getenv('EMAIL_RECIPIENT', '').
 APP_KEY = os.getenv('APP_KEY')
 APP_SECRET = os.getenv('APP_SECRET')
 REFRESH_TOKEN = os.getenv('REFRESH_TOKEN')
+STORAGE_DIR = os.getenv('STORAGE_DIR')
+# Den senest hentede database gemmes her sammen med dens rev og content hash.
+# I GitHub Actions bevares mappen mellem kørsler med actions/cache
+CACHE_DIR = os.getenv('REPORT_CACHE_DIR', '.report_cache')
+DB_PATH = os.path.join(CACHE_DIR, "products.db")
+# JSON-fil med alle butikker der skal rapporteres på. Uden manifest rapporteres kun på /products.db
+REPORT_MANIFEST = os.getenv('REPORT_MANIFEST')
 
-def get_access_token():
-    """Henter en ny access token fra Dropbox ved hjælp af refresh token."""
-    url = "https://api.dropboxapi.com/oauth2/token"
-    data = {
-        "grant_type": "refresh_token",
-        "refresh_token": REFRESH_TOKEN,
-        "client_id": APP_KEY,
-        "client_secret": APP_SECRET
-    }
-    
-    response = requests.post(url, data=data)
-    response.raise_for_status()
-    return response.json()['access_token']
+SNAPSHOT_PATH = "/products.db.gz"
+DATABASE_PATH = "/products.db"
+EXPIRY_SNAPSHOT_PATH = "/expiry_snapshot.json.gz"
+REPORT_DAYS = 14
+REPORT_SUBJECT = "Dagens rapport: Udløbende Produkter"
+DEFAULT_MAX_WORKERS = 4
 
-def download_db_from_dropbox(access_token):
-    """Downloader databasefilen fra Dropbox ved hjælp af en access token."""
-    dbx = dropbox.Dropbox(access_token)
-    with open("products.db", "wb") as f:
-        metadata, res = dbx.files_download(path="/products.db")
-        f.write(res.content)
-    print("Database downloaded from Dropbox")
+def get_session_manager():
+    """Opretter en Dropbox-session der genbruger access token og HTTP-forbindelser i hele kørslen."""
+    return DropboxSessionManager(APP_KEY, APP_SECRET, REFRESH_TOKEN)
 
-def fetch_expiring_products():
-    """Forespørger databasen om produkter, der udløber i dag eller inden for de næste 14 dage."""
-    conn = sqlite3.connect("products.db")
-    cursor = conn.cursor()
+def get_storage(session_manager=None, storage_dir=STORAGE_DIR):
+    """Lageret databasen hentes fra. Med en lokal mappe kan rapporten køres offline."""
+    if storage_dir:
+        return LocalBackend(storage_dir)
+    return DropboxBackend(session_manager.get_client())
 
-    today = datetime.now().strftime('%Y-%m-%d')
-    in_14_days = (datetime.now() + timedelta(days=14)).strftime('%Y-%m-%d')
+def default_store():
+    """Den ene butik rapporten altid har kørt for: /products.db og modtagerne fra EMAIL_RECIPIENT."""
+    return {'id': '', 'name': None, 'root': '', 'storage_dir': STORAGE_DIR,
+            'recipients': EMAIL_RECIPIENTS, 'cache_dir': CACHE_DIR}
 
-    query = """
-    SELECT 
-        "Article Description Batch",
-        "Expiry Date",
-        "EAN Serial No",
-        "Ship QTY",
-        "PDF Source"
-    FROM products 
-    WHERE date(substr(`Expiry Date`, 7, 4) || '-' || substr(`Expiry Date`, 4, 2) || '-' || substr(`Expiry Date`, 1, 2)) 
-    BETWEEN ? AND ?
-    ORDER BY date(substr(`Expiry Date`, 7, 4) || '-' || substr(`Expiry Date`, 4, 2) || '-' || substr(`Expiry Date`, 1, 2))
+def load_manifest(manifest_path):
+    """Læser manifestet over butikker.
+
+    Formatet er {"max_workers": 4, "summary_recipients": [...], "stores": [{"id": "aalborg",
+    "name": "Aalborg City Syd", "dropbox_root": "/aalborg", "recipients": [...]}, ...]}.
+    En butik kan bruge "storage_dir" i stedet for "dropbox_root". Returnerer (butikker, manifest).
     """
-    cursor.execute(query, (today, in_14_days))
-    products = cursor.fetchall()
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    stores = []
+    for entry in manifest['stores']:
+        store_id = entry.get('id') or re.sub(r'[^a-z0-9]+', '-', entry['name'].lower()).strip('-')
+        stores.append({
+            'id': store_id,
+            'name': entry['name'],
+            'root': entry.get('dropbox_root', '').rstrip('/'),
+            'storage_dir': entry.get('storage_dir'),
+            'recipients': entry.get('recipients', []),
+            'cache_dir': os.path.join(CACHE_DIR, store_id),
+        })
+    if len({store['id'] for store in stores}) != len(stores):
+        raise ValueError("Butikkernes id'er i manifestet skal være unikke")
+    return stores, manifest
 
-    conn.close()
-    return products
+def log(store, message):
+    print(f"[{store['name']}] {message}" if store['name'] else message)
 
-def generate_email_report(products):
-    """Genererer en e-mailrapport baseret på produkterne."""
-    if not products:
-        return "<tr><td colspan='5'>Ingen produkter udløber indenfor de næste 14 dage.</td></tr>", ""
+def download_db(storage, store):
+    """Sørger for at butikkens cache indeholder den aktuelle database. Returnerer (databasesti, bytes hentet).
 
-    email_body_today = ""
-    email_body_14_days = ""
+    Metadata hentes først. Har filen i lageret samme rev og content hash som den cachede kopi,
+    bruges kopien uden download. Ellers streames det komprimerede snapshot - eller den rå
+    databasefil, hvis der ikke findes et snapshot - til disken og erstatter cachen.
+    """
+    start_time = time.perf_counter()
+    db_path = os.path.join(store['cache_dir'], "products.db")
+    state_path = os.path.join(store['cache_dir'], "sync_state.json")
+    remote_path = store['root'] + SNAPSHOT_PATH
+    remote = storage.stat(remote_path)
+    if remote is None:
+        log(store, "Intet snapshot fundet, bruger den rå databasefil")
+        remote_path = store['root'] + DATABASE_PATH
+        remote = storage.stat(remote_path)
+        if remote is None:
+            raise FileNotFoundError(f"Hverken {store['root'] + SNAPSHOT_PATH} eller {remote_path} findes i lageret")
 
-    # Dato i dag
-    today_date = datetime.now().strftime('%d.%m.%Y')
+    cached = load_sync_state(state_path).get(remote_path)
+    if (cached and os.path.exists(db_path) and cached.get('rev') == remote.rev
+            and cached.get('content_hash') == remote.content_hash):
+        log(store, f"Databasen er uændret (rev {remote.rev}) - bruger cachet kopi, 0 bytes hentet "
+                   f"på {time.perf_counter() - start_time:.2f} sekunder")
+        return db_path, 0
 
-    for product in products:
-        article_description = product[0] if product[0] else "Ingen beskrivelse"
-        expiry_date = product[1] if product[1] else "Ingen dato"
-        ean_serial_no = product[2] if product[2] else "Ingen"
-        ship_qty = product[3] if product[3] else "Ingen"
-        pdf_source = product[4] if product[4] else "Ingen"
-        
-        row = f"""
-        <tr>
-            <td class="product-name">{article_description}</td>
-            <td class="date">{expiry_date}</td>
-            <td class="ean">{ean_serial_no}</td>
-            <td class="qty">{ship_qty}</td>
-            <td class="source">{pdf_source}</td>
-        </tr>
-        """
+    os.makedirs(store['cache_dir'], exist_ok=True)
+    temp_path = db_path + ".download"
+    if remote_path.endswith(SNAPSHOT_PATH):
+        metadata = download_snapshot_streaming(storage, remote_path, temp_path)
+    else:
+        metadata = download_file_streaming(storage, remote_path, temp_path)
+    os.replace(temp_path, db_path)
+    save_sync_state(state_path, remote_path, metadata)
+    log(store, f"Database hentet (rev {metadata.rev}): {metadata.size} bytes på {time.perf_counter() - start_time:.2f} sekunder")
+    return db_path, metadata.size
 
-        if expiry_date == today_date:
-            row = f"""
-            <tr style="color: red; font-weight: bold;">
-                <td class="product-name">{article_description}</td>
-                <td class="date">{expiry_date}</td>
-                <td class="ean">{ean_serial_no}</td>
-                <td class="qty">{ship_qty}</td>
-                <td class="source">{pdf_source}</td>
-            </tr>
-            """
-            email_body_today += row
-        else:
-            email_body_14_days += row
+def fetch_expiring_from_snapshot(storage, store):
+    """Henter produkterne fra det lille udløbs-snapshot som GUI'en publicerer ved synkronisering.
 
-    if email_body_today == "":
-        email_body_today = "<tr><td colspan='5'>Ingen produkter udløber i dag.</td></tr>"
+    Snapshottet bruges kun hvis det er bygget af den database der ligger i lageret nu og dækker
+    hele rapportens periode. Returnerer (produkter, bytes hentet); produkter er None når hele
+    databasen skal bruges i stedet.
+    """
+    start_time = time.perf_counter()
+    database = storage.stat(store['root'] + SNAPSHOT_PATH)
+    if database is None:
+        return None, 0
+    document, size = load_expiry_snapshot(storage, store['root'] + EXPIRY_SNAPSHOT_PATH)
+    if document is None:
+        log(store, "Intet gyldigt udløbs-snapshot fundet")
+        return None, size
+    today = datetime.now()
+    products = expiring_rows(document, today.strftime('%Y-%m-%d'),
+                             (today + timedelta(days=REPORT_DAYS)).strftime('%Y-%m-%d'), database.content_hash)
+    if products is None:
+        log(store, "Udløbs-snapshottet passer ikke til den aktuelle database eller periode")
+        return None, size
+    log(store, f"Udløbs-snapshot læst: {size} bytes på {time.perf_counter() - start_time:.2f} sekunder")
+    return products, size
 
-    return email_body_today, email_body_14_days
+def fetch_expiring_products(db_path=DB_PATH):
+    """Forespørger databasen om produkter, der udløber i dag eller inden for de næste 14 dage.
 
-def send_email(subject, body_today, body_14_days):
-    """Sender e-mailen til alle modtagere."""
-    msg = MIMEMultipart("alternative")
-    msg['From'] = EMAIL_SENDER
-    msg['Subject'] = subject
-    
-    html = f"""
-    <html>
-    <head>
-        <style>
-            body {{
-                font-family: Arial, sans-serif;
-                color: #333333;
-            }}
-            .container {{
-                width: 80%;
-                margin: 0 auto;
-                padding: 20px;
-                background-color: #f9f9f9;
-                border: 1px solid #ddd;
-                border-radius: 10px;
-            }}
-            h1 {{
-                color: #4A90E2;
-            }}
-            table {{
-                width: 100%;
-                border-collapse: collapse;
-                margin-top: 20px;
-                table-layout: fixed;
-            }}
-            th, td {{
-                padding: 10px;
-                border-bottom: 1px solid #ddd;
-                text-align: left;
-                overflow: hidden;
-                text-overflow: ellipsis;
-                white-space: nowrap;
-            }}
-            th {{
-                background-color: #4A90E2;
-                color: #ffffff;
-            }}
-            .product-name {{
-                width: 35%;
-            }}
-            .date {{
-                width: 15%;
-            }}
-            .ean {{
-                width: 20%;
-            }}
-            .qty {{
-                width: 15%;
-            }}
-            .source {{
-                width: 15%;
-            }}
-            tr:hover {{
-                background-color: #f5f5f5;
-            }}
-            .warning {{
-                color: #ff6b6b;
-                font-weight: bold;
-            }}
-            @media screen and (max-width: 768px) {{
-                .container {{
-                    width: 95%;
-                    padding: 10px;
-                }}
-                th, td {{
-                    padding: 5px;
-                    font-size: 14px;
-                }}
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>Dagens Rapport: Udløbende Produkter</h1>
+    Bruger samme indekserede udløbsforespørgsel som GUI'en. Indekset oprettes i den cachede kopi
+    første gang, så senere kørsler mod en uændret database kun læser de relevante rækker.
+    """
+    with ProductRepository(db_path) as repository:
+        repository.run_alone(install_expiry_index)
+        return [product[:-1] for product in repository.expiring(REPORT_DAYS)]
 
-            <h2>Produkter Udløbende I Dag:</h2>
-            <table>
-                <tr>
-                    <th class="product-name">Article Description</th>
-                    <th class="date">Expiry Date</th>
-                    <th class="ean">EAN Serial No</th>
-                    <th class="qty">Ship QTY</th>
-                    <th class="source">PDF Source</th>
-                </tr>
-                {body_today}
-            </table>
+def collect_store(store, session_manager):
+    """Henter og forespørger én butiks database. Fejl fanges, så én butik aldrig stopper de andre."""
+    result = {'store': store, 'products': None, 'error': None, 'source': None, 'bytes': 0,
+              'fetch_seconds': 0.0, 'query_seconds': 0.0, 'send_seconds': 0.0, 'sent': 0, 'failed': {}}
+    start_time = time.perf_counter()
+    try:
+        storage = get_storage(session_manager, store['storage_dir'])
+        products, result['bytes'] = fetch_expiring_from_snapshot(storage, store)
+        result['source'] = 'udløbs-snapshot'
+        if products is None:
+            log(store, "Bruger hele databasen")
+            db_path, size = download_db(storage, store)
+            result['bytes'] += size
+            result['fetch_seconds'] = time.perf_counter() - start_time
+            query_start = time.perf_counter()
+            products = fetch_expiring_products(db_path)
+            result['query_seconds'] = time.perf_counter() - query_start
+            result['source'] = 'database'
+        else:
+            result['fetch_seconds'] = time.perf_counter() - start_time
+        result['products'] = products
+        log(store, f"Fandt {len(products)} produkter der udløber snart")
+    except Exception as e:
+        result['error'] = str(e)
+        result['fetch_seconds'] = time.perf_counter() - start_time
+        log(store, f"Fejl ved hentning af data: {e}")
+    return result
 
-            <h2>Produkter Udløbende Indenfor 14 Dage</h2>
-            <p>Her er en liste over produkter, der udløber inden for de næste 14 dage:</p>
-            <table>
-                <tr>
-                    <th class="product-name">Article Description</th>
-                    <th class="date">Expiry Date</th>
-                    <th class="ean">EAN Serial No</th>
-                    <th class="qty">Ship QTY</th>
-                    <th class="source">PDF Source</th>
-                </tr>
-                {body_14_days}
-            </table>
+def send_email(pool, subject, products, recipients, store_name=None):
+    """Renderer rapporten og sender den til modtagerne.
 
-            <p style="margin-top: 20px; font-size: 12px; color: #666;">
-                Denne rapport er automatisk genereret. Ved spørgsmål kontakt venligst IT-support.
-            </p>
-        </div>
-    </body>
-    </html>
+    Beskeden bygges én gang med HTML- og tekstversion og sendes med en envelope pr. modtager over
+    puljens genbrugte SMTP-forbindelser. Forbigående SMTP-fejl forsøges igen. Returnerer puljens statistik.
     """
+    html, text = render_report(products, datetime.now().strftime('%d.%m.%Y'), REPORT_DAYS, store_name)
+    message = build_message(EMAIL_SENDER, subject, html, text)
+    return pool.send(EMAIL_SENDER, recipients, message)
 
-    msg.attach(MIMEText(html, "html"))
-    
+def deliver_store_report(pool, result):
+    """Sender én butiks rapport. En fejl registreres på butikken og stopper ikke de andre."""
+    store = result['store']
+    recipients = [recipient for recipient in store['recipients'] if recipient]
+    if result['products'] is None or not recipients:
+        return
+    subject = f"{REPORT_SUBJECT} - {store['name']}" if store['name'] else REPORT_SUBJECT
+    start_time = time.perf_counter()
     try:
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(EMAIL_SENDER, EMAIL_PASSWORD)
-        
-        # Send til hver modtager individuelt
-        for recipient in EMAIL_RECIPIENTS:
-            if recipient:  # Tjek at e-mailen ikke er tom
-                msg_copy = MIMEMultipart("alternative")
-                msg_copy['From'] = EMAIL_SENDER
-                msg_copy['To'] = recipient
-                msg_copy['Subject'] = subject
-                msg_copy.attach(MIMEText(html, "html"))
-                
-                server.sendmail(EMAIL_SENDER, recipient, msg_copy.as_string())
-                print(f"E-mail sendt succesfuldt til {recipient}")
-        
-        server.quit()
-        print("Alle e-mails er sendt succesfuldt.")
+        stats = send_email(pool, subject, result['products'], recipients, store['name'])
+        result['sent'] = len(recipients) - len(stats['failed'])
+        result['failed'] = stats['failed']
+        for recipient, error in stats['failed'].items():
+            log(store, f"Fejl ved afsendelse af e-mail til {recipient}: {error}")
+        log(store, f"{result['sent']} e-mails sendt ({stats['retries']} genforsøg i alt)")
+    except Exception as e:
+        result['error'] = f"afsendelse fejlede: {e}"
+        log(store, f"Fejl ved afsendelse af e-mail: {e}")
+    result['send_seconds'] = time.perf_counter() - start_time
+
+def run_report(stores, summary_recipients=(), max_workers=DEFAULT_MAX_WORKERS):
+    """Kører rapporten for alle butikker og returnerer resultatet pr. butik.
+
+    Data hentes og forespørges parallelt med højst max_workers butikker ad gangen. Derefter sendes
+    hver butiks rapport over én fælles SMTP-pulje, og til sidst en samlet oversigt til summary_recipients.
+    """
+    session_manager = None
+    if any(not store['storage_dir'] for store in stores):
+        session_manager = get_session_manager()
+        session_manager.get_access_token()
+        print("Access token hentet fra Dropbox")
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(stores)))) as executor:
+        results = list(executor.map(lambda store: collect_store(store, session_manager), stores))
+    print(f"Data for {len(stores)} butik(ker) hentet på {time.perf_counter() - start_time:.2f} sekunder")
+    if session_manager:
+        stats = session_manager.stats()
+        print(f"Dropbox: tokenfornyelse {stats['token_refresh_seconds']:.2f} s, "
+              f"{stats['requests']} kald med gns. {stats['avg_request_seconds'] * 1000:.0f} ms")
+
+    try:
+        with SMTPConnectionPool('smtp.gmail.com', 587, EMAIL_SENDER, EMAIL_PASSWORD) as pool:
+            for result in results:
+                deliver_store_report(pool, result)
+            if summary_recipients:
+                html, text = render_summary(results, datetime.now().strftime('%d.%m.%Y'), REPORT_DAYS)
+                message = build_message(EMAIL_SENDER, f"{REPORT_SUBJECT} - samlet oversigt", html, text)
+                stats = pool.send(EMAIL_SENDER, summary_recipients, message)
+                print(f"Samlet oversigt sendt til {len(summary_recipients) - len(stats['failed'])} modtagere")
     except Exception as e:
         print(f"Fejl ved afsendelse af e-mail: {e}")
 
+    print("Tider pr. butik (hent / forespørg / send):")
+    for result in results:
+        status = f"FEJL: {result['error']}" if result['error'] else f"{len(result['products'])} produkter fra {result['source']}"
+        print(f"  {result['store']['name'] or 'products.db'}: {result['fetch_seconds']:.2f} / "
+              f"{result['query_seconds']:.2f} / {result['send_seconds']:.2f} s, {result['bytes']} bytes - {status}")
+    return results
+
 if __name__ == "__main__":
     try:
         print("Starter daglig rapport proces...")
-        access_token = get_access_token()
-        print("Access token hentet fra Dropbox")
-        
-        download_db_from_dropbox(access_token)
-        print("Database downloaded fra Dropbox")
-        
-        products = fetch_expiring_products()
-        print(f"Fandt {len(products)} produkter der udløber snart")
-        
-        report_body_today, report_body_14_days = generate_email_report(products)
-        print("E-mail rapport genereret")
-        
-        send_email("Dagens rapport: Udløbende Produkter", report_body_today, report_body_14_days)
-        print("Process fuldført succesfult")
+        run_start = time.perf_counter()
+        if REPORT_MANIFEST:
+            stores, manifest = load_manifest(REPORT_MANIFEST)
+            results = run_report(stores, manifest.get('summary_recipients', []),
+                                 manifest.get('max_workers', DEFAULT_MAX_WORKERS))
+        else:
+            results = run_report([default_store()])
+        failed = [result for result in results if result['error']]
+        print(f"Process fuldført på {time.perf_counter() - run_start:.2f} sekunder: "
+              f"{len(results) - len(failed)} af {len(results)} butikker OK, "
+              f"{sum(result['bytes'] for result in results)} bytes hentet fra lageret")
     except Exception as e:
         print(f"Kritisk fejl i hovedprocessen: {e}")
-        # Her kunne tilføjes yderligere fejlhåndtering efter behov
\ No newline at end of file
+        # Her kunne tilføjes yderligere fejlhåndtering efter behov
@@ -0,0 +1,146 @@
+import os
+import gzip
+import zlib
+import time
+import struct
+import sqlite3
+import hashlib
+import logging
+
+# Header: magic, SHA-256 af den ukomprimerede database og dens størrelse, efterfulgt af en gzip-strøm
+SNAPSHOT_MAGIC = b'SSDBGZ1\n'
+SNAPSHOT_HEADER = struct.Struct('>8s32sQ')
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def vacuum_into(db_path, target_path):
+    """Skriver en kompakt kopi af databasen uden frie sider, fx efter 'Ryd Database'"""
+    if os.path.exists(target_path):
+        os.remove(target_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute('VACUUM INTO ?', (target_path,))
+    except sqlite3.OperationalError:
+        # SQLite før 3.27 kender ikke VACUUM INTO - tag en kopi med backup-API'et og vacuum den
+        target = sqlite3.connect(target_path)
+        try:
+            conn.backup(target)
+            target.execute('VACUUM')
+        finally:
+            target.close()
+    finally:
+        conn.close()
+
+
+def create_snapshot(db_path, snapshot_path, compresslevel=6, vacuum_path=None):
+    """Laver et komprimeret snapshot af databasen med checksum-header.
+
+    gzip skrives med mtime=0, så den samme database altid giver den samme fil og Dropbox'
+    content hash kan bruges til at springe uændrede uploads over. Med vacuum_path beholdes den
+    vacuumede kopi, snapshottet er lavet af, og kalderen sletter den selv.
+    Returnerer (rå størrelse, vacuumet størrelse, snapshot-størrelse).
+    """
+    keep_vacuum = vacuum_path is not None
+    vacuum_path = vacuum_path or snapshot_path + ".vacuum"
+    vacuum_into(db_path, vacuum_path)
+    try:
+        digest = hashlib.sha256()
+        size = 0
+        with open(snapshot_path, 'wb') as out:
+            out.write(b'\0' * SNAPSHOT_HEADER.size)
+            with gzip.GzipFile(filename='', mode='wb', fileobj=out, compresslevel=compresslevel, mtime=0) as gz:
+                with open(vacuum_path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+                        digest.update(chunk)
+                        size += len(chunk)
+                        gz.write(chunk)
+            out.seek(0)
+            out.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, digest.digest(), size))
+    finally:
+        if not keep_vacuum and os.path.exists(vacuum_path):
+            os.remove(vacuum_path)
+    return os.path.getsize(db_path), size, os.path.getsize(snapshot_path)
+
+
+def restore_snapshot_stream(chunks, output_path):
+    """Dekomprimerer et snapshot mens det modtages og kontrollerer checksummen.
+
+    chunks er en iterator af bytes, fx response.iter_content(). Ved fejl slettes output_path.
+    Returnerer antal modtagne (komprimerede) bytes.
+    """
+    header = b''
+    received = 0
+    digest = hashlib.sha256()
+    size = 0
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    try:
+        with open(output_path, 'wb') as out:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                received += len(chunk)
+                if len(header) < SNAPSHOT_HEADER.size:
+                    missing = SNAPSHOT_HEADER.size - len(header)
+                    header += chunk[:missing]
+                    chunk = chunk[missing:]
+                    if len(header) < SNAPSHOT_HEADER.size:
+                        continue
+                    magic, expected_digest, expected_size = SNAPSHOT_HEADER.unpack(header)
+                    if magic != SNAPSHOT_MAGIC:
+                        raise IOError("Filen er ikke et gyldigt database-snapshot")
+                data = decompressor.decompress(chunk)
+                digest.update(data)
+                size += len(data)
+                out.write(data)
+            data = decompressor.flush()
+            digest.update(data)
+            size += len(data)
+            out.write(data)
+            out.flush()
+            os.fsync(out.fileno())
+
+        if len(header) < SNAPSHOT_HEADER.size or not decompressor.eof:
+            raise IOError("Database-snapshottet er ufuldstændigt")
+        if size != expected_size or digest.digest() != expected_digest:
+            raise IOError("Database-snapshottet er beskadiget (checksum passer ikke)")
+    except zlib.error as e:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise IOError(f"Database-snapshottet er beskadiget: {e}") from e
+    except BaseException:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+    return received
+
+
+def restore_snapshot(snapshot_path, output_path):
+    """Gendanner en database fra en lokal snapshot-fil"""
+    with open(snapshot_path, 'rb') as f:
+        return restore_snapshot_stream(iter(lambda: f.read(COPY_CHUNK_SIZE), b''), output_path)
+
+
+def download_snapshot_streaming(backend, remote_path, output_path, chunk_size=COPY_CHUNK_SIZE,
+                                progress_callback=None):
+    """Henter et snapshot fra lageret og dekomprimerer det direkte til output_path.
+
+    backend er en StorageBackend. Returnerer metadata for det hentede snapshot.
+    """
+    start_time = time.perf_counter()
+    metadata, stream = backend.get_stream(remote_path, chunk_size)
+    progress = {'received': 0}
+
+    def chunks():
+        for chunk in stream:
+            progress['received'] += len(chunk)
+            if progress_callback:
+                progress_callback(progress['received'], metadata.size)
+            yield chunk
+
+    try:
+        received = restore_snapshot_stream(chunks(), output_path)
+    finally:
+        stream.close()
+    logging.info(f"Snapshot {remote_path} hentet: {received} bytes over nettet, "
+                 f"{os.path.getsize(output_path)} bytes dekomprimeret på {time.perf_counter() - start_time:.2f} sekunder")
+    return metadata
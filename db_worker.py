@@ -0,0 +1,134 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+
+class DbWorker(QObject):
+    """Kører databasearbejde på én baggrundstråd og leverer resultatet tilbage på GUI-tråden.
+
+    run() returnerer straks en Future. Når operationen er færdig, kaldes on_success(resultat) eller
+    on_error(undtagelse) på GUI-tråden, så de må røre widgets. Operationerne udføres i den rækkefølge
+    de er startet, så en redigering altid ser resultatet af den forrige. busy_changed sendes når den
+    første operation starter og når den sidste er færdig, så knapperne kan spærres imens.
+    """
+
+    busy_changed = pyqtSignal(bool)
+    _completed = pyqtSignal(object, object, object)  # (future, on_success, on_error)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-worker')
+        self._pending = 0
+        self._closed = False
+        # Statistikken opdateres på baggrundstråden og læses på GUI-tråden
+        self._lock = threading.Lock()
+        self._stats = {'operations': 0, 'failed': 0, 'max_seconds': 0.0, 'total_seconds': 0.0}
+        # Signalet sendes fra baggrundstråden og køes derfor til GUI-tråden, hvor objektet bor
+        self._completed.connect(self._finish)
+
+    @property
+    def busy(self):
+        return self._pending > 0
+
+    def run(self, operation, on_success=None, on_error=None):
+        """Lægger operation() i kø. Må ikke røre widgets - det gør callbackene"""
+        started = time.perf_counter()
+
+        def timed():
+            try:
+                return operation()
+            finally:
+                elapsed = time.perf_counter() - started
+                with self._lock:
+                    self._stats['max_seconds'] = max(self._stats['max_seconds'], elapsed)
+                    self._stats['total_seconds'] += elapsed
+
+        self._pending += 1
+        if self._pending == 1:
+            self.busy_changed.emit(True)
+        future = self._executor.submit(timed)
+        future.add_done_callback(lambda done: self._completed.emit(done, on_success, on_error))
+        return future
+
+    def _finish(self, future, on_success, on_error):
+        try:
+            error = future.exception()
+            with self._lock:
+                self._stats['operations'] += 1
+                if error is not None:
+                    self._stats['failed'] += 1
+            if error is not None:
+                logging.error(f"Fejl i databaseoperation: {str(error)}")
+                if on_error:
+                    on_error(error)
+            elif on_success:
+                on_success(future.result())
+        except Exception as e:
+            logging.error(f"Fejl ved afslutning af databaseoperation: {str(e)}")
+        finally:
+            self._pending -= 1
+            if self._pending == 0:
+                self.busy_changed.emit(False)
+
+    def drain(self):
+        """Venter til alle startede operationer er udført. Callbackene kører først, når GUI-trådens
+        hændelsesløkke får lov at køre igen"""
+        if not self._closed:
+            self._executor.submit(lambda: None).result()
+
+    def shutdown(self):
+        self._closed = True
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+class EventLoopStallMonitor(QObject):
+    """Måler hvor længe GUI-trådens hændelsesløkke er blokeret.
+
+    En timer skal udløses hvert interval_ms. Kommer den mere end threshold_ms for sent, har
+    hændelsesløkken været blokeret, og forsinkelsen registreres som et hak i brugerfladen.
+    """
+
+    def __init__(self, interval_ms=10, threshold_ms=50, parent=None):
+        super().__init__(parent)
+        self.interval = interval_ms / 1000
+        self.threshold = threshold_ms / 1000
+        self._timer = QTimer(self)
+        self._timer.setInterval(interval_ms)
+        self._timer.timeout.connect(self._tick)
+        self._last_tick = None
+        self.reset()
+
+    def reset(self):
+        self.stalls = 0
+        self.max_stall = 0.0
+        self.total_stall = 0.0
+
+    def start(self):
+        self._last_tick = time.perf_counter()
+        self._timer.start()
+
+    def stop(self):
+        self._timer.stop()
+
+    def _tick(self):
+        now = time.perf_counter()
+        stall = now - self._last_tick - self.interval
+        self._last_tick = now
+        if stall > self.threshold:
+            self.stalls += 1
+            self.total_stall += stall
+            self.max_stall = max(self.max_stall, stall)
+
+    def summary(self):
+        return {'stalls': self.stalls, 'max_ms': round(self.max_stall * 1000, 1),
+                'total_ms': round(self.total_stall * 1000, 1)}
+
+    def log_summary(self, label):
+        logging.info(f"Hak i brugerfladen ({label}): {self.summary()}")
@@ -0,0 +1,234 @@
+import os
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future
+
+_STOP = object()
+
+
+def configure_wal(conn):
+    """WAL lader læsere arbejde samtidig med én skriver. Med synchronous=NORMAL synkroniseres der
+    kun ved checkpoints, så en commit ikke venter på disken; databasen kan ikke blive korrupt ved
+    strømsvigt, men de seneste commits kan gå tabt"""
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+
+
+def release_wal(db_path, timeout=10):
+    """Checkpointer WAL'en ind i databasefilen og skifter til journal_mode=DELETE, så SQLite selv
+    fjerner -wal og -shm ved lukningen. Skal ske før databasefilen udskiftes eller slettes.
+
+    Skiftet kræver at ingen anden forbindelse er åben. Er der det stadig efter timeout sekunder,
+    rejses sqlite3.OperationalError, og filen må ikke udskiftes. Næste DatabaseWriter slår WAL til igen.
+    """
+    if not os.path.exists(db_path):
+        return
+    conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+    try:
+        mode = conn.execute('PRAGMA journal_mode=DELETE').fetchone()[0]
+    finally:
+        conn.close()
+    if mode.lower() != 'delete':
+        raise sqlite3.OperationalError(f"Kunne ikke forlade WAL-tilstand for {db_path} (journal_mode={mode})")
+
+
+class DatabaseWriter:
+    """Én tråd med én forbindelse som udfører alle skrivninger til databasen.
+
+    submit() lægger et job i køen og returnerer en Future. Skrivertråden tager alle ventende jobs
+    (op til max_batch) og udfører dem i én transaktion med et savepoint pr. job, så en fejl kun ruller
+    det ene job tilbage. Futures afsluttes først efter commit. Jobs med transaction=False, fx
+    skemaændringer der selv committer, udføres alene uden for en batch.
+    """
+
+    def __init__(self, db_path, max_batch=100, timeout=30, cached_statements=128):
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {'jobs': 0, 'batches': 0, 'largest_batch': 0, 'failed_jobs': 0,
+                       'lock_waits': 0, 'lock_wait_seconds': 0.0}
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="DatabaseWriter", daemon=True)
+                self._thread.start()
+
+    def submit(self, job, transaction=True):
+        """Kører job(conn) på skrivertråden og returnerer en Future med jobbets resultat"""
+        future = Future()
+        self._ensure_started()
+        self._queue.put((job, transaction, future))
+        return future
+
+    def write(self, job, transaction=True):
+        return self.submit(job, transaction).result()
+
+    def _connect(self):
+        # isolation_level=None: transaktioner styres eksplicit med BEGIN, SAVEPOINT og COMMIT
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None,
+                               check_same_thread=False, cached_statements=self.cached_statements)
+        configure_wal(conn)
+        return conn
+
+    def _begin(self, conn):
+        # BEGIN IMMEDIATE tager skrivelåsen med det samme. Venter den, er det på en skriver uden for køen
+        start_time = time.perf_counter()
+        conn.execute('BEGIN IMMEDIATE')
+        waited = time.perf_counter() - start_time
+        if waited > 0.005:
+            with self._lock:
+                self._stats['lock_waits'] += 1
+                self._stats['lock_wait_seconds'] += waited
+
+    def _run_batch(self, conn, batch):
+        self._begin(conn)
+        results = []
+        try:
+            for index, (job, _, future) in enumerate(batch):
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute(f'SAVEPOINT job_{index}')
+                try:
+                    results.append((future, job(conn), None))
+                    conn.execute(f'RELEASE job_{index}')
+                except Exception as e:
+                    conn.execute(f'ROLLBACK TO job_{index}')
+                    conn.execute(f'RELEASE job_{index}')
+                    results.append((future, None, e))
+            conn.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            for job, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        failed = 0
+        for future, result, error in results:
+            if error is not None:
+                failed += 1
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        with self._lock:
+            self._stats['jobs'] += len(batch)
+            self._stats['batches'] += 1
+            self._stats['largest_batch'] = max(self._stats['largest_batch'], len(batch))
+            self._stats['failed_jobs'] += failed
+
+    def _run_alone(self, conn, job, future):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(job(conn))
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            future.set_exception(e)
+        with self._lock:
+            self._stats['jobs'] += 1
+
+    def _run(self):
+        conn = None
+        pending = None
+        while True:
+            item = pending or self._queue.get()
+            pending = None
+            if item is _STOP:
+                break
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except sqlite3.Error as e:
+                    item[2].set_exception(e)
+                    continue
+            job, transaction, future = item
+            if not transaction:
+                self._run_alone(conn, job, future)
+                continue
+            batch = [item]
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP or not item[1]:
+                    pending = item
+                    break
+                batch.append(item)
+            self._run_batch(conn, batch)
+        if conn is not None:
+            try:
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            except sqlite3.Error as e:
+                logging.warning(f"WAL checkpoint ved lukning fejlede: {e}")
+            conn.close()
+
+    def close(self):
+        """Udfører de ventende jobs og stopper tråden. Et nyt submit() starter en ny tråd"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+class ReaderPool:
+    """Genbrugte læseforbindelser. I WAL-tilstand blokerer læsere hverken hinanden eller skriveren"""
+
+    def __init__(self, db_path, size=4, timeout=30, cached_statements=128):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        conn.execute('PRAGMA query_only=ON')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        with self._lock:
+            generation = self._generation
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            # Forbindelser fra før close() hører måske til en fil der er blevet udskiftet
+            with self._lock:
+                keep = generation == self._generation and self._idle.qsize() < self.size
+            if keep:
+                self._idle.put(conn)
+            else:
+                conn.close()
+
+    def close(self):
+        with self._lock:
+            self._generation += 1
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
@@ -0,0 +1,132 @@
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import requests
+from requests.adapters import HTTPAdapter
+from dropbox import Dropbox
+
+TOKEN_URL = "https://api.dropboxapi.com/oauth2/token"
+# Tokenet fornys lidt før det udløber, så et kald aldrig sendes med et netop udløbet token
+TOKEN_EXPIRY_MARGIN = 300
+REQUEST_TIMEOUT = 100
+
+
+class DropboxSessionManager:
+    """Delt adgang til Dropbox: ét keep-alive HTTP session og et cachet access token.
+
+    Access tokenet hentes med refresh tokenet første gang det skal bruges og genbruges indtil kort
+    før det udløber. Alle kald - også tokenfornyelsen - går gennem den samme requests.Session, så
+    TLS-forbindelser genbruges. CA-bundtet sættes på sessionen i stedet for globalt i os.environ.
+    """
+
+    def __init__(self, app_key, app_secret, refresh_token, ca_bundle=None, max_connections=8,
+                 timeout=REQUEST_TIMEOUT):
+        self.app_key = app_key
+        self.app_secret = app_secret
+        self.refresh_token = refresh_token
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._token_lock = threading.Lock()
+        self._access_token = None
+        self._expires_at = 0.0
+        self._client = None
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+        self.session.mount('https://', adapter)
+        if ca_bundle:
+            self.session.verify = ca_bundle
+        self.session.hooks['response'].append(self._record_response)
+
+        self._stats = {
+            'token_refreshes': 0,
+            'token_refresh_seconds': 0.0,
+            'token_cache_hits': 0,
+            'requests': 0,
+            'request_seconds': 0.0,
+        }
+
+    def _record_response(self, response, *args, **kwargs):
+        with self._lock:
+            self._stats['requests'] += 1
+            self._stats['request_seconds'] += response.elapsed.total_seconds()
+
+    def _refresh_access_token(self):
+        start_time = time.perf_counter()
+        response = self.session.post(TOKEN_URL, data={
+            'grant_type': 'refresh_token',
+            'refresh_token': self.refresh_token,
+            'client_id': self.app_key,
+            'client_secret': self.app_secret,
+        }, timeout=self.timeout)
+        response.raise_for_status()
+        payload = response.json()
+        elapsed = time.perf_counter() - start_time
+
+        with self._lock:
+            self._access_token = payload['access_token']
+            self._expires_at = time.time() + payload.get('expires_in', 14400)
+            self._client = None
+            self._stats['token_refreshes'] += 1
+            self._stats['token_refresh_seconds'] += elapsed
+        logging.info(f"Dropbox access token fornyet på {elapsed:.2f} sekunder "
+                     f"(gyldigt i {payload.get('expires_in', 14400)} sekunder)")
+
+    def get_access_token(self):
+        """Returnerer et gyldigt access token og fornyer det kun når det er ved at udløbe"""
+        with self._lock:
+            if self._access_token and time.time() < self._expires_at - TOKEN_EXPIRY_MARGIN:
+                self._stats['token_cache_hits'] += 1
+                return self._access_token
+        # Fornyelsen har sin egen lås, da svarhooket tager self._lock under kaldet
+        with self._token_lock:
+            if not self._access_token or time.time() >= self._expires_at - TOKEN_EXPIRY_MARGIN:
+                self._refresh_access_token()
+            return self._access_token
+
+    def get_client(self):
+        """Returnerer en Dropbox-klient der deler sessionen og det cachede token.
+
+        Klienten kender også refresh tokenet, så en klient der holdes længe fornyer sig selv.
+        """
+        try:
+            access_token = self.get_access_token()
+        except requests.exceptions.RequestException as e:
+            # Uden forbindelse ved opstart henter klienten selv et token ved første kald
+            logging.warning(f"Kunne ikke hente Dropbox access token: {e}")
+            access_token = None
+        with self._lock:
+            if self._client is None:
+                expiration = None
+                if access_token:
+                    # SDK'et sammenligner udløbstidspunktet med UTC
+                    expiration = datetime.utcnow() + timedelta(seconds=self._expires_at - time.time())
+                self._client = Dropbox(
+                    oauth2_access_token=access_token,
+                    oauth2_refresh_token=self.refresh_token,
+                    oauth2_access_token_expiration=expiration,
+                    app_key=self.app_key,
+                    app_secret=self.app_secret,
+                    session=self.session,
+                    timeout=self.timeout,
+                )
+            return self._client
+
+    def stats(self):
+        """Tidsforbrug for tokenfornyelse og HTTP-kald siden sessionen blev oprettet"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['avg_request_seconds'] = stats['request_seconds'] / stats['requests'] if stats['requests'] else 0.0
+        return stats
+
+    def log_stats(self):
+        stats = self.stats()
+        logging.info(f"Dropbox session: {stats['requests']} kald, gns. {stats['avg_request_seconds'] * 1000:.0f} ms, "
+                     f"{stats['token_refreshes']} tokenfornyelser ({stats['token_refresh_seconds']:.2f} s), "
+                     f"{stats['token_cache_hits']} gange genbrugt token")
+        return stats
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,265 @@
+import os
+import json
+import time
+import hashlib
+import logging
+
+import requests
+from dropbox.files import CommitInfo, UploadSessionCursor, WriteMode
+from dropbox.exceptions import ApiError, InternalServerError, RateLimitError
+
+# Dropbox afviser enkelt-upload over 150 MB, og store filer bør aldrig læses helt ind i hukommelsen
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_RETRIES = 5
+RETRY_DELAY = 1.0
+
+TRANSIENT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    InternalServerError, RateLimitError)
+
+# Dropbox' content hash beregnes over blokke af denne størrelse
+DROPBOX_HASH_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+class SyncConflictError(Exception):
+    """Dropbox-kopien er ændret siden den lokale kopi sidst blev synkroniseret"""
+
+
+def _incorrect_offset(error):
+    """Returnerer det offset Dropbox har kvitteret for, hvis fejlen skyldes forkert offset"""
+    lookup_error = error
+    if hasattr(error, 'is_lookup_failed') and error.is_lookup_failed():
+        lookup_error = error.get_lookup_failed()
+    if hasattr(lookup_error, 'is_incorrect_offset') and lookup_error.is_incorrect_offset():
+        return lookup_error.get_incorrect_offset().correct_offset
+    return None
+
+
+def _load_resume_state(state_path, local_path, remote_path):
+    """Indlæser en tidligere afbrudt upload-session, hvis den passer til den samme uændrede fil"""
+    if not state_path or not os.path.exists(state_path):
+        return None
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        stat = os.stat(local_path)
+        if (state.get('local_path') == local_path and state.get('remote_path') == remote_path
+                and state.get('size') == stat.st_size and state.get('mtime_ns') == stat.st_mtime_ns):
+            return state
+    except (OSError, ValueError) as e:
+        logging.warning(f"Kunne ikke læse upload-tilstand: {e}")
+    return None
+
+
+def _save_resume_state(state_path, local_path, remote_path, session_id, offset):
+    if not state_path:
+        return
+    try:
+        stat = os.stat(local_path)
+        with open(state_path, 'w', encoding='utf-8') as f:
+            json.dump({'local_path': local_path, 'remote_path': remote_path, 'session_id': session_id,
+                       'offset': offset, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}, f)
+    except OSError as e:
+        logging.warning(f"Kunne ikke gemme upload-tilstand: {e}")
+
+
+def _clear_resume_state(state_path):
+    if state_path and os.path.exists(state_path):
+        try:
+            os.remove(state_path)
+        except OSError:
+            pass
+
+
+def upload_file_chunked(dbx_client, local_path, remote_path, mode=None, chunk_size=UPLOAD_CHUNK_SIZE,
+                        progress_callback=None, max_retries=MAX_RETRIES, retry_delay=RETRY_DELAY,
+                        resume_state_path=None):
+    """Uploader en fil til Dropbox i upload-sessioner med faste chunks streamet fra disken.
+
+    Efter en netværksfejl genoptages uploaden fra det sidst kvitterede offset i stedet for fra start.
+    Hvis resume_state_path angives, gemmes sessionen så en afbrudt upload også kan genoptages
+    efter genstart. dbx_client kan være en dropbox.Dropbox eller en lokal stand-in med de samme
+    files_upload_session_* metoder. Returnerer Dropbox' FileMetadata for den færdige fil.
+    """
+    mode = mode or WriteMode.overwrite
+    file_size = os.path.getsize(local_path)
+
+    def report(offset):
+        if progress_callback:
+            progress_callback(offset, file_size)
+
+    state = _load_resume_state(resume_state_path, local_path, remote_path)
+    session_id = state['session_id'] if state else None
+    offset = state['offset'] if state else 0
+    if state:
+        logging.info(f"Genoptager upload af {remote_path} fra byte {offset} af {file_size}")
+
+    retries = 0
+    with open(local_path, 'rb') as f:
+        while True:
+            try:
+                if session_id is None:
+                    f.seek(0)
+                    chunk = f.read(chunk_size)
+                    if len(chunk) == file_size:
+                        # Små filer klares i ét kald
+                        metadata = dbx_client.files_upload(chunk, remote_path, mode=mode)
+                        report(file_size)
+                        return metadata
+                    session_id = dbx_client.files_upload_session_start(chunk).session_id
+                    offset = len(chunk)
+                elif file_size - offset > chunk_size:
+                    f.seek(offset)
+                    chunk = f.read(chunk_size)
+                    dbx_client.files_upload_session_append_v2(chunk, UploadSessionCursor(session_id, offset))
+                    offset += len(chunk)
+                else:
+                    f.seek(offset)
+                    chunk = f.read(file_size - offset)
+                    metadata = dbx_client.files_upload_session_finish(
+                        chunk, UploadSessionCursor(session_id, offset), CommitInfo(path=remote_path, mode=mode)
+                    )
+                    _clear_resume_state(resume_state_path)
+                    report(file_size)
+                    return metadata
+
+                _save_resume_state(resume_state_path, local_path, remote_path, session_id, offset)
+                report(offset)
+                retries = 0
+                state = None
+            except ApiError as e:
+                correct_offset = _incorrect_offset(e.error)
+                if correct_offset is None and state:
+                    # Den gemte session er udløbet eller ukendt - start forfra
+                    logging.warning(f"Kunne ikke genoptage upload-session ({e}), starter forfra")
+                    state = None
+                    session_id = None
+                    offset = 0
+                    continue
+                if correct_offset is None or retries >= max_retries:
+                    _clear_resume_state(resume_state_path)
+                    raise
+                retries += 1
+                logging.warning(f"Dropbox har kvitteret til byte {correct_offset} (ikke {offset}), fortsætter derfra")
+                offset = correct_offset
+            except TRANSIENT_ERRORS as e:
+                if retries >= max_retries:
+                    raise
+                retries += 1
+                delay = retry_delay * 2 ** (retries - 1)
+                logging.warning(f"Netværksfejl under upload ved byte {offset}: {e}. "
+                                f"Forsøg {retries} af {max_retries} om {delay:.0f} sekunder")
+                time.sleep(delay)
+
+
+def dropbox_content_hash(path):
+    """Beregner Dropbox' content hash: SHA-256 af de sammenkædede SHA-256 for hver 4 MB blok"""
+    block_hashes = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(DROPBOX_HASH_BLOCK_SIZE), b''):
+            block_hashes.update(hashlib.sha256(block).digest())
+    return block_hashes.hexdigest()
+
+
+def _is_not_found(error):
+    if hasattr(error, 'is_path') and error.is_path():
+        path_error = error.get_path()
+        return hasattr(path_error, 'is_not_found') and path_error.is_not_found()
+    return False
+
+
+def _is_conflict(error):
+    """Genkender skrivekonflikter fra både files_upload og files_upload_session_finish"""
+    if hasattr(error, 'is_path') and error.is_path():
+        write_error = error.get_path()
+        write_error = getattr(write_error, 'reason', write_error)
+        return hasattr(write_error, 'is_conflict') and write_error.is_conflict()
+    return False
+
+
+def load_sync_state(state_path):
+    """Læser den sidst synkroniserede rev og content hash pr. Dropbox-sti"""
+    if not state_path or not os.path.exists(state_path):
+        return {}
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Kunne ikke læse synkroniseringstilstand: {e}")
+        return {}
+
+
+def save_sync_state(state_path, remote_path, metadata):
+    """Husker rev og content hash for den version der senest er uploadet eller hentet"""
+    if not state_path:
+        return
+    state = load_sync_state(state_path)
+    state[remote_path] = {'rev': metadata.rev, 'content_hash': metadata.content_hash}
+    temp_path = state_path + ".temp"
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2)
+        os.replace(temp_path, state_path)
+    except OSError as e:
+        logging.warning(f"Kunne ikke gemme synkroniseringstilstand: {e}")
+
+
+def upload_if_changed(backend, local_path, remote_path, state_path, **upload_options):
+    """Uploader kun hvis indholdet afviger fra kopien i lageret.
+
+    Uploaden kræver den rev den lokale kopi bygger på, så en forældet lokal kopi aldrig
+    overskriver en nyere version (SyncConflictError). backend er en StorageBackend. Returnerer
+    (uploaded, metadata), hvor uploaded er False når filerne allerede var identiske.
+    """
+    local_hash = dropbox_content_hash(local_path)
+    remote = backend.stat(remote_path)
+    if remote is not None and remote.content_hash == local_hash:
+        logging.info(f"{remote_path} er uændret (content hash {local_hash[:12]}), upload sprunget over")
+        save_sync_state(state_path, remote_path, remote)
+        return False, remote
+
+    base_rev = load_sync_state(state_path).get(remote_path, {}).get('rev')
+    if remote is None:
+        expected_rev = ''  # storage_backend.NEW_FILE: filen må ikke findes i forvejen
+    elif base_rev:
+        expected_rev = base_rev
+    else:
+        # Ingen kendt basisversion endnu (første synkronisering efter opdatering af programmet)
+        logging.warning(f"Ingen kendt rev for {remote_path}, overskriver kopien i lageret")
+        expected_rev = None
+
+    metadata = backend.upload_chunked(local_path, remote_path, expected_rev=expected_rev, **upload_options)
+    save_sync_state(state_path, remote_path, metadata)
+    return True, metadata
+
+
+def download_file_streaming(backend, remote_path, local_path, chunk_size=DOWNLOAD_CHUNK_SIZE,
+                            progress_callback=None):
+    """Streamer en fil fra lageret til disken i chunks uden at holde hele filen i hukommelsen.
+
+    Den hentede fil kontrolleres mod lagerets content hash. Ved fejl slettes den ufuldstændige fil.
+    Returnerer metadata for den hentede version.
+    """
+    metadata, chunks = backend.get_stream(remote_path, chunk_size)
+    total = metadata.size
+    received = 0
+    try:
+        with open(local_path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                received += len(chunk)
+                if progress_callback:
+                    progress_callback(received, total)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        if os.path.exists(local_path):
+            os.remove(local_path)
+        raise
+    finally:
+        chunks.close()
+
+    if metadata.content_hash and dropbox_content_hash(local_path) != metadata.content_hash:
+        os.remove(local_path)
+        raise IOError(f"Den hentede fil {remote_path} er ufuldstændig eller beskadiget (content hash passer ikke)")
+    return metadata
@@ -0,0 +1,329 @@
+import ssl
+import time
+import queue
+import smtplib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from email import policy
+
+from jinja2 import Environment
+
+HTML_TEMPLATE = """<html>
+<head>
+    <style>
+        body { font-family: Arial, sans-serif; color: #333333; }
+        .container { width: 80%; margin: 0 auto; padding: 20px; background-color: #f9f9f9;
+                     border: 1px solid #ddd; border-radius: 10px; }
+        h1 { color: #4A90E2; }
+        table { width: 100%; border-collapse: collapse; margin-top: 20px; table-layout: fixed; }
+        th, td { padding: 10px; border-bottom: 1px solid #ddd; text-align: left; overflow: hidden;
+                 text-overflow: ellipsis; white-space: nowrap; }
+        th { background-color: #4A90E2; color: #ffffff; }
+        .product-name { width: 35%; }
+        .date { width: 15%; }
+        .ean { width: 20%; }
+        .qty { width: 15%; }
+        .source { width: 15%; }
+        tr:hover { background-color: #f5f5f5; }
+        .warning { color: #ff6b6b; font-weight: bold; }
+        @media screen and (max-width: 768px) {
+            .container { width: 95%; padding: 10px; }
+            th, td { padding: 5px; font-size: 14px; }
+        }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>Dagens Rapport: Udløbende Produkter{% if store_name %} - {{ store_name }}{% endif %}</h1>
+{% macro product_table(rows, empty_text, highlight) %}
+        <table>
+            <tr>
+                <th class="product-name">Article Description</th>
+                <th class="date">Expiry Date</th>
+                <th class="ean">EAN Serial No</th>
+                <th class="qty">Ship QTY</th>
+                <th class="source">PDF Source</th>
+            </tr>
+{% for row in rows %}
+            <tr{% if highlight %} style="color: red; font-weight: bold;"{% endif %}>
+                <td class="product-name">{{ row.description }}</td>
+                <td class="date">{{ row.expiry_date }}</td>
+                <td class="ean">{{ row.ean }}</td>
+                <td class="qty">{{ row.qty }}</td>
+                <td class="source">{{ row.source }}</td>
+            </tr>
+{% else %}
+            <tr><td colspan="5">{{ empty_text }}</td></tr>
+{% endfor %}
+        </table>
+{% endmacro %}
+        <h2>Produkter Udløbende I Dag:</h2>
+{{ product_table(today_rows, "Ingen produkter udløber i dag.", true) }}
+        <h2>Produkter Udløbende Indenfor {{ days }} Dage</h2>
+        <p>Her er en liste over produkter, der udløber inden for de næste {{ days }} dage:</p>
+{{ product_table(later_rows, "Ingen produkter udløber indenfor de næste " ~ days ~ " dage.", false) }}
+        <p style="margin-top: 20px; font-size: 12px; color: #666;">
+            Denne rapport er automatisk genereret. Ved spørgsmål kontakt venligst IT-support.
+        </p>
+    </div>
+</body>
+</html>
+"""
+
+TEXT_TEMPLATE = """Dagens Rapport: Udløbende Produkter{% if store_name %} - {{ store_name }}{% endif %}
+
+Produkter udløbende i dag:
+{% for row in today_rows %}
+- {{ row.description }} | {{ row.expiry_date }} | EAN {{ row.ean }} | Antal {{ row.qty }} | {{ row.source }}
+{% else %}
+Ingen produkter udløber i dag.
+{% endfor %}
+
+Produkter udløbende indenfor {{ days }} dage:
+{% for row in later_rows %}
+- {{ row.description }} | {{ row.expiry_date }} | EAN {{ row.ean }} | Antal {{ row.qty }} | {{ row.source }}
+{% else %}
+Ingen produkter udløber indenfor de næste {{ days }} dage.
+{% endfor %}
+
+Denne rapport er automatisk genereret. Ved spørgsmål kontakt venligst IT-support.
+"""
+
+SUMMARY_HTML_TEMPLATE = """<html>
+<head>
+    <style>
+        body { font-family: Arial, sans-serif; color: #333333; }
+        .container { width: 80%; margin: 0 auto; padding: 20px; background-color: #f9f9f9;
+                     border: 1px solid #ddd; border-radius: 10px; }
+        h1 { color: #4A90E2; }
+        table { width: 100%; border-collapse: collapse; margin-top: 20px; }
+        th, td { padding: 10px; border-bottom: 1px solid #ddd; text-align: left; }
+        th { background-color: #4A90E2; color: #ffffff; }
+        .warning { color: #ff6b6b; font-weight: bold; }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>Samlet Oversigt: Udløbende Produkter</h1>
+        <p>{{ total_today }} produkter udløber i dag og {{ total_later }} inden for de næste {{ days }} dage
+           i {{ stores|length }} butikker.</p>
+        <table>
+            <tr>
+                <th>Butik</th>
+                <th>Udløber i dag</th>
+                <th>Indenfor {{ days }} dage</th>
+                <th>Status</th>
+            </tr>
+{% for store in stores %}
+            <tr>
+                <td>{{ store.name }}</td>
+                <td{% if store.today %} class="warning"{% endif %}>{{ store.today }}</td>
+                <td>{{ store.later }}</td>
+                <td{% if store.error %} class="warning"{% endif %}>{{ store.status }}</td>
+            </tr>
+{% endfor %}
+        </table>
+        <p style="margin-top: 20px; font-size: 12px; color: #666;">
+            Denne rapport er automatisk genereret. Ved spørgsmål kontakt venligst IT-support.
+        </p>
+    </div>
+</body>
+</html>
+"""
+
+SUMMARY_TEXT_TEMPLATE = """Samlet Oversigt: Udløbende Produkter
+
+{{ total_today }} produkter udløber i dag og {{ total_later }} inden for de næste {{ days }} dage i {{ stores|length }} butikker.
+
+{% for store in stores %}
+- {{ store.name }}: {{ store.today }} i dag, {{ store.later }} indenfor {{ days }} dage | {{ store.status }}
+{% endfor %}
+
+Denne rapport er automatisk genereret. Ved spørgsmål kontakt venligst IT-support.
+"""
+
+# Skabelonerne kompileres én gang når modulet importeres og genbruges for hver rapport
+_html_environment = Environment(autoescape=True, trim_blocks=True, lstrip_blocks=True)
+_text_environment = Environment(autoescape=False, trim_blocks=True, lstrip_blocks=True)
+_html_template = _html_environment.from_string(HTML_TEMPLATE)
+_text_template = _text_environment.from_string(TEXT_TEMPLATE)
+_summary_html_template = _html_environment.from_string(SUMMARY_HTML_TEMPLATE)
+_summary_text_template = _text_environment.from_string(SUMMARY_TEXT_TEMPLATE)
+
+
+def _report_rows(products):
+    for product in products:
+        yield {
+            'description': product[0] or "Ingen beskrivelse",
+            'expiry_date': product[1] or "Ingen dato",
+            'ean': product[2] or "Ingen",
+            'qty': product[3] or "Ingen",
+            'source': product[4] or "Ingen",
+        }
+
+
+def render_report(products, today_date, days=14, store_name=None):
+    """Renderer rapporten som (html, tekst). products er rækker som fra fetch_expiring_products,
+    today_date er dagens dato som dd.mm.åååå. store_name tilføjes overskriften når der er flere butikker"""
+    rows = list(_report_rows(products))
+    context = {
+        'today_rows': [row for row in rows if row['expiry_date'] == today_date],
+        'later_rows': [row for row in rows if row['expiry_date'] != today_date],
+        'days': days,
+        'store_name': store_name,
+    }
+    return _html_template.render(context), _text_template.render(context)
+
+
+def render_summary(results, today_date, days=14):
+    """Renderer den samlede oversigt over alle butikker som (html, tekst).
+
+    results er resultaterne fra rapportens run_report: en dict pr. butik med 'store', 'products' og 'error'.
+    """
+    stores = []
+    for result in results:
+        products = result['products'] or []
+        today = sum(1 for product in products if product[1] == today_date)
+        if result['error']:
+            status = f"Fejl: {result['error']}"
+        else:
+            status = f"OK ({result['bytes']} bytes, {result['fetch_seconds'] + result['query_seconds']:.2f} s)"
+        stores.append({
+            'name': result['store']['name'] or "products.db",
+            'today': today,
+            'later': len(products) - today,
+            'error': bool(result['error']),
+            'status': status,
+        })
+    context = {
+        'stores': stores,
+        'total_today': sum(store['today'] for store in stores),
+        'total_later': sum(store['later'] for store in stores),
+        'days': days,
+    }
+    return _summary_html_template.render(context), _summary_text_template.render(context)
+
+
+def build_message(sender, subject, html, text):
+    """Bygger MIME-beskeden én gang med tekst- og HTML-version. To-headeren tilføjes pr. modtager ved afsendelse"""
+    msg = MIMEMultipart("alternative", policy=policy.SMTP)
+    msg['From'] = sender
+    msg['Subject'] = subject
+    msg.attach(MIMEText(text, "plain", "utf-8"))
+    msg.attach(MIMEText(html, "html", "utf-8"))
+    return msg.as_bytes(policy=policy.SMTP)
+
+
+def _is_transient(error):
+    """4xx-svar og afbrudte forbindelser kan forsøges igen; 5xx-svar er permanente"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    # SMTPServerDisconnected, SMTPConnectError og socket-fejl er alle OSError
+    return isinstance(error, OSError)
+
+
+class SMTPConnectionPool:
+    """Sender en færdigbygget besked til mange modtagere over genbrugte SMTP-forbindelser.
+
+    Hver modtager får sin egen envelope, så ingen ser de andre modtagere. Op til size forbindelser
+    bruges parallelt, og hver forbindelse genbruges til max_messages_per_connection beskeder før den
+    lukkes. Forbigående fejl forsøges igen på en ny forbindelse med stigende ventetid.
+    """
+
+    def __init__(self, host, port, username=None, password=None, starttls=True, size=1, timeout=30,
+                 max_messages_per_connection=100, max_retries=3, retry_delay=1.0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.size = size
+        self.timeout = timeout
+        self.max_messages_per_connection = max_messages_per_connection
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._stats = {'connections': 0, 'sent': 0, 'retries': 0}
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            smtp.starttls(context=ssl.create_default_context())
+        if self.username:
+            smtp.login(self.username, self.password)
+        with self._lock:
+            self._stats['connections'] += 1
+        return [smtp, 0]
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _release(self, connection):
+        if connection[1] >= self.max_messages_per_connection:
+            self._discard(connection)
+        else:
+            self._idle.put(connection)
+
+    @staticmethod
+    def _discard(connection):
+        try:
+            connection[0].quit()
+        except (smtplib.SMTPException, OSError):
+            connection[0].close()
+
+    def send_one(self, sender, recipient, message):
+        """Sender til én modtager. Returnerer None ved succes, ellers fejlen"""
+        envelope = f"To: {recipient}\r\n".encode('utf-8') + message
+        for attempt in range(self.max_retries + 1):
+            connection = None
+            try:
+                connection = self._acquire()
+                connection[0].sendmail(sender, [recipient], envelope)
+                connection[1] += 1
+                self._release(connection)
+                with self._lock:
+                    self._stats['sent'] += 1
+                return None
+            except (smtplib.SMTPException, OSError) as e:
+                if connection is not None:
+                    self._discard(connection)
+                if not _is_transient(e) or attempt == self.max_retries:
+                    return e
+                with self._lock:
+                    self._stats['retries'] += 1
+                time.sleep(self.retry_delay * (2 ** attempt))
+
+    def send(self, sender, recipients, message):
+        """Sender beskeden til alle modtagere. Returnerer statistik med fejlede modtagere"""
+        recipients = list(dict.fromkeys(r for r in recipients if r))
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            errors = list(executor.map(lambda r: self.send_one(sender, r, message), recipients))
+        elapsed = time.perf_counter() - start_time
+        with self._lock:
+            stats = dict(self._stats)
+        stats['failed'] = {recipient: str(error) for recipient, error in zip(recipients, errors) if error is not None}
+        stats['seconds'] = elapsed
+        stats['per_second'] = len(recipients) / elapsed if elapsed else 0.0
+        return stats
+
+    def close(self):
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
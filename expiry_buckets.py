@@ -0,0 +1,175 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+
+# Udløbsdatoer gemmes som dd.mm.åååå. Omskrevet til ISO kan de sammenlignes og sorteres som tekst.
+# Udtrykket skal stå præcis sådan i forespørgslerne, for at SQLite bruger indekset nedenfor
+ISO_EXPIRY_DATE = ("substr(\"Expiry Date\", 7, 4) || '-' || substr(\"Expiry Date\", 4, 2) || '-' || "
+                   "substr(\"Expiry Date\", 1, 2)")
+
+# Sand for en gyldig dato. '+0 days' får SQLite til at normalisere datoen, så fx 31.02 ikke er lig sig selv
+VALID_ISO_DATE = "date({0}, '+0 days') IS {0}"
+
+EXPIRY_INDEX_SQL = f'CREATE INDEX IF NOT EXISTS idx_products_expiry_iso ON products ({ISO_EXPIRY_DATE})'
+
+DEFAULT_HORIZONS = (7, 14, 30)
+
+INVALID = 'invalid'
+EXPIRED = 'expired'
+TODAY = 'today'
+
+
+def horizon_bucket(days):
+    return f"within_{days}"
+
+
+def install_expiry_index(conn):
+    """Opretter udtryksindekset på udløbsdatoen i ISO-form"""
+    conn.execute(EXPIRY_INDEX_SQL)
+    conn.commit()
+
+
+def _bucket_case(horizons):
+    whens = [f"WHEN NOT ({VALID_ISO_DATE.format('iso')}) THEN '{INVALID}'",
+             f"WHEN iso < :today THEN '{EXPIRED}'",
+             f"WHEN iso = :today THEN '{TODAY}'"]
+    whens += [f"WHEN iso <= :d{days} THEN '{horizon_bucket(days)}'" for days in horizons]
+    return "CASE " + " ".join(whens) + " END"
+
+
+def _parameters(today, horizons):
+    params = {'today': today.strftime('%Y-%m-%d')}
+    for days in horizons:
+        params[f"d{days}"] = (today + timedelta(days=days)).strftime('%Y-%m-%d')
+    return params
+
+
+def bucket_query(horizons=DEFAULT_HORIZONS):
+    """Én forespørgsel der giver (UniqueID, spand) for alle rækker med udløb inden for den
+    længste horisont og alle rækker med ugyldig eller manglende dato.
+
+    Alle dele er søgninger i udtryksindekset, så gyldige rækker der udløber senere aldrig læses.
+    """
+    return f'''
+        SELECT UniqueID, {_bucket_case(horizons)} AS bucket
+        FROM (SELECT *, {ISO_EXPIRY_DATE} AS iso FROM products WHERE {ISO_EXPIRY_DATE} <= :d{max(horizons)})
+        UNION ALL
+        SELECT UniqueID, '{INVALID}'
+        FROM products
+        WHERE {ISO_EXPIRY_DATE} > :d{max(horizons)} AND NOT ({VALID_ISO_DATE.format(ISO_EXPIRY_DATE)})
+        UNION ALL
+        SELECT UniqueID, '{INVALID}'
+        FROM products
+        WHERE {ISO_EXPIRY_DATE} IS NULL
+    '''
+
+
+def expiring_rows(conn, columns, days, today=None):
+    """Rækker med udløb fra i dag til og med days dage frem, sorteret efter udløbsdato.
+
+    Samme indekserede udtryk som spandene, så rapporten og GUI'en altid er enige om perioden.
+    """
+    today = today or datetime.now().date()
+    column_names = ', '.join(f'"{col}"' for col in columns)
+    return conn.execute(f'''
+        SELECT {column_names}, {ISO_EXPIRY_DATE} AS iso_date
+        FROM products
+        WHERE {ISO_EXPIRY_DATE} BETWEEN ? AND ? AND {VALID_ISO_DATE.format(ISO_EXPIRY_DATE)}
+        ORDER BY iso_date, UniqueID
+    ''', (today.strftime('%Y-%m-%d'), (today + timedelta(days=days)).strftime('%Y-%m-%d'))).fetchall()
+
+
+class ExpiryBuckets:
+    """Inddeler produkterne i udløbsspande: ugyldig dato, udløbet, i dag og inden for hver horisont.
+
+    Spandene er eksklusive, så et produkt der udløber om 3 dage ligger i within_7 og ikke også i
+    within_14. Resultatet caches og genberegnes kun når databasen er ændret, når datoen skifter,
+    eller når filen er udskiftet (download eller gendannelse). Ændringer opdages med PRAGMA
+    data_version på en fast læseforbindelse, så kontrollen koster ét kald og ingen tabellæsning.
+    """
+
+    def __init__(self, db_path, horizons=DEFAULT_HORIZONS):
+        self.db_path = db_path
+        self.horizons = tuple(sorted(horizons))
+        self._query = bucket_query(self.horizons)
+        self._conn = None
+        self._file_id = None
+        self._cache_key = None
+        self._result = None
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'last_query_seconds': 0.0}
+
+    @property
+    def bucket_names(self):
+        return [INVALID, EXPIRED, TODAY] + [horizon_bucket(days) for days in self.horizons]
+
+    def _connect(self):
+        stat = os.stat(self.db_path)
+        file_id = (stat.st_dev, stat.st_ino)
+        if self._conn is not None and self._file_id == file_id:
+            return self._conn
+        self._close()
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        try:
+            install_expiry_index(conn)
+        except sqlite3.OperationalError as e:
+            # Uden indekset virker spandene stadig, de læser bare hele tabellen
+            logging.warning(f"Udløbsindeks kunne ikke oprettes: {e}")
+        self._conn = conn
+        self._file_id = file_id
+        return conn
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = None
+        self._file_id = None
+        self._cache_key = None
+
+    def close(self):
+        """Lukker læseforbindelsen. Skal kaldes før databasefilen udskiftes på Windows"""
+        with self._lock:
+            self._close()
+
+    def compute(self, today=None):
+        """Returnerer spandene som {'today', 'bucket_of': {UniqueID: spand}, 'ids': {spand: [UniqueID]},
+        'counts': {spand: antal}}. Rækker der udløber efter den længste horisont er ikke med"""
+        today = today or datetime.now().date()
+        with self._lock:
+            conn = self._connect()
+            data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+            cache_key = (self._file_id, data_version, today)
+            if cache_key == self._cache_key:
+                self._stats['hits'] += 1
+                return self._result
+
+            start_time = time.perf_counter()
+            ids = {name: [] for name in self.bucket_names}
+            bucket_of = {}
+            for row_id, bucket in conn.execute(self._query, _parameters(today, self.horizons)):
+                ids[bucket].append(row_id)
+                bucket_of[row_id] = bucket
+            self._result = {
+                'today': today.strftime('%Y-%m-%d'),
+                'bucket_of': bucket_of,
+                'ids': ids,
+                'counts': {name: len(bucket_ids) for name, bucket_ids in ids.items()},
+            }
+            self._cache_key = cache_key
+            self._stats['misses'] += 1
+            self._stats['last_query_seconds'] = time.perf_counter() - start_time
+            logging.info(f"Udløbsspande beregnet på {self._stats['last_query_seconds'] * 1000:.1f} ms: "
+                         f"{self._result['counts']}")
+            return self._result
+
+    def within(self, days, today=None):
+        """Antal produkter der udløber fra i dag til og med days dage frem"""
+        counts = self.compute(today)['counts']
+        return counts[TODAY] + sum(counts[horizon_bucket(h)] for h in self.horizons if h <= days)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,101 @@
+import io
+import os
+import gzip
+import json
+import time
+import sqlite3
+import logging
+from datetime import datetime, timedelta
+
+from dropbox_transfer import dropbox_content_hash
+from expiry_buckets import expiring_rows as select_expiring_rows
+
+EXPIRY_SNAPSHOT_VERSION = 1
+
+# Samme kolonner og rækkefølge som rapportens fetch_expiring_products
+EXPIRY_COLUMNS = ["Article Description Batch", "Expiry Date", "EAN Serial No", "Ship QTY", "PDF Source"]
+
+
+def build_expiry_snapshot(db_path, horizon_days, database_hash=None, today=None):
+    """Bygger et lille gzip-komprimeret JSON-dokument med produkter der udløber inden for horizon_days.
+
+    database_hash er content hash for det database-snapshot dokumentet er bygget sammen med, så
+    læseren kan se om det stadig passer til databasen. Dokumentet er deterministisk for samme data
+    og dato, så et uændret snapshot aldrig uploades igen.
+    """
+    today = today or datetime.now().date()
+    from_date = today.strftime('%Y-%m-%d')
+    to_date = (today + timedelta(days=horizon_days)).strftime('%Y-%m-%d')
+
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = select_expiring_rows(conn, EXPIRY_COLUMNS, horizon_days, today)
+    finally:
+        conn.close()
+
+    document = {
+        'version': EXPIRY_SNAPSHOT_VERSION,
+        'database_hash': database_hash,
+        'from_date': from_date,
+        'to_date': to_date,
+        'horizon_days': horizon_days,
+        'columns': EXPIRY_COLUMNS + ['iso_date'],
+        'rows': [list(row) for row in rows],
+    }
+    payload = json.dumps(document, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=9, mtime=0) as gz:
+        gz.write(payload)
+    return buffer.getvalue(), len(rows)
+
+
+def publish_expiry_snapshot(storage, db_path, remote_path, local_path, horizon_days, database_hash=None):
+    """Bygger udløbs-snapshottet og uploader det hvis det afviger fra kopien i lageret.
+
+    Snapshottet er afledt af databasen, så det overskrives altid (last writer wins). Returnerer True ved upload.
+    """
+    start_time = time.perf_counter()
+    data, row_count = build_expiry_snapshot(db_path, horizon_days, database_hash)
+    temp_path = local_path + ".new"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, local_path)
+
+    remote = storage.stat(remote_path)
+    if remote is not None and remote.content_hash == dropbox_content_hash(local_path):
+        logging.info(f"Udløbs-snapshot {remote_path} er uændret, upload sprunget over")
+        return False
+    storage.put(data, remote_path)
+    logging.info(f"Udløbs-snapshot {remote_path} uploadet: {row_count} produkter, {len(data)} bytes "
+                 f"på {time.perf_counter() - start_time:.2f} sekunder")
+    return True
+
+
+def load_expiry_snapshot(storage, remote_path):
+    """Henter og validerer udløbs-snapshottet. Returnerer (dokument, bytes hentet) eller (None, 0)"""
+    if storage.stat(remote_path) is None:
+        return None, 0
+    data = storage.get(remote_path)
+    try:
+        document = json.loads(gzip.decompress(data).decode('utf-8'))
+    except (OSError, ValueError) as e:
+        logging.warning(f"Udløbs-snapshot {remote_path} kunne ikke læses: {e}")
+        return None, len(data)
+    if document.get('version') != EXPIRY_SNAPSHOT_VERSION:
+        logging.warning(f"Udløbs-snapshot {remote_path} har ukendt version {document.get('version')}")
+        return None, len(data)
+    return document, len(data)
+
+
+def expiring_rows(document, from_date, to_date, database_hash):
+    """Rækker fra snapshottet med udløb mellem from_date og to_date (ISO-datoer).
+
+    Returnerer None hvis snapshottet ikke dækker hele perioden eller er bygget af en anden version af
+    databasen end database_hash - så skal databasen bruges i stedet.
+    """
+    if not database_hash or document.get('database_hash') != database_hash:
+        return None
+    if document['from_date'] > from_date or document['to_date'] < to_date:
+        return None
+    iso_index = document['columns'].index('iso_date')
+    return [tuple(row[:iso_index]) for row in document['rows'] if from_date <= row[iso_index] <= to_date]
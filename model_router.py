@@ -0,0 +1,164 @@
+import os
+import re
+import json
+import logging
+import threading
+from collections import namedtuple
+
+import config
+
+DATE_PATTERN = re.compile(r'\b\d{2}\.\d{2}\.\d{4}\b')
+SKU_PATTERN = re.compile(r'(?<!\d)\d{5}(?!\d)')
+
+RoutingDecision = namedtuple('RoutingDecision', ['model', 'layout_key', 'reasons', 'signals'])
+
+
+def layout_fingerprint(text_content):
+    """Laver en grov nøgle for leverandørens layout ud fra sidens første tekstlinje"""
+    for line in text_content.splitlines():
+        if re.search(r'[A-Za-zÆØÅæøå]{3,}', line):
+            key = re.sub(r'[\d\W_]+', ' ', line.lower()).strip()
+            return re.sub(r'\s+', ' ', key)[:40] or 'ukendt'
+    return 'ukendt'
+
+
+def text_signals(text_content):
+    """Beregner billige signaler for en tekstside uden at kalde AI'en"""
+    lines = [line for line in text_content.splitlines() if line.strip()]
+    date_lines = [line for line in lines if DATE_PATTERN.search(line)]
+    parsed_lines = [line for line in date_lines if SKU_PATTERN.search(line)]
+    return {
+        'chars': len(''.join(text_content.split())),
+        'lines': len(lines),
+        'date_lines': len(date_lines),
+        # Andelen af linjer med udløbsdato som en simpel regelparser også kan finde SKU i
+        'rule_confidence': len(parsed_lines) / len(date_lines) if date_lines else 1.0,
+    }
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    """Estimerer prisen i USD for et kald ud fra config.AI_MODEL_PRICES (pris pr. 1M tokens)"""
+    input_price, output_price = config.AI_MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+class ModelRouter:
+    """Vælger model pr. side eller billede og eskalerer svære sider til den stærkere model"""
+
+    def __init__(self, stats_path, fast_model=config.AI_TEXT_MODEL, strong_model=config.AI_STRONG_MODEL,
+                 max_fast_chars=6000, min_rule_confidence=0.5, max_layout_failure_rate=0.25,
+                 max_fast_image_pixels=2_000_000, max_fast_image_bytes=1_500_000,
+                 escalate_rejection_rate=0.3, min_layout_samples=5):
+        self.stats_path = stats_path
+        self.fast_model = fast_model
+        self.strong_model = strong_model
+        self.max_fast_chars = max_fast_chars
+        self.min_rule_confidence = min_rule_confidence
+        self.max_layout_failure_rate = max_layout_failure_rate
+        self.max_fast_image_pixels = max_fast_image_pixels
+        self.max_fast_image_bytes = max_fast_image_bytes
+        self.escalate_rejection_rate = escalate_rejection_rate
+        self.min_layout_samples = min_layout_samples
+        self._lock = threading.Lock()
+        self.layout_stats = self._load_stats()
+
+    def _load_stats(self):
+        if not os.path.exists(self.stats_path):
+            return {}
+        try:
+            with open(self.stats_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Kunne ikke indlæse routing-statistik: {e}")
+            return {}
+
+    def _save_stats(self):
+        try:
+            temp_path = self.stats_path + ".temp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.layout_stats, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.stats_path)
+        except OSError as e:
+            logging.warning(f"Kunne ikke gemme routing-statistik: {e}")
+
+    def layout_failure_rate(self, layout_key):
+        """Andel af afviste produkter for et layout, eller None hvis der er for få målinger"""
+        with self._lock:
+            stats = self.layout_stats.get(layout_key)
+        if not stats or stats.get('total', 0) < self.min_layout_samples:
+            return None
+        return stats['rejected'] / stats['total']
+
+    def route_text(self, text_content, layout_key=None):
+        """Vælger model for en tekstside"""
+        layout_key = layout_key or layout_fingerprint(text_content)
+        signals = text_signals(text_content)
+        signals['layout_failure_rate'] = self.layout_failure_rate(layout_key)
+
+        reasons = []
+        if signals['chars'] > self.max_fast_chars:
+            reasons.append(f"tæt side ({signals['chars']} tegn)")
+        if signals['rule_confidence'] < self.min_rule_confidence:
+            reasons.append(f"lav regelparser-sikkerhed ({signals['rule_confidence']:.2f})")
+        if signals['layout_failure_rate'] is not None and signals['layout_failure_rate'] > self.max_layout_failure_rate:
+            reasons.append(f"layout fejlrate {signals['layout_failure_rate']:.0%}")
+
+        model = self.strong_model if reasons else self.fast_model
+        return RoutingDecision(model, layout_key, reasons, signals)
+
+    def route_image(self, file_size, pixel_count, layout_key='billede'):
+        """Vælger model for et billede ud fra filstørrelse og opløsning"""
+        signals = {
+            'bytes': file_size,
+            'pixels': pixel_count,
+            'layout_failure_rate': self.layout_failure_rate(layout_key),
+        }
+
+        reasons = []
+        if pixel_count is None or pixel_count > self.max_fast_image_pixels:
+            reasons.append(f"stort billede ({pixel_count} pixels)")
+        if file_size > self.max_fast_image_bytes:
+            reasons.append(f"stor fil ({file_size / (1024 * 1024):.1f} MB)")
+        if signals['layout_failure_rate'] is not None and signals['layout_failure_rate'] > self.max_layout_failure_rate:
+            reasons.append(f"layout fejlrate {signals['layout_failure_rate']:.0%}")
+
+        model = self.strong_model if reasons else self.fast_model
+        return RoutingDecision(model, layout_key, reasons, signals)
+
+    def should_escalate(self, decision, stats):
+        """Afgør om en side behandlet af den hurtige model skal køres igen med den stærke model.
+
+        rejected_count er antallet der stadig er afvist efter en eventuel reparation. Har reparationen
+        allerede kørt på den stærke model, eskaleres der ikke, da en ny kørsel af hele siden på samme
+        model koster det dobbelte og smider de reparerede rækker væk.
+        """
+        if decision.model == self.strong_model or stats.get('repair_model') == self.strong_model:
+            return False
+        raw_count = stats.get('raw_count', 0)
+        if raw_count == 0:
+            # Regelparseren ser datolinjer, men modellen fandt intet
+            return decision.signals.get('date_lines', 0) > 0
+        return stats.get('rejected_count', 0) / raw_count > self.escalate_rejection_rate
+
+    def record_outcome(self, decision, stats, escalated=False):
+        """Registrerer resultatet af et kald, opdaterer layout-statistik og logger latenstid og pris"""
+        raw_count = stats.get('raw_count', 0)
+        rejected_count = stats.get('rejected_count', 0)
+        with self._lock:
+            layout = self.layout_stats.setdefault(decision.layout_key, {'total': 0, 'rejected': 0, 'calls': 0})
+            layout['total'] += raw_count
+            # Layoutets fejlrate måler modellens første forsøg, ikke hvad reparationen reddede
+            layout['rejected'] += stats.get('initial_rejected_count', rejected_count)
+            layout['calls'] += 1
+            self._save_stats()
+
+        cost = estimate_cost(stats.get('model', decision.model), stats.get('prompt_tokens', 0),
+                             stats.get('completion_tokens', 0))
+        logging.info(
+            f"Routing: model={stats.get('model', decision.model)} layout='{decision.layout_key}' "
+            f"årsager={decision.reasons or ['let side']} eskaleret={escalated} "
+            f"latenstid={stats.get('latency', 0.0):.2f}s tokens={stats.get('prompt_tokens', 0)}+"
+            f"{stats.get('completion_tokens', 0)} pris=${cost:.5f} "
+            f"afviste={rejected_count}/{raw_count}"
+        )
+        return cost
@@ -0,0 +1,140 @@
+import os
+import re
+import json
+import logging
+from collections import namedtuple
+
+DATE_PATTERN = re.compile(r'(?<!\d)\d{2}\.\d{2}\.\d{4}(?!\d)')
+SKU_PATTERN = re.compile(r'(?<!\d)\d{5}(?!\d)')
+EAN_PATTERN = re.compile(r'(?<!\d)\d{13}(?!\d)')
+WEIGHT_PATTERN = re.compile(r'\d+\s?(?:x\s?\d+\s?)?(?:g|gr|kg|ml|cl|l)\b', re.IGNORECASE)
+
+# Lille keyword-model: positive vægte trækker mod varer med udløbsdato, negative mod udstyr og vilkår
+KEYWORD_WEIGHTS = {
+    'chokolade': 2, 'slik': 2, 'vingummi': 2, 'lakrids': 2, 'chips': 2, 'popcorn': 2, 'nødder': 2,
+    'mælk': 2, 'sodavand': 2, 'cola': 2, 'juice': 2, 'kiks': 2, 'single': 1,
+    'candy': 2, 'chocolate': 2, 'snack': 2, 'drink': 1, 'ritter': 2, 'twix': 2, 'haribo': 2,
+    'marabou': 2, 'mars': 2, 'snickers': 2, 'maltesers': 2, 'toms': 2, 'pepsi': 2, 'fanta': 2,
+    'bæger': -3, 'bægre': -3, 'kop': -2, 'krus': -2, 'låg': -3, 'sugerør': -3, 'handske': -3,
+    'handsker': -3, 'serviet': -3, 'servietter': -3, 'pose': -2, 'poser': -2, 'emballage': -2,
+    'cups': -3, 'cup': -2, 'lids': -3, 'lid': -2, 'gloves': -3, 'straws': -3, 'napkins': -3,
+    'bags': -2, 'spand': -2, 'bakke': -2, 'bakker': -2,
+    'betingelser': -3, 'vilkår': -3, 'salgsbetingelser': -3, 'leveringsbetingelser': -3,
+    'terms': -3, 'conditions': -3, 'ansvar': -1, 'reklamation': -2,
+}
+
+# Længste keywords først, så 'handsker' matches før 'handske' i sammensatte ord
+COMPOUND_KEYWORDS = sorted((keyword for keyword in KEYWORD_WEIGHTS if len(keyword) >= 4), key=len, reverse=True)
+
+PageRelevance = namedtuple('PageRelevance', ['relevant', 'reason', 'signals'])
+
+
+def word_weight(word):
+    """Vægt for et ord. Sammensatte ord som 'plastbæger' får vægten fra deres sidste led"""
+    if word in KEYWORD_WEIGHTS:
+        return KEYWORD_WEIGHTS[word]
+    for keyword in COMPOUND_KEYWORDS:
+        if word.endswith(keyword):
+            return KEYWORD_WEIGHTS[keyword]
+    return 0
+
+
+def keyword_score(text):
+    """Summen af keyword-vægte for teksten. Vægtangivelser som '32x50g' tæller som fødevare"""
+    words = re.findall(r'[a-zæøå]+', text.lower())
+    score = sum(word_weight(word) for word in words)
+    return score + 2 * len(WEIGHT_PATTERN.findall(text))
+
+
+def classify_page(text_content):
+    """Afgør lokalt om en side kan indeholde produkter med udløbsdato.
+
+    Klassifikationen er bevidst forsigtig: ved tvivl sendes siden til AI'en, da en overset side
+    koster tabte produkter, mens en unødvendig side kun koster et AI-kald.
+    """
+    lines = [line for line in text_content.splitlines() if line.strip()]
+    dates = DATE_PATTERN.findall(text_content)
+    skus = SKU_PATTERN.findall(text_content)
+    eans = EAN_PATTERN.findall(text_content)
+
+    product_lines = 0
+    equipment_lines = 0
+    for line in lines:
+        if DATE_PATTERN.search(line) and (SKU_PATTERN.search(line) or EAN_PATTERN.search(line)):
+            product_lines += 1
+            if keyword_score(line) < 0:
+                equipment_lines += 1
+
+    signals = {
+        'dates': len(dates),
+        'skus': len(skus),
+        'eans': len(eans),
+        'product_lines': product_lines,
+        'equipment_lines': equipment_lines,
+        'keyword_score': keyword_score(text_content),
+    }
+
+    if not text_content.strip():
+        return PageRelevance(False, "ingen tekst på siden", signals)
+    if not dates:
+        return PageRelevance(False, "ingen datoer i formatet DD.MM.YYYY", signals)
+    if product_lines:
+        if equipment_lines == product_lines:
+            return PageRelevance(False, f"alle {product_lines} produktlinjer ligner udstyr", signals)
+        return PageRelevance(True, f"{product_lines - equipment_lines} produktlinjer med dato", signals)
+    # PDF-teksten kan være brudt op så dato og SKU havner på forskellige linjer
+    if (skus or eans) and len(dates) >= 2 and signals['keyword_score'] >= 0:
+        return PageRelevance(True, "datoer og varenumre uden samlede produktlinjer", signals)
+    return PageRelevance(False, "ingen produktlinjer med SKU/EAN og dato", signals)
+
+
+def record_corpus_label(page_file, has_products, predicted):
+    """Gemmer AI'ens resultat for en side som facit i labels.json ved siden af den udtrukne sidetekst"""
+    labels_path = os.path.join(os.path.dirname(page_file), 'labels.json')
+    try:
+        labels = {}
+        if os.path.exists(labels_path):
+            with open(labels_path, 'r', encoding='utf-8') as f:
+                labels = json.load(f)
+        labels[os.path.basename(page_file)] = {'has_products': has_products, 'predicted': predicted}
+        with open(labels_path, 'w', encoding='utf-8') as f:
+            json.dump(labels, f, ensure_ascii=False, indent=2)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Kunne ikke gemme corpus-label for {page_file}: {e}")
+
+
+def evaluate_corpus(corpus_dir):
+    """Kører klassifikationen på en optaget corpus-mappe og beregner false-negative raten.
+
+    Mappen skal indeholde sidetekster (*.txt) og labels.json med facit, som skrives af
+    record_corpus_label når PDF'er behandles med PAGE_FILTER_SHADOW_MODE slået til.
+    """
+    with open(os.path.join(corpus_dir, 'labels.json'), 'r', encoding='utf-8') as f:
+        labels = json.load(f)
+
+    counts = {'tp': 0, 'fp': 0, 'tn': 0, 'fn': 0}
+    false_negatives = []
+    for file_name, label in sorted(labels.items()):
+        page_path = os.path.join(corpus_dir, file_name)
+        if not os.path.exists(page_path):
+            continue
+        with open(page_path, 'r', encoding='utf-8') as f:
+            relevance = classify_page(f.read())
+        if label['has_products']:
+            if relevance.relevant:
+                counts['tp'] += 1
+            else:
+                counts['fn'] += 1
+                false_negatives.append((file_name, relevance.reason))
+        else:
+            counts['fp' if relevance.relevant else 'tn'] += 1
+
+    positives = counts['tp'] + counts['fn']
+    total = sum(counts.values())
+    return {
+        'pages': total,
+        'counts': counts,
+        'false_negative_rate': counts['fn'] / positives if positives else 0.0,
+        'skipped_share': (counts['tn'] + counts['fn']) / total if total else 0.0,
+        'false_negatives': false_negatives,
+    }
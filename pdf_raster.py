@@ -0,0 +1,50 @@
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import fitz
+
+
+def has_text_layer(text, min_chars=20):
+    """En side uden (næsten) udtrækkelig tekst behandles som scannet"""
+    return len(''.join((text or '').split())) >= min_chars
+
+
+def render_page(pdf_path, page_num, dpi, output_path):
+    """Rasteriserer én side (1-indekseret) til PNG. Kører i en separat proces"""
+    with fitz.open(pdf_path) as document:
+        pixmap = document[page_num - 1].get_pixmap(dpi=dpi)
+        pixmap.save(output_path)
+        return page_num, output_path, pixmap.width * pixmap.height
+
+
+def render_pages(pdf_path, page_numbers, output_dir, dpi, max_workers=None, progress_callback=None):
+    """Rasteriserer de angivne sider parallelt på tværs af en procespulje.
+
+    Returnerer {page_num: (image_path, pixel_count)}. Sider der fejler logges og udelades.
+    """
+    if not page_numbers:
+        return {}
+
+    stem = os.path.splitext(os.path.basename(pdf_path))[0]
+    max_workers = max(1, min(max_workers or os.cpu_count() or 1, len(page_numbers)))
+    rendered = {}
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(render_page, pdf_path, page_num, dpi,
+                            os.path.join(output_dir, f"{stem}_page_{page_num}.png")): page_num
+            for page_num in page_numbers
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            page_num = futures[future]
+            try:
+                _, image_path, pixel_count = future.result()
+                rendered[page_num] = (image_path, pixel_count)
+                logging.info(f"Scannet side {page_num} rasteriseret ved {dpi} DPI til {image_path}")
+            except Exception as e:
+                logging.error(f"Kunne ikke rasterisere side {page_num}: {e}")
+            if progress_callback:
+                progress_callback(done, len(page_numbers))
+
+    return rendered
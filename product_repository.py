@@ -0,0 +1,246 @@
+import os
+import logging
+import threading
+from functools import lru_cache
+from collections import namedtuple
+
+from db_writer import DatabaseWriter, ReaderPool
+from changeset_sync import SYNCED_COLUMNS, install_change_tracking
+from undo_journal import install_undo_journal, begin_group, end_group
+from expiry_buckets import install_expiry_index, expiring_rows
+
+PRODUCT_COLUMNS = SYNCED_COLUMNS
+
+PRODUCTS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS products (
+    UniqueID INTEGER PRIMARY KEY AUTOINCREMENT,
+    ProductID TEXT,
+    SKU TEXT,
+    "Article Description Batch" TEXT,
+    "Expiry Date" TEXT,
+    "EAN Serial No" TEXT,
+    Remark TEXT,
+    "Order QTY" TEXT,
+    "Ship QTY" TEXT,
+    UOM TEXT,
+    "PDF Source" TEXT
+)
+'''
+
+# Kolonnerne i rapporten og udløbs-snapshottet, i den rækkefølge de vises
+EXPIRING_COLUMNS = ["Article Description Batch", "Expiry Date", "EAN Serial No", "Ship QTY", "PDF Source"]
+ExpiringProduct = namedtuple('ExpiringProduct', ['description', 'expiry_date', 'ean', 'ship_qty', 'pdf_source',
+                                                 'iso_date'])
+
+# sqlite3 genbruger forberedte sætninger pr. forbindelse ud fra SQL-teksten. Med vedvarende
+# forbindelser og faste SQL-strenge skal hver sætning kun kompileres én gang pr. forbindelse
+STATEMENT_CACHE_SIZE = 128
+
+
+def _quote(columns):
+    return ', '.join(f'"{col}"' for col in columns)
+
+
+@lru_cache(maxsize=None)
+def _insert_sql(columns):
+    return f'INSERT INTO products ({_quote(columns)}) VALUES ({", ".join("?" for _ in columns)})'
+
+
+@lru_cache(maxsize=None)
+def _update_sql(columns):
+    assignments = ', '.join(f'"{col}"=?' for col in columns)
+    return f'UPDATE products SET {assignments} WHERE UniqueID=?'
+
+
+_DELETE_SQL = 'DELETE FROM products WHERE UniqueID=?'
+_CLEAR_SQL = 'DELETE FROM products'
+_SELECT_ALL_SQL = 'SELECT * FROM products'
+_COUNT_SQL = 'SELECT COUNT(*) FROM products'
+
+
+class ProductRepository:
+    """Al adgang til products-tabellen: skema, forbindelser, forberedte sætninger og typede metoder.
+
+    Databasen kører i WAL-tilstand. Alle skrivninger går gennem én skrivertråd, som samler ventende
+    skrivninger i én transaktion, og læsninger bruger en pulje af genbrugte læseforbindelser, så
+    læsere aldrig venter på skriveren. Sætningerne kompileres kun én gang pr. forbindelse. En
+    skrivning kan samles i én fortryd-gruppe med undo_label. close() og derefter release_wal() skal
+    kaldes før databasefilen udskiftes; næste kald åbner så den nye fil.
+    """
+
+    def __init__(self, db_path, timeout=30, readers=4, max_batch=100):
+        self.db_path = db_path
+        self._writer = DatabaseWriter(db_path, max_batch=max_batch, timeout=timeout,
+                                      cached_statements=STATEMENT_CACHE_SIZE)
+        self._readers = ReaderPool(db_path, size=readers, timeout=timeout, cached_statements=STATEMENT_CACHE_SIZE)
+        self._columns = None
+        self._lock = threading.Lock()
+
+    def close(self):
+        """Udfører ventende skrivninger og lukker alle forbindelser. Skriveren checkpointer WAL'en
+        ved lukningen"""
+        self._writer.close()
+        self._readers.close()
+        with self._lock:
+            self._columns = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def stats(self):
+        return self._writer.stats()
+
+    def submit_write(self, job, undo_label=None):
+        """Lægger job(conn) i skriverens kø og returnerer en Future. Med undo_label fortrydes
+        alle jobbets ændringer samlet"""
+        if not undo_label:
+            return self._writer.submit(job)
+
+        def grouped(conn):
+            begin_group(conn, undo_label)
+            result = job(conn)
+            end_group(conn)
+            return result
+        return self._writer.submit(grouped)
+
+    def write(self, job, undo_label=None):
+        return self.submit_write(job, undo_label).result()
+
+    def run_alone(self, job):
+        """Kører job(conn) på skrivertråden uden for en batch, til funktioner der selv committer"""
+        return self._writer.write(job, transaction=False)
+
+    def read(self, job):
+        with self._readers.connection() as conn:
+            return job(conn)
+
+    def create_schema(self, device_id):
+        """Opretter products med change tracking, fortryd-journal og udløbsindeks"""
+        def create(conn):
+            conn.execute(PRODUCTS_SCHEMA)
+            install_change_tracking(conn, device_id)
+            install_undo_journal(conn)
+            install_expiry_index(conn)
+        self.run_alone(create)
+        with self._lock:
+            self._columns = None
+
+    def has_products_table(self):
+        return self.read(lambda conn: conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='products'").fetchone()) is not None
+
+    def columns(self):
+        """Kolonnerne i products, cachet indtil forbindelserne lukkes eller en kolonne tilføjes"""
+        with self._lock:
+            if self._columns is None:
+                self._columns = self.read(
+                    lambda conn: [info[1] for info in conn.execute('PRAGMA table_info(products)')])
+            return self._columns
+
+    def _add_missing_columns(self, conn, columns):
+        known = {col.lower() for col in self.columns()}
+        missing = [col for col in columns if col.lower() not in known]
+        for column in missing:
+            conn.execute(f'ALTER TABLE products ADD COLUMN "{column}" TEXT')
+            logging.info(f"Kolonne '{column}' tilføjet til databasen.")
+        if missing:
+            with self._lock:
+                self._columns = None
+        return missing
+
+    def fetch_all(self):
+        """Alle produkter som (kolonnenavne, rækker)"""
+        def fetch(conn):
+            cursor = conn.execute(_SELECT_ALL_SQL)
+            return [description[0] for description in cursor.description], cursor.fetchall()
+        return self.read(fetch)
+
+    def count(self):
+        return self.read(lambda conn: conn.execute(_COUNT_SQL).fetchone()[0])
+
+    def insert(self, data, undo_label="Tilføj produkt"):
+        """Indsætter ét produkt fra en dict med kolonnenavne og returnerer dets UniqueID"""
+        columns = tuple(data.keys())
+        values = tuple(data.values())
+        return self.write(lambda conn: conn.execute(_insert_sql(columns), values).lastrowid, undo_label)
+
+    def insert_many(self, products, undo_label=None):
+        """Indsætter mange produkter med én forberedt sætning i én transaktion.
+
+        Kolonnerne er foreningen af nøglerne i produkterne; manglende værdier bliver NULL og
+        kolonner der ikke findes i tabellen tilføjes først. Returnerer antal indsatte rækker.
+        """
+        columns = tuple(dict.fromkeys(key for product in products for key in product))
+        if not columns:
+            return 0
+
+        def insert(conn):
+            self._add_missing_columns(conn, columns)
+            conn.executemany(_insert_sql(columns), (tuple(product.get(col) for col in columns) for product in products))
+            return len(products)
+        return self.write(insert, undo_label)
+
+    def update(self, row_id, data, undo_label="Rediger produkt", columns=PRODUCT_COLUMNS):
+        """Opdaterer et produkt. Kolonner der mangler i data sættes til tom tekst, som i redigeringsdialogen"""
+        columns = tuple(columns)
+        values = tuple(data.get(col, '') for col in columns) + (row_id,)
+        return self.write(lambda conn: conn.execute(_update_sql(columns), values).rowcount, undo_label)
+
+    def update_cells(self, cells, undo_label="Rediger produkter"):
+        """Opdaterer enkelte felter ud fra (UniqueID, kolonne, værdi) i én transaktion.
+
+        Sætningerne grupperes pr. kolonne og køres med executemany, så hver ændret celle koster én
+        UPDATE af én kolonne. Returnerer antal opdaterede celler.
+        """
+        by_column = {}
+        for row_id, column, value in cells:
+            by_column.setdefault(column, []).append((value, row_id))
+        known = {col.lower() for col in self.columns()}
+        unknown = [column for column in by_column if column.lower() not in known]
+        if unknown:
+            raise ValueError(f"Ukendte kolonner: {unknown}")
+        if not by_column:
+            return 0
+
+        def update(conn):
+            return sum(conn.executemany(_update_sql((column,)), params).rowcount
+                       for column, params in by_column.items())
+        return self.write(update, undo_label)
+
+    def delete(self, row_id, undo_label="Slet produkt"):
+        return self.write(lambda conn: conn.execute(_DELETE_SQL, (row_id,)).rowcount, undo_label)
+
+    def delete_many(self, row_ids, undo_label="Slet produkter"):
+        """Sletter flere produkter i én transaktion og returnerer antal slettede rækker"""
+        params = [(row_id,) for row_id in row_ids]
+        if not params:
+            return 0
+        return self.write(lambda conn: conn.executemany(_DELETE_SQL, params).rowcount, undo_label)
+
+    def clear(self, undo_label="Ryd database"):
+        return self.write(lambda conn: conn.execute(_CLEAR_SQL).rowcount, undo_label)
+
+    def execute(self, sql, args=(), undo_label=None):
+        """Kører en vilkårlig skrivning i én transaktion og returnerer eventuelle rækker"""
+        return self.write(lambda conn: conn.execute(sql, args).fetchall(), undo_label)
+
+    def expiring(self, days, today=None):
+        """Produkter der udløber fra i dag til og med days dage frem, sorteret efter udløbsdato"""
+        return self.read(lambda conn: [ExpiringProduct(*row)
+                                       for row in expiring_rows(conn, EXPIRING_COLUMNS, days, today)])
+
+
+_repositories = {}
+_repositories_lock = threading.Lock()
+
+
+def get_repository(db_path):
+    """Det fælles repository for en databasefil, så GUI'en og baggrundstrådene deler én skriver"""
+    with _repositories_lock:
+        key = os.path.abspath(db_path)
+        if key not in _repositories:
+            _repositories[key] = ProductRepository(db_path)
+        return _repositories[key]
@@ -2,15 +2,16 @@ import os
 import sys
 import logging
 import certifi
-from dropbox import Dropbox
 from dropbox import DropboxOAuth2FlowNoRedirect
 from config import get_dropbox_app_key, get_dropbox_app_secret, get_dropbox_refresh_token
+from dropbox_session import DropboxSessionManager
 
 class SecureDropboxAuth:
     def __init__(self):
         self.app_key = get_dropbox_app_key()
         self.app_secret = get_dropbox_app_secret()
         self.refresh_token = get_dropbox_refresh_token()
+        self.session_manager = None
 
     def get_certifi_path(self):
         if getattr(sys, 'frozen', False):
@@ -23,12 +24,10 @@ class SecureDropboxAuth:
             return None
 
         try:
-            os.environ['REQUESTS_CA_BUNDLE'] = self.get_certifi_path()
-            return Dropbox(
-                oauth2_refresh_token=self.refresh_token,
-                app_key=self.app_key,
-                app_secret=self.app_secret
-            )
+            if self.session_manager is None:
+                self.session_manager = DropboxSessionManager(self.app_key, self.app_secret, self.refresh_token,
+                                                             ca_bundle=self.get_certifi_path())
+            return self.session_manager.get_client()
         except Exception as e:
             logging.error(f"Fejl ved oprettelse af Dropbox-klient: {e}")
             return None
@@ -44,6 +43,7 @@ class SecureDropboxAuth:
         try:
             oauth_result = auth_flow.finish(auth_code)
             self.refresh_token = oauth_result.refresh_token
+            self.session_manager = None
             return self.get_dropbox_client()
         except Exception as e:
             logging.error(f"Fejl under OAuth-flow: {e}")
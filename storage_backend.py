@@ -0,0 +1,311 @@
+import os
+import time
+import socket
+import threading
+from collections import namedtuple
+
+from dropbox_transfer import (SyncConflictError, UPLOAD_CHUNK_SIZE, DOWNLOAD_CHUNK_SIZE, dropbox_content_hash,
+                              upload_file_chunked, _is_conflict, _is_not_found)
+
+# Metadata for en fil eller mappe. Felterne matcher dem koden bruger fra Dropbox' FileMetadata
+FileInfo = namedtuple('FileInfo', ['name', 'path', 'size', 'rev', 'content_hash', 'is_folder'])
+
+# expected_rev=NEW_FILE betyder at filen ikke må findes i forvejen
+NEW_FILE = ''
+
+
+class StorageBackend:
+    """Fælles interface for lageret databasen synkroniseres med.
+
+    expected_rev styrer skrivninger: None overskriver, NEW_FILE kræver at filen ikke findes, og
+    en rev kræver at filen stadig har den version. Ellers rejses SyncConflictError.
+    """
+
+    def put(self, data, remote_path, expected_rev=None):
+        """Gemmer bytes og returnerer FileInfo for den nye version"""
+        raise NotImplementedError
+
+    def get(self, remote_path):
+        """Henter hele filen som bytes"""
+        raise NotImplementedError
+
+    def get_stream(self, remote_path, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        """Returnerer (FileInfo, iterator af chunks). Iteratoren lukker selv forbindelsen"""
+        raise NotImplementedError
+
+    def stat(self, remote_path):
+        """FileInfo for filen eller None hvis den ikke findes"""
+        raise NotImplementedError
+
+    def upload_chunked(self, local_path, remote_path, expected_rev=None, chunk_size=UPLOAD_CHUNK_SIZE,
+                       progress_callback=None, **options):
+        """Uploader en lokal fil i chunks uden at læse den helt ind i hukommelsen"""
+        raise NotImplementedError
+
+    def list(self, folder):
+        """FileInfo for filer og mapper direkte i folder, sorteret efter navn. Tom liste hvis mappen mangler"""
+        raise NotImplementedError
+
+    def delete(self, remote_path):
+        """Sletter filen. Findes den ikke, sker der ingenting"""
+        raise NotImplementedError
+
+    def is_online(self):
+        """Hurtig kontrol af om lageret kan nås, før en overførsel forsøges"""
+        return True
+
+
+class DropboxBackend(StorageBackend):
+    """Dropbox app-mappen via SDK'et"""
+
+    API_HOST = "api.dropboxapi.com"
+
+    def __init__(self, dbx_client, online_timeout=3):
+        self.dbx_client = dbx_client
+        self.online_timeout = online_timeout
+
+    def is_online(self):
+        try:
+            with socket.create_connection((self.API_HOST, 443), timeout=self.online_timeout):
+                return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def _info(metadata):
+        from dropbox.files import FolderMetadata
+        return FileInfo(metadata.name, metadata.path_display, getattr(metadata, 'size', 0),
+                        getattr(metadata, 'rev', None), getattr(metadata, 'content_hash', None),
+                        isinstance(metadata, FolderMetadata))
+
+    @staticmethod
+    def _mode(expected_rev):
+        from dropbox.files import WriteMode
+        if expected_rev is None:
+            return WriteMode.overwrite
+        if expected_rev == NEW_FILE:
+            return WriteMode.add
+        return WriteMode.update(expected_rev)
+
+    @staticmethod
+    def _conflict(remote_path):
+        return SyncConflictError(
+            f"{remote_path} i Dropbox er blevet ændret siden din sidste synkronisering. "
+            f"Hent den nyeste version fra Dropbox før du uploader."
+        )
+
+    def put(self, data, remote_path, expected_rev=None):
+        from dropbox.exceptions import ApiError
+        try:
+            return self._info(self.dbx_client.files_upload(data, remote_path, mode=self._mode(expected_rev)))
+        except ApiError as e:
+            if _is_conflict(e.error):
+                raise self._conflict(remote_path) from e
+            raise
+
+    def get(self, remote_path):
+        _, response = self.dbx_client.files_download(remote_path)
+        try:
+            return response.content
+        finally:
+            response.close()
+
+    def get_stream(self, remote_path, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        metadata, response = self.dbx_client.files_download(remote_path)
+
+        def chunks():
+            try:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    if chunk:
+                        yield chunk
+            finally:
+                response.close()
+
+        return self._info(metadata), chunks()
+
+    def stat(self, remote_path):
+        from dropbox.exceptions import ApiError
+        try:
+            return self._info(self.dbx_client.files_get_metadata(remote_path))
+        except ApiError as e:
+            if _is_not_found(e.error):
+                return None
+            raise
+
+    def upload_chunked(self, local_path, remote_path, expected_rev=None, chunk_size=UPLOAD_CHUNK_SIZE,
+                       progress_callback=None, **options):
+        from dropbox.exceptions import ApiError
+        try:
+            metadata = upload_file_chunked(self.dbx_client, local_path, remote_path, mode=self._mode(expected_rev),
+                                           chunk_size=chunk_size, progress_callback=progress_callback, **options)
+        except ApiError as e:
+            if _is_conflict(e.error):
+                raise self._conflict(remote_path) from e
+            raise
+        return self._info(metadata)
+
+    def list(self, folder):
+        from dropbox.exceptions import ApiError
+        try:
+            result = self.dbx_client.files_list_folder(folder)
+        except ApiError as e:
+            if _is_not_found(e.error):
+                return []
+            raise
+        entries = list(result.entries)
+        while result.has_more:
+            result = self.dbx_client.files_list_folder_continue(result.cursor)
+            entries.extend(result.entries)
+        return sorted((self._info(entry) for entry in entries), key=lambda info: info.name)
+
+    def delete(self, remote_path):
+        from dropbox.exceptions import ApiError
+        try:
+            self.dbx_client.files_delete_v2(remote_path)
+        except ApiError as e:
+            # files_delete_v2 melder en manglende fil som path_lookup, ikke path
+            error = e.error
+            if not (hasattr(error, 'is_path_lookup') and error.is_path_lookup()
+                    and error.get_path_lookup().is_not_found()):
+                raise
+
+
+class LocalBackend(StorageBackend):
+    """Lager i en lokal mappe med valgfri simuleret netværksforsinkelse og båndbredde.
+
+    latency lægges på hvert kald og hver chunk, bandwidth er bytes pr. sekund (None = ubegrænset).
+    Rev og content hash opfører sig som i Dropbox, så konfliktkontrol og uændret-check kan testes
+    og benchmarkes uden netværk.
+    """
+
+    TEMP_SUFFIX = ".partial"
+
+    def __init__(self, root, latency=0.0, bandwidth=None):
+        self.root = root
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'bytes_sent': 0, 'bytes_received': 0, 'simulated_seconds': 0.0}
+        os.makedirs(root, exist_ok=True)
+
+    def _local(self, remote_path):
+        return os.path.join(self.root, *[part for part in remote_path.split('/') if part])
+
+    def is_online(self):
+        # Mappen kan ligge på et netværksdrev, som ikke altid er monteret
+        return os.path.isdir(self.root)
+
+    def _simulate(self, sent=0, received=0):
+        delay = self.latency
+        if self.bandwidth:
+            delay += (sent + received) / self.bandwidth
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['bytes_sent'] += sent
+            self.stats['bytes_received'] += received
+            self.stats['simulated_seconds'] += delay
+        if delay:
+            time.sleep(delay)
+
+    def _stat_local(self, remote_path):
+        local_path = self._local(remote_path)
+        if not os.path.exists(local_path):
+            return None
+        name = os.path.basename(local_path)
+        if os.path.isdir(local_path):
+            return FileInfo(name, remote_path, 0, None, None, True)
+        st = os.stat(local_path)
+        return FileInfo(name, remote_path, st.st_size, f"{st.st_mtime_ns:x}{st.st_size:x}",
+                        dropbox_content_hash(local_path), False)
+
+    def _check_rev(self, remote_path, expected_rev):
+        if expected_rev is None:
+            return
+        current = self._stat_local(remote_path)
+        if (expected_rev == NEW_FILE and current is not None) or \
+                (expected_rev != NEW_FILE and (current is None or current.rev != expected_rev)):
+            raise SyncConflictError(
+                f"{remote_path} er blevet ændret siden din sidste synkronisering. "
+                f"Hent den nyeste version før du uploader."
+            )
+
+    def put(self, data, remote_path, expected_rev=None):
+        self._simulate(sent=len(data))
+        local_path = self._local(remote_path)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        temp_path = local_path + self.TEMP_SUFFIX
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            try:
+                self._check_rev(remote_path, expected_rev)
+            except SyncConflictError:
+                os.remove(temp_path)
+                raise
+            os.replace(temp_path, local_path)
+        return self._stat_local(remote_path)
+
+    def get(self, remote_path):
+        local_path = self._local(remote_path)
+        if not os.path.isfile(local_path):
+            raise FileNotFoundError(f"{remote_path} findes ikke")
+        with open(local_path, 'rb') as f:
+            data = f.read()
+        self._simulate(received=len(data))
+        return data
+
+    def get_stream(self, remote_path, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        info = self.stat(remote_path)
+        if info is None or info.is_folder:
+            raise FileNotFoundError(f"{remote_path} findes ikke")
+        local_path = self._local(remote_path)
+
+        def chunks():
+            with open(local_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    self._simulate(received=len(chunk))
+                    yield chunk
+
+        return info, chunks()
+
+    def stat(self, remote_path):
+        self._simulate()
+        return self._stat_local(remote_path)
+
+    def upload_chunked(self, local_path, remote_path, expected_rev=None, chunk_size=UPLOAD_CHUNK_SIZE,
+                       progress_callback=None, **options):
+        file_size = os.path.getsize(local_path)
+        target_path = self._local(remote_path)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        temp_path = target_path + self.TEMP_SUFFIX
+        sent = 0
+        with open(local_path, 'rb') as source, open(temp_path, 'wb') as target:
+            for chunk in iter(lambda: source.read(chunk_size), b''):
+                self._simulate(sent=len(chunk))
+                target.write(chunk)
+                sent += len(chunk)
+                if progress_callback:
+                    progress_callback(sent, file_size)
+        with self._lock:
+            try:
+                self._check_rev(remote_path, expected_rev)
+            except SyncConflictError:
+                os.remove(temp_path)
+                raise
+            os.replace(temp_path, target_path)
+        return self._stat_local(remote_path)
+
+    def list(self, folder):
+        self._simulate()
+        local_folder = self._local(folder)
+        if not os.path.isdir(local_folder):
+            return []
+        remote_folder = '/' + '/'.join(part for part in folder.split('/') if part)
+        return [self._stat_local(f"{remote_folder.rstrip('/')}/{name}")
+                for name in sorted(os.listdir(local_folder)) if not name.endswith(self.TEMP_SUFFIX)]
+
+    def delete(self, remote_path):
+        self._simulate()
+        local_path = self._local(remote_path)
+        if os.path.isfile(local_path):
+            os.remove(local_path)
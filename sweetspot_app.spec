@@ -17,6 +17,24 @@ added_files = [
     (os.path.join(base_path, 'config.py'), '.'),
     (os.path.join(base_path, 'crypt.py'), '.'),
     (os.path.join(base_path, 'secure_dropbox_auth.py'), '.'),
+    (os.path.join(base_path, 'model_router.py'), '.'),
+    (os.path.join(base_path, 'ai_usage.py'), '.'),
+    (os.path.join(base_path, 'page_filter.py'), '.'),
+    (os.path.join(base_path, 'pdf_raster.py'), '.'),
+    (os.path.join(base_path, 'dropbox_transfer.py'), '.'),
+    (os.path.join(base_path, 'changeset_sync.py'), '.'),
+    (os.path.join(base_path, 'db_snapshot.py'), '.'),
+    (os.path.join(base_path, 'dropbox_session.py'), '.'),
+    (os.path.join(base_path, 'auto_sync.py'), '.'),
+    (os.path.join(base_path, 'storage_backend.py'), '.'),
+    (os.path.join(base_path, 'backup_manager.py'), '.'),
+    (os.path.join(base_path, 'undo_journal.py'), '.'),
+    (os.path.join(base_path, 'expiry_snapshot.py'), '.'),
+    (os.path.join(base_path, 'expiry_buckets.py'), '.'),
+    (os.path.join(base_path, 'product_repository.py'), '.'),
+    (os.path.join(base_path, 'db_writer.py'), '.'),
+    (os.path.join(base_path, 'db_worker.py'), '.'),
+    (os.path.join(base_path, 'cell_edit_buffer.py'), '.'),
     (certifi.where(), '.'),  # Brug certifi.where() til at finde cacert.pem
 ]
 
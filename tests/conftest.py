@@ -0,0 +1,59 @@
+import os
+import sys
+import sqlite3
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from changeset_sync import SYNCED_COLUMNS  # noqa: E402
+from product_repository import PRODUCTS_SCHEMA, ProductRepository  # noqa: E402
+
+_COLUMN_LIST = ', '.join(f'"{col}"' for col in SYNCED_COLUMNS)
+
+
+def product(i, **fields):
+    """Et produkt som {kolonne: værdi} med forskelligt indhold for hvert i"""
+    values = {"ProductID": str(i), "SKU": f"{10000 + i}", "Article Description Batch": f"Produkt {i}",
+              "Expiry Date": f"{1 + i % 28:02d}.11.2026", "EAN Serial No": f"57{i:011d}", "Remark": "",
+              "Order QTY": "1", "Ship QTY": "1", "UOM": "STK", "PDF Source": "test.pdf"}
+    values.update(fields)
+    return values
+
+
+@pytest.fixture
+def make_products_db(tmp_path):
+    """Opretter en products-database uden change tracking med de givne produkter"""
+    def make(name, products=()):
+        db_path = str(tmp_path / name)
+        conn = sqlite3.connect(db_path)
+        conn.execute(PRODUCTS_SCHEMA)
+        conn.executemany(
+            f'INSERT INTO products ({_COLUMN_LIST}) VALUES ({", ".join("?" for _ in SYNCED_COLUMNS)})',
+            [[p.get(col, '') for col in SYNCED_COLUMNS] for p in products])
+        conn.commit()
+        conn.close()
+        return db_path
+    return make
+
+
+@pytest.fixture
+def open_repository():
+    """Åbner en ProductRepository for en databasefil og lukker den efter testen"""
+    repositories = []
+
+    def open_(db_path):
+        repositories.append(ProductRepository(db_path))
+        return repositories[-1]
+    yield open_
+    for repository in repositories:
+        repository.close()
+
+
+def read_products(db_path):
+    """Alle produkter som sorteret liste af tupler uden UniqueID, så kopier kan sammenlignes"""
+    conn = sqlite3.connect(db_path)
+    try:
+        return sorted(conn.execute(f'SELECT {_COLUMN_LIST} FROM products').fetchall())
+    finally:
+        conn.close()
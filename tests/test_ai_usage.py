@@ -0,0 +1,38 @@
+import sqlite3
+
+from ai_usage import AIUsageLog
+
+# ai_calls som den så ud, før fejlede kald blev registreret
+OLD_AI_CALLS_SCHEMA = '''
+CREATE TABLE ai_calls (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    purpose TEXT,
+    model TEXT,
+    prompt_tokens INTEGER DEFAULT 0,
+    completion_tokens INTEGER DEFAULT 0,
+    latency REAL DEFAULT 0,
+    retries INTEGER DEFAULT 0,
+    cache_hit INTEGER DEFAULT 0,
+    document_hash TEXT,
+    document_name TEXT,
+    page INTEGER,
+    cost REAL DEFAULT 0,
+    baseline_cost REAL DEFAULT 0
+)
+'''
+
+
+def test_failed_calls_are_recorded_and_counted(tmp_path):
+    db_path = str(tmp_path / "ai_usage.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute(OLD_AI_CALLS_SCHEMA)
+    conn.commit()
+    conn.close()
+
+    usage_log = AIUsageLog(db_path)
+    usage_log.record_call("tekst", "gpt-4o-mini", 100, 20, 1.5, cost=0.01)
+    usage_log.record_call("tekst", "gpt-4o-mini", 0, 0, 7.0, retries=3, error="APIConnectionError: nede")
+
+    (_, calls, _, _, _, _, total_latency, retries, _, _, _, failed), = usage_log.daily_summary()
+    assert (calls, total_latency, retries, failed) == (2, 8.5, 3, 1)
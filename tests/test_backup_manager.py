@@ -0,0 +1,57 @@
+import os
+import time
+import sqlite3
+
+from backup_manager import BackupManager
+from conftest import product, read_products
+
+
+def edit(db_path, remark):
+    conn = sqlite3.connect(db_path)
+    conn.execute('UPDATE products SET Remark=? WHERE ProductID=?', (remark, "3"))
+    conn.commit()
+    conn.close()
+
+
+def page_files(backup_dir):
+    return {name for _, _, files in os.walk(os.path.join(backup_dir, 'pages')) for name in files}
+
+
+def test_prune_keeps_newest_per_hour_and_removes_unused_pages(tmp_path, make_products_db):
+    db_path = make_products_db("products.db", [product(i) for i in range(500)])
+    backup_dir = str(tmp_path / "backups")
+    manager = BackupManager(backup_dir, min_interval=0)
+    snapshots = []
+    for i in range(3):
+        edit(db_path, f"redigering {i}")
+        snapshots.append(manager.create_snapshot(db_path, label='test'))
+    assert manager.list_snapshots() == snapshots
+    pages_before = page_files(backup_dir)
+
+    # To timer senere ligger alle tre i samme time; kun det nyeste beholdes
+    assert manager.prune(now=time.time() + 2 * 3600) == 2
+    assert manager.list_snapshots() == snapshots[-1:]
+    pages_after = page_files(backup_dir)
+    assert pages_after < pages_before
+    assert pages_after == {f"{page}.z" for page in manager.load_manifest(snapshots[-1])['pages']}
+
+    restored = str(tmp_path / "restored.db")
+    manager.restore(snapshots[-1], restored)
+    assert read_products(restored) == read_products(db_path)
+
+
+def test_prune_removes_snapshots_past_retention(tmp_path, make_products_db):
+    db_path = make_products_db("products.db", [product(1)])
+    manager = BackupManager(str(tmp_path / "backups"), min_interval=0, retention_days=30)
+    manager.create_snapshot(db_path)
+    assert manager.prune(now=time.time() + 31 * 86400) == 1
+    assert manager.list_snapshots() == []
+
+
+def test_snapshot_within_min_interval_is_reused(tmp_path, make_products_db):
+    db_path = make_products_db("products.db", [product(1)])
+    manager = BackupManager(str(tmp_path / "backups"), min_interval=300)
+    first = manager.create_snapshot(db_path)
+    edit(db_path, "ny")
+    assert manager.create_snapshot(db_path) == first
+    assert manager.create_snapshot(db_path, force=True) != first
@@ -0,0 +1,108 @@
+import shutil
+import sqlite3
+
+import pytest
+
+from changeset_sync import ChangesetSync, CHANGES_FOLDER
+from storage_backend import LocalBackend
+from conftest import product, read_products
+
+
+def execute(db_path, sql, params=()):
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute(sql, params)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def replicas(tmp_path, open_repository):
+    """To enheder der synkroniserer gennem en lokal mappe i stedet for Dropbox"""
+    def make(db_a, db_b, **options):
+        backend = LocalBackend(str(tmp_path / "remote"))
+        return (backend, ChangesetSync(open_repository(db_a), backend, "device-a", **options),
+                ChangesetSync(open_repository(db_b), backend, "device-b", **options))
+    return make
+
+
+def test_two_replicas_converge(tmp_path, make_products_db, replicas):
+    db_a = make_products_db("a.db", [product(i) for i in range(5)])
+    db_b = str(tmp_path / "b.db")
+    shutil.copy(db_a, db_b)
+    _, sync_a, sync_b = replicas(db_a, db_b)
+    sync_a.sync()
+    sync_b.sync()
+
+    execute(db_a, 'UPDATE products SET Remark=? WHERE ProductID=?', ("rettet på A", "1"))
+    execute(db_a, 'INSERT INTO products (ProductID, "Article Description Batch") VALUES (?, ?)', ("10", "Ny på A"))
+    execute(db_b, 'UPDATE products SET "Ship QTY"=? WHERE ProductID=?', ("7", "2"))
+    execute(db_b, 'DELETE FROM products WHERE ProductID=?', ("3",))
+
+    sync_a.sync()
+    stats = sync_b.sync()
+    sync_a.sync()
+
+    assert stats['applied'] == 2
+    assert read_products(db_a) == read_products(db_b)
+    products = {row[0]: row for row in read_products(db_a)}
+    assert set(products) == {"0", "1", "2", "4", "10"}
+    assert products["1"][5] == "rettet på A"
+    assert products["2"][7] == "7"
+
+
+def test_conflicting_edits_resolve_the_same_way_on_both_replicas(tmp_path, make_products_db, replicas):
+    db_a = make_products_db("a.db", [product(1)])
+    db_b = str(tmp_path / "b.db")
+    shutil.copy(db_a, db_b)
+    _, sync_a, sync_b = replicas(db_a, db_b)
+    sync_a.sync()
+    sync_b.sync()
+
+    execute(db_a, 'UPDATE products SET Remark=? WHERE ProductID=?', ("A", "1"))
+    execute(db_b, 'UPDATE products SET Remark=? WHERE ProductID=?', ("B", "1"))
+    sync_a.sync()
+    sync_b.sync()
+    sync_a.sync()
+
+    assert read_products(db_a) == read_products(db_b)
+    assert len(read_products(db_a)) == 1
+
+
+def test_diverged_copies_do_not_overwrite_different_products_with_the_same_id(tmp_path, make_products_db, replicas):
+    # Begge kopier har UniqueID 1, men for hvert sit produkt, før sporingen blev slået til
+    db_a = make_products_db("a.db", [product(1)])
+    db_b = make_products_db("b.db", [product(2)])
+    _, sync_a, sync_b = replicas(db_a, db_b)
+    sync_a.sync()
+    sync_b.sync()
+
+    execute(db_a, 'UPDATE products SET Remark=? WHERE UniqueID=1', ("rettet på A",))
+    sync_a.sync()
+    sync_b.sync()
+
+    products = {row[0]: row for row in read_products(db_b)}
+    assert set(products) == {"1", "2"}
+    assert products["1"][5] == "rettet på A"
+    assert products["2"][5] == ""
+
+
+def test_compaction_keeps_latest_change_per_row(tmp_path, make_products_db, replicas):
+    db_a = make_products_db("a.db", [product(i) for i in range(3)])
+    db_b = str(tmp_path / "b.db")
+    shutil.copy(db_a, db_b)
+    backend, sync_a, sync_b = replicas(db_a, db_b, compact_after_files=3)
+    sync_a.sync()
+    sync_b.sync()
+
+    for i in range(4):
+        execute(db_a, 'UPDATE products SET Remark=? WHERE ProductID=?', (f"rettelse {i}", str(i % 3)))
+        stats = sync_a.sync()
+
+    assert stats['compacted_files'] == 4
+    assert len(backend.list(f"{CHANGES_FOLDER}/device-a")) == 1
+    stats = sync_b.sync()
+    assert stats['files_read'] == 1
+    assert stats['applied'] == 3
+    assert read_products(db_a) == read_products(db_b)
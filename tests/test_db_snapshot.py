@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+from db_snapshot import create_snapshot, restore_snapshot, restore_snapshot_stream
+from conftest import product, read_products
+
+
+@pytest.fixture
+def snapshot(tmp_path, make_products_db):
+    db_path = make_products_db("products.db", [product(i) for i in range(200)])
+    snapshot_path = str(tmp_path / "products.db.gz")
+    create_snapshot(db_path, snapshot_path)
+    return db_path, snapshot_path
+
+
+def test_round_trip_restores_the_same_rows(tmp_path, snapshot):
+    db_path, snapshot_path = snapshot
+    restored_path = str(tmp_path / "restored.db")
+    restore_snapshot(snapshot_path, restored_path)
+    assert read_products(restored_path) == read_products(db_path)
+
+
+def test_same_database_gives_identical_snapshot(tmp_path, snapshot):
+    db_path, snapshot_path = snapshot
+    again_path = str(tmp_path / "again.db.gz")
+    create_snapshot(db_path, again_path)
+    with open(snapshot_path, 'rb') as first, open(again_path, 'rb') as second:
+        assert first.read() == second.read()
+
+
+def test_stream_split_inside_the_header(tmp_path, snapshot):
+    db_path, snapshot_path = snapshot
+    with open(snapshot_path, 'rb') as f:
+        data = f.read()
+    restored_path = str(tmp_path / "restored.db")
+    received = restore_snapshot_stream((data[i:i + 7] for i in range(0, len(data), 7)), restored_path)
+    assert received == len(data)
+    assert read_products(restored_path) == read_products(db_path)
+
+
+@pytest.mark.parametrize("damage", [
+    lambda data: data[:len(data) // 2],
+    lambda data: data[:60] + bytes([data[60] ^ 0xFF]) + data[61:],
+    lambda data: b'NOTASNAP' + data[8:],
+    lambda data: data[:-12] + bytes(12),
+], ids=["truncated", "flipped-byte", "bad-magic", "bad-trailer"])
+def test_corrupt_stream_is_rejected_and_output_removed(tmp_path, snapshot, damage):
+    _, snapshot_path = snapshot
+    with open(snapshot_path, 'rb') as f:
+        data = damage(f.read())
+    restored_path = str(tmp_path / "restored.db")
+    with pytest.raises(IOError):
+        restore_snapshot_stream(iter([data]), restored_path)
+    assert not os.path.exists(restored_path)
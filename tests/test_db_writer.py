@@ -0,0 +1,56 @@
+import sqlite3
+import threading
+
+import pytest
+
+from db_writer import DatabaseWriter, release_wal
+from conftest import read_products
+
+INSERT_SQL = 'INSERT INTO products (ProductID) VALUES (?)'
+
+
+def test_failing_job_rolls_back_only_its_own_savepoint(make_products_db):
+    db_path = make_products_db("products.db")
+    writer = DatabaseWriter(db_path)
+    release = threading.Event()
+    # Det første job holder skrivertråden, så de næste tre ender i samme batch (evt. sammen med det)
+    blocker = writer.submit(lambda conn: release.wait(5))
+
+    def failing(conn):
+        conn.execute(INSERT_SQL, ("fejl",))
+        raise ValueError("jobbet fejler efter sin skrivning")
+
+    first = writer.submit(lambda conn: conn.execute(INSERT_SQL, ("1",)).lastrowid)
+    broken = writer.submit(failing)
+    last = writer.submit(lambda conn: conn.execute(INSERT_SQL, ("2",)).lastrowid)
+    release.set()
+
+    assert blocker.result(5)
+    assert first.result(5) and last.result(5)
+    with pytest.raises(ValueError):
+        broken.result(5)
+    writer.close()
+
+    assert [row[0] for row in read_products(db_path)] == ["1", "2"]
+    stats = writer.stats()
+    assert stats['failed_jobs'] == 1
+    assert stats['largest_batch'] >= 3
+
+
+def test_release_wal_refuses_while_another_connection_is_open(make_products_db):
+    db_path = make_products_db("products.db")
+    writer = DatabaseWriter(db_path)
+    writer.write(lambda conn: conn.execute(INSERT_SQL, ("1",)))
+    other = sqlite3.connect(db_path)
+    other.execute('SELECT COUNT(*) FROM products').fetchone()
+    writer.close()
+
+    with pytest.raises(sqlite3.OperationalError):
+        release_wal(db_path, timeout=0.1)
+    other.close()
+    release_wal(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+    finally:
+        conn.close()
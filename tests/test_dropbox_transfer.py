@@ -0,0 +1,193 @@
+import os
+import hashlib
+from types import SimpleNamespace
+
+import pytest
+import requests
+from dropbox.exceptions import ApiError
+from dropbox.files import (GetMetadataError, LookupError as DropboxLookupError, UploadError, UploadSessionFinishError,
+                           UploadSessionLookupError, UploadSessionOffsetError, UploadWriteFailed, WriteConflictError,
+                           WriteError)
+
+from dropbox_transfer import (DROPBOX_HASH_BLOCK_SIZE, SyncConflictError, dropbox_content_hash,
+                              upload_file_chunked, upload_if_changed)
+from storage_backend import DropboxBackend
+
+CHUNK_SIZE = 1024
+
+
+def content_hash(data):
+    blocks = hashlib.sha256()
+    for start in range(0, len(data), DROPBOX_HASH_BLOCK_SIZE):
+        blocks.update(hashlib.sha256(data[start:start + DROPBOX_HASH_BLOCK_SIZE]).digest())
+    return blocks.hexdigest()
+
+
+class FakeDropboxClient:
+    """Lokal stand-in for dropbox.Dropbox med de kald upload og konfliktkontrol bruger.
+
+    fail_appends er en liste af kald-numre for files_upload_session_append_v2 der fejler med en
+    netværksfejl. Med lose_response gemmes data før fejlen, som når svaret går tabt på vej tilbage.
+    """
+
+    def __init__(self, fail_appends=(), lose_response=False):
+        self.files = {}
+        self.sessions = {}
+        self.calls = []
+        self.fail_appends = list(fail_appends)
+        self.lose_response = lose_response
+        self._appends = 0
+        self._revs = 0
+
+    def _conflict(self, remote_path, mode, finish):
+        current = self.files.get(remote_path)
+        if mode.is_add() and current is not None:
+            conflict = True
+        elif mode.is_update():
+            conflict = current is None or current.rev != mode.get_update()
+        else:
+            conflict = False
+        if conflict:
+            write_error = WriteError.conflict(WriteConflictError.file)
+            error = UploadSessionFinishError.path(write_error) if finish else \
+                UploadError.path(UploadWriteFailed(reason=write_error, upload_session_id=''))
+            raise ApiError('fake', error, None, None)
+
+    def _store(self, data, remote_path):
+        self._revs += 1
+        metadata = SimpleNamespace(name=os.path.basename(remote_path), path_display=remote_path, size=len(data),
+                                   rev=f"{self._revs:09x}", content_hash=content_hash(data), data=data)
+        self.files[remote_path] = metadata
+        return metadata
+
+    def files_upload(self, data, remote_path, mode):
+        self.calls.append(('upload', len(data)))
+        self._conflict(remote_path, mode, finish=False)
+        return self._store(data, remote_path)
+
+    def files_upload_session_start(self, chunk):
+        self.calls.append(('start', len(chunk)))
+        session_id = f"session-{len(self.sessions)}"
+        self.sessions[session_id] = bytearray(chunk)
+        return SimpleNamespace(session_id=session_id)
+
+    def _check_offset(self, cursor):
+        received = len(self.sessions[cursor.session_id])
+        if cursor.offset != received:
+            raise ApiError('fake', UploadSessionLookupError.incorrect_offset(
+                UploadSessionOffsetError(correct_offset=received)), None, None)
+
+    def files_upload_session_append_v2(self, chunk, cursor):
+        self._appends += 1
+        self.calls.append(('append', cursor.offset, len(chunk)))
+        if self._appends in self.fail_appends and not self.lose_response:
+            raise requests.exceptions.ConnectionError("forbindelsen blev afbrudt")
+        self._check_offset(cursor)
+        self.sessions[cursor.session_id] += chunk
+        if self._appends in self.fail_appends:
+            raise requests.exceptions.ConnectionError("svaret gik tabt")
+
+    def files_upload_session_finish(self, chunk, cursor, commit):
+        self.calls.append(('finish', cursor.offset, len(chunk)))
+        self._check_offset(cursor)
+        self._conflict(commit.path, commit.mode, finish=True)
+        data = bytes(self.sessions.pop(cursor.session_id) + chunk)
+        return self._store(data, commit.path)
+
+    def files_get_metadata(self, remote_path):
+        if remote_path not in self.files:
+            raise ApiError('fake', GetMetadataError.path(DropboxLookupError.not_found), None, None)
+        return self.files[remote_path]
+
+
+@pytest.fixture
+def local_file(tmp_path):
+    path = str(tmp_path / "products.db.gz")
+    with open(path, 'wb') as f:
+        f.write(os.urandom(CHUNK_SIZE * 5 + 100))
+    return path
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_upload_streams_fixed_size_chunks_and_reports_progress(local_file):
+    client = FakeDropboxClient()
+    progress = []
+    metadata = upload_file_chunked(client, local_file, '/products.db.gz', chunk_size=CHUNK_SIZE,
+                                   progress_callback=lambda sent, total: progress.append(sent))
+
+    assert metadata.data == read(local_file)
+    assert [call[0] for call in client.calls] == ['start', 'append', 'append', 'append', 'append', 'finish']
+    assert all(call[-1] <= CHUNK_SIZE for call in client.calls)
+    assert progress == sorted(progress) and progress[-1] == os.path.getsize(local_file)
+
+
+def test_small_file_is_sent_in_one_call(tmp_path):
+    path = str(tmp_path / "small.db")
+    with open(path, 'wb') as f:
+        f.write(b'lille fil')
+    client = FakeDropboxClient()
+    upload_file_chunked(client, path, '/small.db', chunk_size=CHUNK_SIZE)
+    assert client.calls == [('upload', 9)]
+
+
+def test_network_error_resumes_from_last_acknowledged_offset(local_file):
+    client = FakeDropboxClient(fail_appends=[2])
+    metadata = upload_file_chunked(client, local_file, '/products.db.gz', chunk_size=CHUNK_SIZE, retry_delay=0)
+
+    assert metadata.data == read(local_file)
+    offsets = [call[1] for call in client.calls if call[0] == 'append']
+    assert offsets == [CHUNK_SIZE, 2 * CHUNK_SIZE, 2 * CHUNK_SIZE, 3 * CHUNK_SIZE, 4 * CHUNK_SIZE]
+    assert [call[0] for call in client.calls].count('start') == 1
+
+
+def test_lost_response_continues_from_offset_reported_by_dropbox(local_file):
+    client = FakeDropboxClient(fail_appends=[2], lose_response=True)
+    metadata = upload_file_chunked(client, local_file, '/products.db.gz', chunk_size=CHUNK_SIZE, retry_delay=0)
+
+    assert metadata.data == read(local_file)
+    offsets = [call[1] for call in client.calls if call[0] == 'append']
+    # Gentagelsen ved 2 KB afvises med incorrect_offset, og uploaden fortsætter fra 3 KB
+    assert offsets == [CHUNK_SIZE, 2 * CHUNK_SIZE, 2 * CHUNK_SIZE, 3 * CHUNK_SIZE, 4 * CHUNK_SIZE]
+
+
+def test_interrupted_upload_resumes_after_restart(tmp_path, local_file):
+    state_path = str(tmp_path / "upload_session.json")
+    client = FakeDropboxClient(fail_appends=[3])
+    with pytest.raises(requests.exceptions.ConnectionError):
+        upload_file_chunked(client, local_file, '/products.db.gz', chunk_size=CHUNK_SIZE,
+                            max_retries=0, resume_state_path=state_path)
+    assert os.path.exists(state_path)
+
+    client.calls.clear()
+    metadata = upload_file_chunked(client, local_file, '/products.db.gz', chunk_size=CHUNK_SIZE,
+                                   resume_state_path=state_path)
+    assert metadata.data == read(local_file)
+    assert client.calls[0] == ('append', 3 * CHUNK_SIZE, CHUNK_SIZE)
+    assert 'start' not in [call[0] for call in client.calls]
+    assert not os.path.exists(state_path)
+
+
+@pytest.mark.parametrize("size", [100, CHUNK_SIZE * 3 + 1], ids=["single-call", "upload-session"])
+def test_upload_if_changed_detects_remote_changes(tmp_path, size):
+    client = FakeDropboxClient()
+    backend = DropboxBackend(client)
+    local_path = str(tmp_path / "products.db.gz")
+    state_path = str(tmp_path / "sync_state.json")
+    with open(local_path, 'wb') as f:
+        f.write(os.urandom(size))
+
+    uploaded, metadata = upload_if_changed(backend, local_path, '/products.db.gz', state_path, chunk_size=CHUNK_SIZE)
+    assert uploaded and metadata.content_hash == dropbox_content_hash(local_path)
+    uploaded, _ = upload_if_changed(backend, local_path, '/products.db.gz', state_path, chunk_size=CHUNK_SIZE)
+    assert not uploaded
+
+    # En anden enhed uploader en ny version, mens den lokale kopi også ændres
+    client._store(os.urandom(size), '/products.db.gz')
+    with open(local_path, 'wb') as f:
+        f.write(os.urandom(size))
+    with pytest.raises(SyncConflictError):
+        upload_if_changed(backend, local_path, '/products.db.gz', state_path, chunk_size=CHUNK_SIZE)
@@ -0,0 +1,42 @@
+import config
+from model_router import ModelRouter
+
+EASY_PAGE = "\n".join(f"12345 Produkt {i} 01.11.2026 STK" for i in range(10))
+
+
+def route(tmp_path):
+    router = ModelRouter(str(tmp_path / "routing_stats.json"))
+    decision = router.route_text(EASY_PAGE)
+    assert decision.model == router.fast_model
+    return router, decision
+
+
+def repaired_stats(raw_count, rejected, repaired, repair_model=config.AI_REPAIR_MODEL):
+    return {'raw_count': raw_count, 'initial_rejected_count': rejected, 'rejected_count': rejected - repaired,
+            'repaired_count': repaired, 'repair_model': repair_model}
+
+
+def test_repair_runs_on_the_fast_model_by_default(tmp_path):
+    router, _ = route(tmp_path)
+    assert config.AI_REPAIR_MODEL == router.fast_model
+
+
+def test_page_still_failing_after_repair_escalates(tmp_path):
+    router, decision = route(tmp_path)
+    assert router.should_escalate(decision, repaired_stats(10, rejected=6, repaired=1))
+
+
+def test_page_fixed_by_repair_does_not_escalate(tmp_path):
+    router, decision = route(tmp_path)
+    assert not router.should_escalate(decision, repaired_stats(10, rejected=6, repaired=5))
+
+
+def test_page_without_products_escalates_when_rules_see_dates(tmp_path):
+    router, decision = route(tmp_path)
+    assert router.should_escalate(decision, {'raw_count': 0, 'rejected_count': 0})
+
+
+def test_repair_on_the_strong_model_is_not_followed_by_escalation(tmp_path):
+    router, decision = route(tmp_path)
+    stats = repaired_stats(10, rejected=6, repaired=1, repair_model=router.strong_model)
+    assert not router.should_escalate(decision, stats)
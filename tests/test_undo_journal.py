@@ -0,0 +1,69 @@
+import sqlite3
+
+from undo_journal import UndoJournal, install_undo_journal, undo_group
+from conftest import product, read_products
+
+
+def run_in_group(db_path, label, sql, params=()):
+    conn = sqlite3.connect(db_path)
+    install_undo_journal(conn)
+    with undo_group(conn, label):
+        conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+
+def remarks(db_path):
+    return {row[0]: row[5] for row in read_products(db_path)}
+
+
+def test_undo_and_redo_edit_and_clear(make_products_db, open_repository):
+    db_path = make_products_db("products.db", [product(i) for i in range(50)])
+    original = read_products(db_path)
+    journal = UndoJournal(open_repository(db_path))
+
+    run_in_group(db_path, 'Rediger produkt', 'UPDATE products SET Remark=? WHERE ProductID=?', ("rettet", "7"))
+    run_in_group(db_path, 'Ryd database', 'DELETE FROM products')
+    assert read_products(db_path) == []
+    assert journal.peek_undo()['label'] == 'Ryd database'
+
+    journal.undo()
+    assert remarks(db_path)["7"] == "rettet"
+    assert len(read_products(db_path)) == 50
+    journal.undo()
+    assert read_products(db_path) == original
+    assert journal.peek_undo() is None
+    assert journal.peek_redo()['label'] == 'Rediger produkt'
+
+    journal.redo()
+    assert remarks(db_path)["7"] == "rettet"
+    journal.redo()
+    assert read_products(db_path) == []
+    assert journal.peek_redo() is None
+
+
+def test_new_action_discards_redo_history(make_products_db, open_repository):
+    db_path = make_products_db("products.db", [product(1)])
+    journal = UndoJournal(open_repository(db_path))
+    run_in_group(db_path, 'Rediger produkt', 'UPDATE products SET Remark=?', ("første",))
+    journal.undo()
+    run_in_group(db_path, 'Tilføj produkt', 'INSERT INTO products (ProductID) VALUES (?)', ("2",))
+    assert journal.peek_redo() is None
+    journal.undo()
+    assert [row[0] for row in read_products(db_path)] == ["1"]
+
+
+def test_replay_goes_through_the_repository_writer(make_products_db, open_repository):
+    db_path = make_products_db("products.db", [product(i) for i in range(3)])
+    repository = open_repository(db_path)
+    journal = UndoJournal(repository, max_groups=2)
+    for i in range(3):
+        run_in_group(db_path, f'Rediger {i}', 'UPDATE products SET Remark=? WHERE ProductID=?', ("rettet", str(i)))
+    jobs = repository.stats()['jobs']
+
+    assert journal.prune() == 1
+    journal.undo()
+    assert repository.stats()['jobs'] == jobs + 2
+    assert remarks(db_path) == {"0": "rettet", "1": "rettet", "2": ""}
+    journal.undo()
+    assert journal.peek_undo() is None
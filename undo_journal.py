@@ -0,0 +1,243 @@
+import json
+import time
+import logging
+from contextlib import contextmanager
+
+from changeset_sync import SYNCED_COLUMNS
+
+JOURNAL_COLUMNS = ["UniqueID"] + SYNCED_COLUMNS
+
+UNDO_JOURNAL_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS undo_groups (
+    group_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    label TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    undone INTEGER NOT NULL DEFAULT 0,
+    row_count INTEGER NOT NULL DEFAULT 0,
+    snapshot_id TEXT
+);
+CREATE TABLE IF NOT EXISTS undo_journal (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    group_id INTEGER NOT NULL,
+    op TEXT NOT NULL,
+    row_id INTEGER NOT NULL,
+    before_data TEXT,
+    after_data TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_undo_journal_group ON undo_journal (group_id, seq);
+'''
+
+
+def _json_image(prefix):
+    return "json_object(" + ', '.join(f"'{col}', {prefix}.\"{col}\"" for col in JOURNAL_COLUMNS) + ")"
+
+
+_CURRENT_GROUP = "(SELECT group_id FROM temp.undo_context)"
+_IN_GROUP = "EXISTS (SELECT 1 FROM temp.undo_context)"
+
+# Triggers oprettes som TEMP pr. forbindelse. Kun forbindelser der har åbnet en gruppe optager
+# ændringer, så synkronisering og andre skrivere aldrig havner i brugerens fortryd-historik.
+# Sætningerne køres enkeltvis, da executescript ville committe en igangværende transaktion
+_SESSION_SCHEMA = [
+    'CREATE TEMP TABLE IF NOT EXISTS undo_context (group_id INTEGER NOT NULL)',
+    f'''CREATE TEMP TRIGGER IF NOT EXISTS trg_products_undo_insert AFTER INSERT ON main.products
+    WHEN {_IN_GROUP}
+    BEGIN
+        INSERT INTO undo_journal (group_id, op, row_id, before_data, after_data)
+        VALUES ({_CURRENT_GROUP}, 'I', NEW.UniqueID, NULL, {_json_image('NEW')});
+    END''',
+    f'''CREATE TEMP TRIGGER IF NOT EXISTS trg_products_undo_update AFTER UPDATE ON main.products
+    WHEN {_IN_GROUP}
+    BEGIN
+        INSERT INTO undo_journal (group_id, op, row_id, before_data, after_data)
+        VALUES ({_CURRENT_GROUP}, 'U', NEW.UniqueID, {_json_image('OLD')}, {_json_image('NEW')});
+    END''',
+    f'''CREATE TEMP TRIGGER IF NOT EXISTS trg_products_undo_delete AFTER DELETE ON main.products
+    WHEN {_IN_GROUP}
+    BEGIN
+        INSERT INTO undo_journal (group_id, op, row_id, before_data, after_data)
+        VALUES ({_CURRENT_GROUP}, 'D', OLD.UniqueID, {_json_image('OLD')}, NULL);
+    END''',
+]
+
+
+def install_undo_journal(conn):
+    """Opretter journal-tabellerne i databasen. Historikken ligger i selve databasen og overlever genstart"""
+    conn.executescript(UNDO_JOURNAL_SCHEMA)
+    conn.commit()
+
+
+def _new_group(conn, label, snapshot_id=None):
+    # En ny handling gør de fortrudte handlinger ugyldige, ligesom i enhver anden redo-stak
+    conn.execute('DELETE FROM undo_journal WHERE group_id IN (SELECT group_id FROM undo_groups WHERE undone=1)')
+    conn.execute('DELETE FROM undo_groups WHERE undone=1')
+    cursor = conn.execute('INSERT INTO undo_groups (label, created_at, snapshot_id) VALUES (?, ?, ?)',
+                          (label, time.time(), snapshot_id))
+    return cursor.lastrowid
+
+
+def begin_group(conn, label):
+    """Starter en fortryd-gruppe på forbindelsen. Alle ændringer af products indtil end_group() fortrydes samlet"""
+    for statement in _SESSION_SCHEMA:
+        conn.execute(statement)
+    group_id = _new_group(conn, label)
+    conn.execute('DELETE FROM temp.undo_context')
+    conn.execute('INSERT INTO temp.undo_context (group_id) VALUES (?)', (group_id,))
+    return group_id
+
+
+def end_group(conn):
+    """Afslutter den aktive gruppe. Kaldes før commit, så gruppen og ændringerne gemmes i samme transaktion"""
+    row = conn.execute('SELECT group_id FROM temp.undo_context').fetchone()
+    if row is None:
+        return
+    conn.execute('DELETE FROM temp.undo_context')
+    conn.execute('UPDATE undo_groups SET row_count = (SELECT COUNT(*) FROM undo_journal WHERE group_id=?) '
+                 'WHERE group_id=?', (row[0], row[0]))
+
+
+@contextmanager
+def undo_group(conn, label):
+    begin_group(conn, label)
+    try:
+        yield
+    finally:
+        end_group(conn)
+
+
+def record_snapshot_group(conn, label, snapshot_id):
+    """Registrerer en handling der erstattede hele databasefilen. Den fortrydes ved at gendanne snapshottet"""
+    group_id = _new_group(conn, label, snapshot_id)
+    conn.commit()
+    return group_id
+
+
+def reset_journal(conn):
+    """Tømmer historikken, fx efter en download hvor databasen kommer fra en anden enhed"""
+    conn.execute('DELETE FROM undo_journal')
+    conn.execute('DELETE FROM undo_groups')
+    conn.commit()
+
+
+class UndoJournal:
+    """Fortryd og gentag ud fra journalen som triggerne fylder.
+
+    Hver brugerhandling er én gruppe med før- og efterbilleder af de rækker den ændrede, så fortryd og
+    gentag tager tid proportionalt med antallet af ændrede rækker. Historikken begrænses til max_groups
+    grupper og max_rows journalrækker; den nyeste gruppe beholdes altid. Alle skrivninger går gennem
+    repositoriets skrivertråd, og tabellerne oprettes af ProductRepository.create_schema.
+    """
+
+    def __init__(self, repository, max_groups=100, max_rows=50000):
+        self.repository = repository
+        self.max_groups = max_groups
+        self.max_rows = max_rows
+
+    def _group(self, conn, undone):
+        order = 'ASC' if undone else 'DESC'
+        row = conn.execute(f'SELECT group_id, label, created_at, row_count, snapshot_id FROM undo_groups '
+                           f'WHERE undone=? ORDER BY group_id {order} LIMIT 1', (1 if undone else 0,)).fetchone()
+        if row is None:
+            return None
+        return {'group_id': row[0], 'label': row[1], 'created_at': row[2], 'row_count': row[3], 'snapshot_id': row[4]}
+
+    def peek_undo(self):
+        """Den handling fortryd vil ramme, eller None"""
+        return self.repository.read(lambda conn: self._group(conn, undone=False))
+
+    def peek_redo(self):
+        return self.repository.read(lambda conn: self._group(conn, undone=True))
+
+    def _apply_images(self, conn, op, batch):
+        """Skriver en række billeder af samme slags med én executemany. batch er (row_id, image)-par"""
+        if op == 'delete':
+            conn.executemany('DELETE FROM products WHERE UniqueID=?', [(row_id,) for row_id, _ in batch])
+            return
+        images = [(row_id, json.loads(image)) for row_id, image in batch]
+        if op == 'insert':
+            # Stigende UniqueID indsætter sidst i B-træet i stedet for forrest
+            images.sort(key=lambda item: item[0])
+            column_names = ', '.join(f'"{col}"' for col in JOURNAL_COLUMNS)
+            placeholders = ', '.join('?' for _ in JOURNAL_COLUMNS)
+            conn.executemany(f'INSERT OR REPLACE INTO products ({column_names}) VALUES ({placeholders})',
+                             [tuple(data.get(col) for col in JOURNAL_COLUMNS) for _, data in images])
+        else:
+            assignments = ', '.join(f'"{col}"=?' for col in SYNCED_COLUMNS)
+            conn.executemany(f'UPDATE products SET {assignments} WHERE UniqueID=?',
+                             [tuple(data.get(col) for col in SYNCED_COLUMNS) + (row_id,) for row_id, data in images])
+
+    def _replay_group(self, conn, undo):
+        """Skriverjob: afspiller den næste gruppe. Returnerer (gruppe, antal journalrækker)"""
+        group = self._group(conn, undone=not undo)
+        if group is None or group['snapshot_id']:
+            return group, 0
+        order = 'DESC' if undo else 'ASC'
+        entries = conn.execute(f'SELECT op, row_id, before_data, after_data FROM undo_journal '
+                               f'WHERE group_id=? ORDER BY seq {order}', (group['group_id'],)).fetchall()
+        # Indsættelse fortrydes med sletning og omvendt; opdatering skriver førbilledet tilbage
+        actions = {'I': 'delete', 'D': 'insert', 'U': 'update'} if undo else \
+            {'I': 'insert', 'D': 'delete', 'U': 'update'}
+        batch_action = None
+        batch = []
+        for op, row_id, before_data, after_data in entries:
+            action = actions[op]
+            if action != batch_action and batch:
+                self._apply_images(conn, batch_action, batch)
+                batch = []
+            batch_action = action
+            batch.append((row_id, before_data if undo else after_data))
+        if batch:
+            self._apply_images(conn, batch_action, batch)
+        conn.execute('UPDATE undo_groups SET undone=? WHERE group_id=?', (1 if undo else 0, group['group_id']))
+        return group, len(entries)
+
+    def _replay(self, undo):
+        start_time = time.perf_counter()
+        # Skriveren kører jobbet i én transaktion, som rulles tilbage hvis afspilningen fejler
+        group, entry_count = self.repository.write(lambda conn: self._replay_group(conn, undo))
+        if group is not None and not group['snapshot_id']:
+            logging.info(f"{'Fortrudt' if undo else 'Gentaget'}: {group['label']} "
+                         f"({entry_count} rækker på {time.perf_counter() - start_time:.3f} sekunder)")
+        return group
+
+    def undo(self):
+        """Fortryder den seneste gruppe og returnerer den.
+
+        Grupper der erstattede hele filen (snapshot_id sat) afspilles ikke; dem gendanner kalderen fra backup.
+        """
+        return self._replay(undo=True)
+
+    def redo(self):
+        return self._replay(undo=False)
+
+    def discard(self, group_id):
+        """Fjerner en gruppe der ikke længere kan fortrydes, fx fordi dens backup er slettet"""
+        def remove(conn):
+            conn.execute('DELETE FROM undo_journal WHERE group_id=?', (group_id,))
+            conn.execute('DELETE FROM undo_groups WHERE group_id=?', (group_id,))
+        self.repository.write(remove)
+
+    def _prune_limit(self, conn):
+        """(antal grupper der skal fjernes, ældste gruppe der beholdes)"""
+        groups = conn.execute('SELECT group_id, row_count FROM undo_groups ORDER BY group_id DESC').fetchall()
+        total_rows = 0
+        removed = []
+        for position, (group_id, row_count) in enumerate(groups):
+            total_rows += row_count
+            if position > 0 and (position >= self.max_groups or total_rows > self.max_rows):
+                removed.append(group_id)
+        if not removed:
+            return 0, None
+        return len(removed), min(group_id for group_id, _ in groups if group_id not in removed)
+
+    def prune(self):
+        """Sletter de ældste grupper ud over max_groups og max_rows"""
+        # Grænsen findes på en læseforbindelse, så skriveren kun bruges når der er noget at slette
+        removed, oldest_kept = self.repository.read(self._prune_limit)
+        if removed:
+            def delete(conn):
+                conn.execute('DELETE FROM undo_journal WHERE group_id < ?', (oldest_kept,))
+                conn.execute('DELETE FROM undo_groups WHERE group_id < ?', (oldest_kept,))
+            self.repository.write(delete)
+            logging.info(f"Fortryd-historik beskåret: {removed} ældste handlinger fjernet")
+        return removed